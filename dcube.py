@@ -9,6 +9,11 @@
 ## $ python dcube.py [-h] -db DBNAME -user USERNAME -port PORT
 ##            -in INFILE -K K -N N [-outdir OUTDIR] 
 ##            [-dmeasure DMEASURE] [-policy POLICY] [-opt OPTMETHOD]
+##            [-rm RMMETHOD] [-bmass BMASS] [-agg AGG] [-encode]
+##            [-storage STORAGE] [-tune PROFILE] [-loader LOADER] [-workers W]
+##            [-trace TRACEFILE] [-pg_profile] [-tensor NAME] [-append] [-warm_start]
+##            [-schema S] [-window SIZE] [-slide SLIDE] [-time_dim T] [-time_type TYPE]
+##            [-output OUTPUT] [-format FORMAT] [-resume]
 ##
 ## optional arguments:
 ##  -h, --help            show this help message and exit
@@ -17,7 +22,9 @@
 ##  -port, --port         the database port number; default is 5432
 ##  -in, --file_name      Full path to the .csv file to load from. The file should have
 ##                        N+1 columns, where the first N columns are N attributes,
-##                        and the last column is the mass
+##                        and the last column is the mass. It may be compressed (.csv.gz,
+##                        .csv.zst), or be a pre-encoded tensor (a directory of .npy
+##                        arrays or a .npz file, see dcube_loader.py)
 ##  -K, --K               number of dense blocks to detect
 ##  -N, --N               number of dimensions of the tensor
 ##  -outdir, --outdir     output directory; the results will be saved under this directory
@@ -26,8 +33,67 @@
 ##                        or 'suspicious'; default is 'arithmetic'
 ##  -policy, --policy     dimension selection policy, either 'density' or 'cardinality';
 ##                        default is 'density'
-##  -opt, --opt           optimization method, either 'copy' or 'mark';
-##                        default is 'copy', which is in general more efficient
+##  -opt, --opt           optimization method, one of 'copy', 'mark', 'plpgsql' or 'numpy';
+##                        default is 'copy', which is in general more efficient;
+##                        'plpgsql' finds each block with one stored procedure call;
+##                        'numpy' runs in memory and requires NumPy
+##  -rm, --rm             removal strategy of the 'copy' and 'mark' implementations,
+##                        either 'row' (one value at a time) or 'batch' (one set-based
+##                        pass per dimension); default is 'row'
+##  -bmass, --bmass       how the 'copy' and 'mark' implementations maintain the mass of
+##                        each value after a pass, either 'recompute' or 'delta'
+##                        (subtract the removed entries); default is 'recompute'
+##  -agg, --agg           how the 'copy' and 'mark' implementations compute the mass of
+##                        each value, either 'dimension' (one query per dimension) or
+##                        'grouping' (one GROUPING SETS query); default is 'dimension'
+##  -encode, --encode     encode the values of each dimension as integers before running
+##                        the 'copy' or 'plpgsql' implementation
+##  -storage, --storage   kind of the loaded and working relations, one of 'logged',
+##                        'unlogged' or 'temp'; default is 'logged'
+##  -tune, --tune         tuning profile of the database session, 'none' or 'fast';
+##                        default is 'none'
+##  -loader, --loader     how to load the input file, either 'copy' or 'parallel' (parse
+##                        and merge duplicate entries in a process pool, and load them
+##                        with binary COPY through several connections); default 'copy'
+##  -workers, --workers   number of processes of the 'parallel' loader
+##  -trace, --trace       a .json file to write the time, statements and rows of each
+##                        phase, for each block and pass; a summary is printed
+##  -pg_profile, --pg-profile
+##                        capture EXPLAIN (ANALYZE, BUFFERS) of the first execution of
+##                        each statement shape, and the table statistics of each phase,
+##                        in OUTDIR/<prefix>_pg_profile.json
+##  -tensor, --tensor     name of the tensor in the catalog (the schema dcube_catalog),
+##                        which is kept with the content hash of its file and only loaded
+##                        again if -in is new or changed; without -in, it is used as it is
+##  -append, --append     keep the loaded relation across runs and merge the input file
+##                        into it (masses of existing entries are summed); the distinct
+##                        values and total mass are kept too, instead of recomputed, but
+##                        the blocks are searched from scratch in all the entries
+##  -warm_start, --warm-start
+##                        with -append and -opt copy, search each block first among the
+##                        entries of the same block of the previous run and of the
+##                        appended values, and keep it if it is at least as dense as
+##                        before; the blocks may then differ from a search from scratch
+##  -schema, --schema     the schema in which the relations of the run are created, so
+##                        that runs in different schemas can share the database;
+##                        default is 'public' (see also dcube_jobs.py)
+##  -window, --window     length of a window sliding over the time dimension; the blocks
+##                        of the i-th window go to OUTDIR/<prefix>_w<i>_block<k>.csv
+##  -slide, --slide       distance between consecutive windows; default is -window
+##  -time_dim, --time_dim the index of the time dimension; default is the last one
+##  -time_type, --time_type
+##                        'number' or 'timestamp' (-window and -slide in seconds)
+##  -output, --output     'tuples' to write the entries of each block, or 'summary' to
+##                        write only its values (<prefix>_block<k>_values.csv) and its
+##                        entries, mass, density and cardinalities (<prefix>_summary.csv);
+##                        default is 'tuples'
+##  -format, --format     format of the block files, one of 'csv', 'csv.gz', 'csv.zst'
+##                        (needs zstandard), 'binary' (binary COPY) or 'columnar'
+##                        (dictionary-encoded dimensions, in Parquet with pyarrow or else
+##                        in .npz); <prefix>_manifest.json lists the files; default 'csv'
+##  -resume, --resume     commit the loaded tensor and the working relations after each
+##                        block; if the same command was interrupted, it then resumes
+##                        after the last block it found instead of starting over
 ##  -data, --data         default is 'custom', where user specifies the above parameters;
 ##                        in addition, the script provides special settings for 5 datasets:
 ##                        'darpa', 'wiki', 'amazon', 'yelp', 'airforce',
@@ -38,12 +104,24 @@
 import argparse, os, sys
 from dcube_sql_mark import *
 from dcube_sql_copy import *
+from dcube_sql_plpgsql import *
+from dcube_loader import (load_tensor_file, append_tensor, tensor_name, open_tensor_file,
+                        is_tensor_arrays, read_tensor_arrays, load_tensor_arrays)
+from dcube_trace import TracingCursor, ProfilingCursor
+from dcube_window import iter_windows
+from dcube_output import OUT_FORMATS
+from dcube_catalog import (CATALOG_SCHEMA, TENSOR_NAME, catalog_relation, lookup_tensor,
+                        register_tensor)
+from dcube_checkpoint import init_checkpoint, find_checkpoint, drop_checkpoint
 
 def dcube(data_table, col_names, X_name, K, N, cur, 
             dmeasure="arithmetic", policy="cardinality", 
             outdir="out/", out_prefix="out",
             opt="copy", verbose=True,
-            para_index=True, r_index=-1, b_index=2, Bn_index=True):
+            para_index=True, r_index=-1, b_index=2, Bn_index=True,
+            rm_batch=False, sync_params=False, encode_values=False, delta_Bmass=False,
+            grouping_sets=False, storage="logged", persistent=False, output="tuples",
+            out_format="csv", tensor=None, checkpoint=False, warm_start=False):
     """
     D-Cube algorithm. Find K dense blocks in a given tensor.
     Args:
@@ -59,43 +137,182 @@ def dcube(data_table, col_names, X_name, K, N, cur,
         policy: "cardinality" or "density"
         outdir: output directory
         out_prefix: prefix of the output results
-        opt: optimization method: "copy" or "mark"
+        opt: optimization method: "copy" or "mark" or "plpgsql" or "numpy"
         para_index: whether to create a hash index for parameters
         r_index: create an index for the i-th attribute in data_table
         b_index: create an index for the i-th attribute in Btable
         Bn_index: whether to create index on Bn
+        rm_batch: whether to remove the values of each dimension in one set-based pass
+        sync_params: whether the 'copy' and 'mark' implementations write their in-memory
+                parameters back to the relation "parameters" after each pass, for debugging
+        encode_values: whether the 'copy' and 'plpgsql' implementations work on int4 codes
+                of the values, which are decoded only when a block is saved
+        delta_Bmass: whether the 'copy' and 'mark' implementations update the mass of Bn
+                by subtracting the removed entries, instead of re-computing it after each pass
+        grouping_sets: whether the 'copy' and 'mark' implementations compute the mass of
+                all Bn with a single GROUPING SETS query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        persistent: whether data_table is kept across runs by append_tensor, with the
+                distinct values of each dimension and the total mass in <data_table>_R<n>
+                and <data_table>_stats, which the SQL implementations then read
+        output: "tuples" or "summary", whether the SQL implementations save the entries of
+                each block, or only its values, mass, density and cardinalities, without
+                joining the block with data_table
+        out_format: the format of the block files, one of OUT_FORMATS in dcube_output.py;
+                "binary" is only written by the SQL implementations
+        tensor: the pre-encoded tensor (values, codes, mass), which the 'numpy'
+                implementation then uses instead of reading data_table
+        checkpoint: whether the SQL implementations commit their working relations after
+                each block, and resume after the last checkpoint (see dcube_checkpoint.py)
+        warm_start: whether the 'copy' implementation searches each block first among
+                the entries of the same block of the previous run on the persistent
+                data_table and of the values appended since (see find_warm_block)
     """
     if opt == "mark":
         # print "\tUsing 'Mark' implementation."
         dcube_mark(data_table, col_names, X_name, K, N, cur, 
             dmeasure, policy, outdir, out_prefix,
-            verbose, para_index, r_index, b_index, Bn_index)
+            verbose, para_index, r_index, b_index, Bn_index, rm_batch, sync_params,
+            delta_Bmass, grouping_sets, storage, persistent, output,
+            out_format, checkpoint)
     elif opt == "copy":
         # print "\tUsing 'Copy' implementation."
         dcube_copy(data_table, col_names, X_name, K, N, cur, 
             dmeasure, policy, outdir, out_prefix,
-            verbose, para_index, r_index, b_index, Bn_index)
+            verbose, para_index, r_index, b_index, Bn_index, rm_batch, sync_params,
+            encode_values, delta_Bmass, grouping_sets, storage, persistent, output,
+            out_format, checkpoint, warm_start)
+    elif opt == "plpgsql":
+        # print "\tUsing server-side 'PL/pgSQL' implementation."
+        dcube_plpgsql(data_table, col_names, X_name, K, N, cur, 
+            dmeasure, policy, outdir, out_prefix,
+            verbose, para_index, r_index, b_index, Bn_index, encode_values, storage,
+            persistent, output, out_format, checkpoint)
+    elif opt == "numpy":
+        # print "\tUsing in-memory 'NumPy' implementation."
+        ## NumPy is only needed for this implementation
+        from dcube_numpy import dcube_numpy
+        dcube_numpy(data_table, col_names, X_name, K, N, cur,
+            dmeasure, policy, outdir, out_prefix, verbose, out_format, tensor)
+    else:
+        print "ERROR: -opt must be one of 'mark', 'copy', 'plpgsql' or 'numpy'."
+
+
+def iter_dense_blocks(data_table, col_names, X_name, K, N, cur, 
+            dmeasure="arithmetic", policy="cardinality", 
+            outdir=None, out_prefix="out",
+            opt="copy", verbose=False,
+            para_index=True, r_index=-1, b_index=2, Bn_index=True,
+            rm_batch=False, sync_params=False, encode_values=False, delta_Bmass=False,
+            grouping_sets=False, storage="logged", persistent=False):
+    """
+    D-Cube algorithm as a generator. Each block is yielded as a DenseBlock as soon as
+    it is found, before the next one is searched for:
+
+        for block in iter_dense_blocks("test_data", ["D0", "D1", "D2"], "measure", 3, 3, cur):
+            print block.values, block.mass, block.density
+            for entry in block.tuples():
+                ...
+
+    The entries of a block can only be read until the next block is requested.
+    Closing the generator early (e.g. with break) drops the working tables.
+    Args:
+        the arguments of dcube(), except that:
+        outdir: output directory; by default None, and the blocks are not written to files
+        opt: optimization method: "copy" or "mark" or "plpgsql"
+    """
+    if opt == "mark":
+        blocks = iter_blocks_mark(data_table, col_names, X_name, K, N, cur, 
+            dmeasure, policy, outdir, out_prefix,
+            verbose, para_index, r_index, b_index, Bn_index, rm_batch, sync_params,
+            delta_Bmass, grouping_sets, storage, persistent)
+        ## the values are not encoded
+        encode_values = False
+    elif opt == "copy":
+        blocks = iter_blocks_copy(data_table, col_names, X_name, K, N, cur, 
+            dmeasure, policy, outdir, out_prefix,
+            verbose, para_index, r_index, b_index, Bn_index, rm_batch, sync_params,
+            encode_values, delta_Bmass, grouping_sets, storage, persistent)
+    elif opt == "plpgsql":
+        blocks = iter_blocks_plpgsql(data_table, col_names, X_name, K, N, cur, 
+            dmeasure, policy, outdir, out_prefix,
+            verbose, para_index, r_index, b_index, Bn_index, encode_values, storage,
+            persistent)
     else:
-        print "ERROR: -opt must be either 'mark' or 'copy'."
+        raise ValueError("opt must be one of 'mark', 'copy' or 'plpgsql'.")
+
+    try:
+        for (k, params) in blocks:
+            set_phase(cur, "yield_block")
+            yield fetch_dense_block(k, col_names, X_name, N, cur, dmeasure,
+                                    params, encode_values)
+    finally:
+        blocks.close()
 
 
 
 def dcube_custom(dbname, user, port, file_name, K, N, sep=",",
-                dmeasure="arithmetic", policy="density", outdir="out/", opt="copy"):
+                dmeasure="arithmetic", policy="density", outdir="out/", opt="copy",
+                rm_batch=False, encode_values=False, delta_Bmass=False,
+                grouping_sets=False, storage="logged", profile="none",
+                loader="copy", workers=None, trace=None, pg_profile=False, append=False,
+                window=None, slide=None, time_dim=-1, time_type="number", output="tuples",
+                out_format="csv", catalog=None, schema=None, conn=None, resume=False,
+                warm_start=False):
     """
     Dense subtensor mining using D-cube.
     Args:
         dbname: an existing database name
         user: user
         port: port number
-        file_name: .csv file to load data
+        file_name: .csv file to load data, which may be compressed (.gz or .zst), or a
+                pre-encoded tensor (a directory of .npy arrays or a .npz file, see
+                read_tensor_arrays in dcube_loader.py)
         K: number of blocks to detect
         N: number of dimensions
         dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
         policy: "cardinality" or "density"
         outdir: output directory
         out_prefix: prefix of the output results
-        opt: optimization method: "copy" or "mark"
+        opt: optimization method: "copy" or "mark" or "plpgsql" or "numpy"
+        rm_batch: whether to remove the values of each dimension in one set-based pass
+        encode_values: whether to work on int4 codes of the values instead of the values
+        delta_Bmass: whether to update the mass of Bn by subtracting the removed entries
+        grouping_sets: whether to compute the mass of all Bn with a single query
+        storage: "logged", "unlogged" or "temp", the kind of the loaded and working relations
+        profile: "none" or "fast", the tuning profile of the database session
+        loader: "copy" to load the file with a single COPY, or "parallel" to parse it in
+                parallel and load it through several connections; duplicate entries are
+                then merged and their masses summed
+        workers: number of processes of the "parallel" loader; default is the number of CPUs
+        trace: if given, a JSON file to write the time, statements and rows of each phase
+        pg_profile: whether to write the plans of the statements and the table statistics
+                of each phase to <outdir>/<prefix>_pg_profile.json
+        append: whether to keep the loaded relation across runs and merge the file into it,
+                summing the masses of the entries which are already there; the blocks are
+                still searched in all the entries, unless warm_start
+        window: if given, the length of a window sliding over the time dimension; the blocks
+                are found in each window, and written with the prefix <prefix>_w<i>
+        slide: distance between the starts of consecutive windows; default is window
+        time_dim: the index of the time dimension; default is the last one
+        time_type: "number" or "timestamp" (measured in seconds), the values of the time
+        output: "tuples" or "summary", whether to write the entries of each block, or only
+                its values, mass, density and cardinalities
+        out_format: the format of the block files, one of OUT_FORMATS in dcube_output.py
+        catalog: if given, the name of the tensor in the catalog (see dcube_catalog.py),
+                which is kept across runs, and only loaded if file_name is new or has
+                changed; file_name may then be None to use the registered tensor
+        schema: if given, the schema in which the run creates its relations (dropped in
+                the end, unless append), so that runs in other schemas are not affected;
+                default is "public"
+        conn: an open connection to use, e.g. of a pool, instead of connecting with
+                dbname, user and port
+        resume: whether to commit the loaded tensor and the working relations after each
+                block (see dcube_checkpoint.py), and if the same run was interrupted, to
+                resume after its last checkpoint instead of starting over
+        warm_start: with append and opt "copy", whether to search each block first among
+                the entries of the same block of the previous run and of the appended
+                values, keeping it if it is at least as dense as before
     """
     ## N-way tensor + measure
     data_table = "test_data"
@@ -104,28 +321,163 @@ def dcube_custom(dbname, user, port, file_name, K, N, sep=",",
     X_name = "measure" ## name for measure attribute
     X_fmt = "double precision" ## type for measure attribute
 
-    ## Connect to the database
-    DSN = "dbname=%s user=%s port=%s host='/tmp/'" % (dbname, user, port)
-    with psycopg2.connect(DSN) as conn:
+    ## an interrupted run with checkpoints resumes after the last one
+    setting = {"file_name": file_name, "K": K, "N": N, "dmeasure": dmeasure,
+            "policy": policy, "opt": opt, "rm_batch": rm_batch,
+            "encode_values": encode_values, "delta_Bmass": delta_Bmass,
+            "grouping_sets": grouping_sets, "storage": storage, "append": append,
+            "catalog": catalog, "output": output, "out_format": out_format,
+            "outdir": outdir, "warm_start": warm_start}
+    DSN = database_dsn(dbname, user, port, schema)
+
+    ## the .csv file is loaded by run_dcube, unless the run is resumed or reuses a tensor
+    def load(cur, load_table):
+        if loader == "parallel":
+            load_tensor_file(DSN, cur, file_name, load_table, col_names, X_name, sep,
+                            count=False, workers=workers, storage=storage)
+        else:
+            cur.execute(create_table(storage) + " %s (%s, %s %s);" % 
+                        (load_table, ",".join(columns), X_name, X_fmt))
+            with open_tensor_file(file_name) as fin:
+                cur.copy_from(fin, load_table, sep=sep)
+
+    run_dcube(DSN, conn, load, data_table, col_names, X_name, X_fmt, K, N, setting,
+            "Performing D-Cube...", file_name, dmeasure=dmeasure, policy=policy,
+            outdir=outdir, opt=opt, rm_batch=rm_batch, encode_values=encode_values,
+            delta_Bmass=delta_Bmass, grouping_sets=grouping_sets, storage=storage,
+            profile=profile, trace=trace, pg_profile=pg_profile, append=append,
+            window=window, slide=slide, time_dim=time_dim, time_type=time_type,
+            output=output, out_format=out_format, catalog=catalog, schema=schema,
+            resume=resume, warm_start=warm_start)
+
+
+def run_dcube(DSN, conn, load, data_table, col_names, X_name, X_fmt, K, N, setting,
+            message, file_name, dmeasure="arithmetic", policy="density", b_index=2,
+            outdir="out/", opt="copy", rm_batch=False, encode_values=False,
+            delta_Bmass=False, grouping_sets=False, storage="logged", profile="none",
+            trace=None, pg_profile=False, append=False, window=None, slide=None,
+            time_dim=-1, time_type="number", output="tuples", out_format="csv",
+            catalog=None, schema=None, resume=False, warm_start=False):
+    """
+    The run of dcube_custom and dcube_realdata: resume after a checkpoint, or find the
+    tensor in the catalog, or load the file (merging it into the kept relation with
+    append), then run D-Cube on the tensor or on each window, and clean up.
+    Args:
+        DSN: the connection string of the database, with the schema of the run
+        conn: an open connection to use instead of connecting with DSN, or None
+        load: function (cur, load_table) loading file_name, a .csv file, into the
+                relation load_table, with the N columns and the measure attribute
+        data_table: name of the relation of the tensor
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        X_fmt: the type of the measure attribute
+        K: number of blocks to detect
+        N: number of dimensions
+        setting: the setting of the run, which a checkpoint must match to be resumed
+        message: printed before D-Cube is performed
+        file_name: the input file, or None to use the tensor of the catalog
+        b_index: create an index for the i-th attribute in Btable
+        time_dim: the index of the time dimension
+        the other arguments are the keyword arguments of dcube_custom(), which the
+        callers pass by name
+    """
+    ## only a relation kept with append keeps the blocks for the warm start
+    warm_start = warm_start and append and catalog is None and window is None
+    with (conn or psycopg2.connect(DSN)) as conn:
         with conn.cursor() as cur:
-            ## drop existing tables in database
-            cur.execute("DROP SCHEMA public CASCADE;")
-            cur.execute("CREATE SCHEMA public;")
-
-            ## load data from file
-            print ("Loading data from %s..." % file_name)
-            cur.execute("CREATE TABLE %s (%s, %s %s);" % (data_table, ",".join(columns), X_name, X_fmt))
-            with open(file_name, mode="rt") as fin:
-                cur.copy_from(fin, data_table, sep=sep)
-
-            ## D-CUBE
-            print "Performing D-Cube..."
-            file_prefix=(file_name.rsplit("/")[len(file_name.rsplit("/"))-1]).split(".csv")[0]
-            dcube(data_table, col_names, X_name, K, N, cur, dmeasure, policy,
-                outdir=outdir, out_prefix=file_prefix, verbose=False, opt=opt)
+            if pg_profile:
+                cur = ProfilingCursor(cur)
+            elif trace is not None:
+                cur = TracingCursor(cur)
+            set_tuning_profile(cur, profile)
+            n_done = None
+            if resume:
+                reset_schema(cur, schema, keep=True)
+                n_done = find_checkpoint(cur, setting)
+            if n_done is not None:
+                if catalog is not None:
+                    data_table = catalog_relation(catalog)
+            elif append and catalog is None:
+                ## the new entries are loaded aside and merged into the kept relation
+                load_table = data_table + "_delta"
+                reset_schema(cur, schema, keep=True)
+                if find_checkpoint(cur) is not None:
+                    raise ValueError("the kept relation has the checkpoint of an "
+                                    + "interrupted run, which must be resumed first.")
+                cur.execute("DROP TABLE IF EXISTS %s;" % load_table)
+            else:
+                ## drop existing tables in the schema of the run; the catalog has its own
+                load_table = data_table if catalog is None else data_table + "_delta"
+                reset_schema(cur, schema)
+            reuse = n_done is not None
+            if catalog is not None and not reuse:
+                ## a tensor of the catalog is only loaded if its file is new or changed
+                (data_table, reuse, digest) = lookup_tensor(cur, catalog, file_name,
+                                                            col_names, append)
+
+            ## load data from file; the 'numpy' implementation reads a pre-encoded
+            ## tensor as it is, unless it is kept or windowed in the database
+            set_phase(cur, "load")
+            tensor = None
+            if n_done is not None:
+                print ("Resuming from the checkpoint after %d blocks..." % n_done)
+            elif reuse:
+                print ("Using tensor '%s' of the catalog..." % catalog)
+            else:
+                print ("Loading data from %s..." % file_name)
+                if (is_tensor_arrays(file_name) and opt == "numpy" and not append
+                        and catalog is None and window is None):
+                    tensor = read_tensor_arrays(file_name, col_names, X_name)
+                elif is_tensor_arrays(file_name):
+                    load_tensor_arrays(cur, file_name, load_table, col_names, X_name, storage)
+                else:
+                    load(cur, load_table)
+            if (append or catalog is not None) and not reuse:
+                (n_new, n_entries) = append_tensor(cur, load_table, data_table, col_names,
+                                                X_name, X_fmt, storage, warm_start)
+                print ("%d new entries are appended; the tensor has %d entries." % 
+                        (n_new, n_entries))
+                if catalog is not None:
+                    register_tensor(cur, catalog, file_name, digest, col_names, X_name)
+            if resume and n_done is None:
+                ## the loaded tensor is kept from now on
+                init_checkpoint(cur, setting, storage)
+                conn.commit()
+
+            ## D-CUBE, on the whole tensor or on each window
+            print message
+            file_prefix = tensor_name(file_name) if file_name is not None else catalog
+            if window is None:
+                runs = [(data_table, file_prefix, append or catalog is not None)]
+            else:
+                runs = ((win, "%s_w%d" % (file_prefix, i+1), True) for (i, win) in 
+                        iter_windows(data_table, col_names, X_name, cur, time_dim, window,
+                                    slide or window, time_type, storage))
+            for (run_table, run_prefix, persistent) in runs:
+                dcube(run_table, col_names, X_name, K, N, cur, dmeasure, policy,
+                    outdir=outdir, out_prefix=run_prefix, verbose=False, opt=opt,
+                    b_index=b_index, rm_batch=rm_batch, encode_values=encode_values,
+                    delta_Bmass=delta_Bmass, grouping_sets=grouping_sets, storage=storage,
+                    persistent=persistent, output=output, out_format=out_format,
+                    tensor=tensor, checkpoint=resume, warm_start=warm_start)
 
             ## clean up
-            cur.execute("DROP TABLE %s;" % data_table)
+            if resume:
+                drop_checkpoint(cur)
+            if not append and tensor is None and catalog is None:
+                cur.execute("DROP TABLE %s;" % data_table)
+            if not append and schema is not None:
+                cur.execute("DROP SCHEMA %s CASCADE;" % schema)
+
+            if trace is not None:
+                cur.write_trace(trace)
+                print ("Trace is written to file '%s'." % trace)
+                cur.print_summary()
+            if pg_profile:
+                profile_file = os.path.join(outdir, file_prefix + "_pg_profile.json")
+                cur.write_profile(profile_file)
+                print ("Profile is written to file '%s'." % profile_file)
+                cur.print_profile()
 
 
 def info_realdata(data="darpa"):
@@ -169,21 +521,65 @@ def info_realdata(data="darpa"):
 
 
 def dcube_realdata(dbname, user, port, file_name, K, data="darpa", 
-            sep=",", outdir="out/", opt="copy"):
+            sep=",", outdir="out/", opt="copy", rm_batch=False, encode_values=False,
+            delta_Bmass=False, grouping_sets=False, storage="logged", profile="none",
+            loader="copy", workers=None, trace=None, pg_profile=False, append=False,
+            window=None, slide=None, time_type="number", output="tuples",
+            out_format="csv", catalog=None, schema=None, conn=None, resume=False,
+            warm_start=False):
     """
     Dense subtensor mining using D-cube.
     Args:
         dbname: an existing database name
         user: user
         port: port number
-        file_name: .csv file to load data
+        file_name: .csv file to load data, which may be compressed (.gz or .zst), or a
+                pre-encoded tensor (a directory of .npy arrays or a .npz file, see
+                read_tensor_arrays in dcube_loader.py)
         sep: delimiter for the input file; "," for .csv
         K: number of blocks to detect
         N: number of dimensions
         data: name of the real dataset
         outdir: output directory
         out_prefix: prefix of the output results
-        opt: optimization method: "copy" or "mark"
+        opt: optimization method: "copy" or "mark" or "plpgsql" or "numpy"
+        rm_batch: whether to remove the values of each dimension in one set-based pass
+        encode_values: whether to work on int4 codes of the values instead of the values
+        delta_Bmass: whether to update the mass of Bn by subtracting the removed entries
+        grouping_sets: whether to compute the mass of all Bn with a single query
+        storage: "logged", "unlogged" or "temp", the kind of the loaded and working relations
+        profile: "none" or "fast", the tuning profile of the database session
+        loader: "copy" to load the file with a single COPY and count the entries in SQL,
+                or "parallel" to parse and count them in parallel and load the counts
+                through several connections
+        workers: number of processes of the "parallel" loader; default is the number of CPUs
+        trace: if given, a JSON file to write the time, statements and rows of each phase
+        pg_profile: whether to write the plans of the statements and the table statistics
+                of each phase to <outdir>/<prefix>_pg_profile.json
+        append: whether to keep the loaded relation across runs and merge the file into it,
+                summing the masses of the entries which are already there; the blocks are
+                still searched in all the entries, unless warm_start
+        window: if given, the length of a window sliding over the "time" dimension; the
+                blocks are found in each window, and written with the prefix <prefix>_w<i>
+        slide: distance between the starts of consecutive windows; default is window
+        time_type: "number" or "timestamp" (measured in seconds), the values of the time
+        output: "tuples" or "summary", whether to write the entries of each block, or only
+                its values, mass, density and cardinalities
+        out_format: the format of the block files, one of OUT_FORMATS in dcube_output.py
+        catalog: if given, the name of the tensor in the catalog (see dcube_catalog.py),
+                which is kept across runs, and only loaded if file_name is new or has
+                changed; file_name may then be None to use the registered tensor
+        schema: if given, the schema in which the run creates its relations (dropped in
+                the end, unless append), so that runs in other schemas are not affected;
+                default is "public"
+        conn: an open connection to use, e.g. of a pool, instead of connecting with
+                dbname, user and port
+        resume: whether to commit the loaded tensor and the working relations after each
+                block (see dcube_checkpoint.py), and if the same run was interrupted, to
+                resume after its last checkpoint instead of starting over
+        warm_start: with append and opt "copy", whether to search each block first among
+                the entries of the same block of the previous run and of the appended
+                values, keeping it if it is at least as dense as before
     """
     ## settings
     policy="density"
@@ -192,39 +588,43 @@ def dcube_realdata(dbname, user, port, file_name, K, data="darpa",
     ## columns
     columns = [col_names[i] + " varchar" for i in range(N)]
     X_name = "measure" ## name for measure attribute
-    X_fmt = "double precision" ## type for measure attribute
+    X_fmt = "bigint" ## type for measure attribute, the number of times an entry appears
 
-    ## Connect to the database
-    DSN = "dbname=%s user=%s port=%s host='/tmp/'" % (dbname, user, port)
-    with psycopg2.connect(DSN) as conn:
-        with conn.cursor() as cur:
-            ## drop existing tables in database
-            cur.execute("DROP SCHEMA public CASCADE;")
-            cur.execute("CREATE SCHEMA public;")
-
-            ## load data from file
-            print ("Loading data from %s..." % file_name)
-            cur.execute("CREATE TABLE rawData (%s);" % (",".join(columns)))
-            with open(file_name, mode="rt") as fin:
+    ## an interrupted run with checkpoints resumes after the last one
+    setting = {"file_name": file_name, "K": K, "data": data, "opt": opt,
+            "rm_batch": rm_batch, "encode_values": encode_values,
+            "delta_Bmass": delta_Bmass, "grouping_sets": grouping_sets,
+            "storage": storage, "append": append, "catalog": catalog,
+            "output": output, "out_format": out_format, "outdir": outdir,
+            "warm_start": warm_start}
+    DSN = database_dsn(dbname, user, port, schema)
+
+    ## the .csv file is loaded by run_dcube, unless the run is resumed or reuses a tensor
+    def load(cur, load_table):
+        if loader == "parallel":
+            ## the measurement is counted while parsing
+            load_tensor_file(DSN, cur, file_name, load_table, col_names, X_name, sep,
+                            count=True, workers=workers, storage=storage)
+        else:
+            cur.execute(create_table(storage) + " rawData (%s);" % (",".join(columns)))
+            with open_tensor_file(file_name) as fin:
                 cur.copy_from(fin, "rawData", sep=sep)
 
             ## compute measurement: number of times the entry appears
-            cur.execute(("CREATE TABLE %s AS " % data_table)
+            cur.execute((create_table(storage) + " %s AS " % load_table)
                 + "SELECT %s, count(*) AS %s FROM rawData GROUP BY %s;" % 
                         (",".join(col_names), X_name, ",".join(col_names)))
             cur.execute("DROP TABLE rawData;")
 
-
-            ## D-CUBE
-            print ("Performing D-Cube on data %s ..." % data)
-            file_prefix=(file_name.rsplit("/")[len(file_name.rsplit("/"))-1]).split(".csv")[0]
-
-            dcube(data_table, col_names, X_name, K, N, cur, dmeasure, policy,
-                outdir=outdir, out_prefix=file_prefix, verbose=False, opt=opt,
-                b_index=b_index)
-
-            ## clean up
-            cur.execute("DROP TABLE %s;" % data_table)
+    run_dcube(DSN, conn, load, data_table, col_names, X_name, X_fmt, K, N, setting,
+            "Performing D-Cube on data %s ..." % data, file_name, dmeasure=dmeasure,
+            policy=policy, b_index=b_index, outdir=outdir, opt=opt, rm_batch=rm_batch,
+            encode_values=encode_values, delta_Bmass=delta_Bmass,
+            grouping_sets=grouping_sets, storage=storage, profile=profile, trace=trace,
+            pg_profile=pg_profile, append=append, window=window, slide=slide,
+            time_dim=col_names.index("time") if window is not None else -1,
+            time_type=time_type, output=output, out_format=out_format, catalog=catalog,
+            schema=schema, resume=resume, warm_start=warm_start)
 
 
 if __name__ == "__main__":
@@ -235,9 +635,10 @@ if __name__ == "__main__":
         help="the database user; default is system $USER")
     parser.add_argument("-port", "--port", type=str, default="5432",
         help="the database port number; default is 5432")
-    parser.add_argument("-in", "--file_name", type=str, default="demo/demo_data.csv",
+    parser.add_argument("-in", "--file_name", type=str, default=None,
         help="""Full path to the .csv file to load from. The file should have N+1 columns,
-        where the first N columns are N attributes, and the last column is the mass""")
+        where the first N columns are N attributes, and the last column is the mass;
+        default is demo/demo_data.csv, unless -tensor is given""")
     parser.add_argument("-K", "--K", type=int, default=1,
         help="number of dense blocks to detect")
     parser.add_argument("-N", "--N", type=int, default=3,
@@ -251,8 +652,88 @@ if __name__ == "__main__":
         help="""dimension selection policy, either 'density' or 'cardinality'; 
         default is 'density'""")
     parser.add_argument("-opt", "--opt", type=str, default="copy",
-        help="""optimization method, either 'copy' or 'mark';
-        default is 'copy', which is in general more efficient""")
+        help="""optimization method, one of 'copy', 'mark', 'plpgsql' or 'numpy';
+        default is 'copy', which is in general more efficient;
+        'plpgsql' finds each block with one stored procedure call (PostgreSQL >= 11);
+        'numpy' runs in memory and requires NumPy""")
+    parser.add_argument("-rm", "--rm", type=str, default="row",
+        help="""removal strategy of the 'copy' and 'mark' implementations, either 'row'
+        (one value at a time) or 'batch' (one set-based pass per dimension);
+        default is 'row'""")
+    parser.add_argument("-bmass", "--bmass", type=str, default="recompute",
+        help="""how the 'copy' and 'mark' implementations maintain the mass of each value
+        after a pass, either 'recompute' (from the whole block) or 'delta' (subtract the
+        removed entries); default is 'recompute'""")
+    parser.add_argument("-agg", "--agg", type=str, default="dimension",
+        help="""how the 'copy' and 'mark' implementations compute the mass of each value,
+        either 'dimension' (one GROUP BY query per dimension) or 'grouping' (a single
+        GROUP BY GROUPING SETS query for all dimensions); default is 'dimension'""")
+    parser.add_argument("-storage", "--storage", type=str, default="logged",
+        help="""kind of the loaded and working relations, one of 'logged', 'unlogged'
+        (not written to the WAL) or 'temp' (temporary tables); default is 'logged'""")
+    parser.add_argument("-tune", "--tune", type=str, default="none",
+        help="""tuning profile of the database session, either 'none' or 'fast'
+        (larger work_mem, maintenance_work_mem and temp_buffers, and
+        synchronous_commit=off); default is 'none'""")
+    parser.add_argument("-loader", "--loader", type=str, default="copy",
+        help="""how to load the input file, either 'copy' (a single COPY) or 'parallel'
+        (parse and merge duplicate entries in a process pool, and load them through
+        several connections with binary COPY); default is 'copy'""")
+    parser.add_argument("-workers", "--workers", type=int, default=None,
+        help="number of processes of the 'parallel' loader; default is the number of CPUs")
+    parser.add_argument("-trace", "--trace", type=str, default=None,
+        help="""a .json file to write the wall time, SQL time, number of statements and
+        rows affected of each phase, for each block and pass; a summary is printed""")
+    parser.add_argument("-pg_profile", "--pg-profile", action="store_true",
+        help="""capture EXPLAIN (ANALYZE, BUFFERS) of the first execution of each distinct
+        statement shape, and the table statistics and temp bytes of each phase, in
+        OUTDIR/<prefix>_pg_profile.json; the statements are run twice in this mode""")
+    parser.add_argument("-tensor", "--tensor", type=str, default=None,
+        help="""name of the tensor in the catalog, which is kept in the database with
+        the content hash of its input file: it is only loaded again if -in is a new
+        or changed file, and without -in, the registered tensor is used""")
+    parser.add_argument("-append", "--append", action="store_true",
+        help="""keep the loaded relation, the distinct values of each dimension and the
+        total mass in the database, and merge the input file into them, summing the
+        masses of the entries which are already there; the blocks are still searched
+        from scratch in all the entries appended so far (see -warm_start)""")
+    parser.add_argument("-warm_start", "--warm-start", action="store_true",
+        help="""with -append and -opt copy, search each block first among the entries of
+        the same block of the previous run and of the appended values, so that the
+        search scales with them instead of the whole tensor; the block is kept if it is
+        at least as dense as before, and may then differ from a search from scratch""")
+    parser.add_argument("-schema", "--schema", type=str, default=None,
+        help="""the schema in which the relations of the run are created, and which is
+        dropped in the end, unless -append; runs in different schemas can share the
+        database; default is 'public'""")
+    parser.add_argument("-window", "--window", type=float, default=None,
+        help="""length of a window sliding over the time dimension; the blocks are found
+        in each window, and the window is updated with the entries which enter and leave
+        it; the blocks of the i-th window are written to OUTDIR/<prefix>_w<i>_block<k>.csv""")
+    parser.add_argument("-slide", "--slide", type=float, default=None,
+        help="distance between the starts of consecutive windows; default is -window")
+    parser.add_argument("-time_dim", "--time_dim", type=int, default=-1,
+        help="""the index (from 0) of the time dimension for -window; default is the last
+        one; the 'time' dimension is used for the -data datasets""")
+    parser.add_argument("-time_type", "--time_type", type=str, default="number",
+        help="""how the values of the time dimension are read, either 'number' or
+        'timestamp' (then -window and -slide are in seconds); default is 'number'""")
+    parser.add_argument("-output", "--output", type=str, default="tuples",
+        help="""'tuples' to write the entries of each block, or 'summary' to write only
+        its values, and its entries, mass, density and cardinalities, without joining the
+        block with the tensor; default is 'tuples'""")
+    parser.add_argument("-format", "--format", type=str, default="csv",
+        help="""format of the block files, one of 'csv', 'csv.gz', 'csv.zst' (needs
+        zstandard), 'binary' (binary COPY) or 'columnar' (dictionary-encoded dimensions,
+        in Parquet if pyarrow is installed, or else in .npz); the files of all the blocks
+        are listed in <prefix>_manifest.json; default is 'csv'""")
+    parser.add_argument("-resume", "--resume", action="store_true",
+        help="""commit the loaded tensor and the working relations after each block, so
+        that if the run is interrupted, running the same command again resumes after
+        the last block found instead of starting over""")
+    parser.add_argument("-encode", "--encode", action="store_true",
+        help="""encode the values of each dimension as integers before running the 'copy'
+        or 'plpgsql' implementation; the blocks are written with the original values""")
     parser.add_argument("-data", "--data", type=str, default="custom",
         help="""default is 'custom', where the user specifies all the above parameters;
         in addition, the script provides special settings for 5 datasets:
@@ -273,13 +754,120 @@ if __name__ == "__main__":
         print "-policy must be one of 'density' or 'cardinality'."
         sys.exit(1)        
 
+    if args.rm != "row" and args.rm != "batch":
+        print "-rm must be one of 'row' or 'batch'."
+        sys.exit(1)
+
+    if args.bmass != "recompute" and args.bmass != "delta":
+        print "-bmass must be one of 'recompute' or 'delta'."
+        sys.exit(1)
+
+    if args.agg != "dimension" and args.agg != "grouping":
+        print "-agg must be one of 'dimension' or 'grouping'."
+        sys.exit(1)
+
+    if args.storage not in ["logged", "unlogged", "temp"]:
+        print "-storage must be one of 'logged', 'unlogged' or 'temp'."
+        sys.exit(1)
+
+    if args.append and args.storage == "temp":
+        print "-append cannot keep the relations with -storage temp."
+        sys.exit(1)
+
+    if args.tensor is not None and not TENSOR_NAME.match(args.tensor):
+        print "-tensor must be a name of lowercase letters, digits and '_'."
+        sys.exit(1)
+
+    if args.tensor is not None and args.storage == "temp":
+        print "-tensor cannot keep the relations with -storage temp."
+        sys.exit(1)
+
+    if args.schema is not None and (not TENSOR_NAME.match(args.schema)
+            or args.schema.startswith("pg_") or args.schema == CATALOG_SCHEMA):
+        print ("-schema must be a name of lowercase letters, digits and '_', "
+                + "other than pg_* and %s." % CATALOG_SCHEMA)
+        sys.exit(1)
+
+    if args.file_name is None and args.tensor is None:
+        args.file_name = "demo/demo_data.csv"
+    elif args.file_name is None and args.append:
+        print "-append needs an input file -in."
+        sys.exit(1)
+
+    if args.window is not None and (args.window <= 0 or (args.slide or 1) <= 0):
+        print "-window and -slide must be positive."
+        sys.exit(1)
+
+    if args.time_type != "number" and args.time_type != "timestamp":
+        print "-time_type must be one of 'number' or 'timestamp'."
+        sys.exit(1)
+
+    if args.data == "custom" and not -args.N <= args.time_dim < args.N:
+        print "-time_dim must be the index of one of the N dimensions."
+        sys.exit(1)
+
+    if args.data in ["amazon", "yelp", "airforce"] and args.window is not None:
+        print "-window needs a 'time' dimension, as in -data darpa or wiki."
+        sys.exit(1)
+
+    if args.output != "tuples" and args.output != "summary":
+        print "-output must be one of 'tuples' or 'summary'."
+        sys.exit(1)
+
+    if args.output == "summary" and args.opt == "numpy":
+        print "-output summary is only supported by the SQL implementations."
+        sys.exit(1)
+
+    if args.format not in OUT_FORMATS:
+        print "-format must be one of 'csv', 'csv.gz', 'csv.zst', 'binary' or 'columnar'."
+        sys.exit(1)
+
+    if args.format == "binary" and args.opt == "numpy":
+        print "-format binary is only supported by the SQL implementations."
+        sys.exit(1)
+
+    if args.resume and (args.opt == "numpy" or args.window is not None
+            or args.storage == "temp"):
+        print ("-resume is only supported by the SQL implementations, "
+                + "without -window and -storage temp.")
+        sys.exit(1)
+
+    if args.warm_start and (not args.append or args.tensor is not None
+            or args.opt != "copy" or args.encode or args.window is not None):
+        print ("-warm_start is only supported with -append and -opt copy, "
+                + "without -tensor, -encode and -window.")
+        sys.exit(1)
+
+    if args.tune not in TUNING_PROFILES:
+        print "-tune must be one of 'none' or 'fast'."
+        sys.exit(1)
+
+    if args.loader != "copy" and args.loader != "parallel":
+        print "-loader must be one of 'copy' or 'parallel'."
+        sys.exit(1)
+
     ## D-cube
     if args.data == "custom":
         dcube_custom(args.dbname, args.user, args.port, args.file_name, args.K, args.N,
-                dmeasure=args.dmeasure, policy=args.policy, outdir=args.outdir, opt=args.opt)
+                dmeasure=args.dmeasure, policy=args.policy, outdir=args.outdir, opt=args.opt,
+                rm_batch=(args.rm == "batch"), encode_values=args.encode,
+                delta_Bmass=(args.bmass == "delta"), grouping_sets=(args.agg == "grouping"),
+                storage=args.storage, profile=args.tune, loader=args.loader,
+                workers=args.workers, trace=args.trace, pg_profile=args.pg_profile,
+                append=args.append, window=args.window, slide=args.slide,
+                time_dim=args.time_dim, time_type=args.time_type, output=args.output,
+                out_format=args.format, catalog=args.tensor, schema=args.schema,
+                resume=args.resume, warm_start=args.warm_start)
     else:
         ## the 5 built-in datasets with specific parameter choices
         dcube_realdata(args.dbname, args.user, args.port, args.file_name, args.K, args.data,
-                outdir=args.outdir, opt=args.opt)
+                outdir=args.outdir, opt=args.opt, rm_batch=(args.rm == "batch"),
+                encode_values=args.encode, delta_Bmass=(args.bmass == "delta"),
+                grouping_sets=(args.agg == "grouping"), storage=args.storage,
+                profile=args.tune, loader=args.loader, workers=args.workers, trace=args.trace,
+                pg_profile=args.pg_profile, append=args.append, window=args.window,
+                slide=args.slide, time_type=args.time_type, output=args.output,
+                out_format=args.format, catalog=args.tensor, schema=args.schema,
+                resume=args.resume, warm_start=args.warm_start)
 
 
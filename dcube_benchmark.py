@@ -0,0 +1,394 @@
+###########################################
+## Benchmark of the D-Cube implementations on synthetic tensors.
+##
+## The generator draws the entries of an N-way tensor of a given size, with values
+## of each dimension drawn uniformly or with a Zipf skew, and plants dense blocks
+## in it, like the test sets TS1-TS4 of doc/final_report.pdf.
+## The tensor is streamed to a .csv file, or straight into COPY.
+##
+## The runner times dcube() for each combination of implementation, density measure,
+## dimension selection policy and index setting, at each size, and reports
+## the throughput, the time of each phase, and the precision and recall of the
+## detected blocks against the planted ones.
+###########################################
+## Usage:
+## $ python dcube_benchmark.py generate -out OUTFILE [-N N] [-tuples T] [-card C]
+##            [-skew S] [-mass M] [-blocks B] [-block_size SIZE]
+##            [-block_density P] [-block_mass BM] [-seed SEED]
+## $ python dcube_benchmark.py run [-db DBNAME] [-user USERNAME] [-port PORT]
+##            [-outdir OUTDIR] [-sizes T1,T2,...] [-K K] [-opt OPT1,OPT2,...]
+##            [-dmeasure DM1,...] [-policy P1,...] [-index on,off]
+##            [the options of generate, except -out and -tuples]
+##
+## generate writes OUTFILE, which has N+1 columns as the input of dcube.py,
+## and OUTFILE.blocks.json, the values of each planted block.
+## run writes OUTDIR/benchmark.csv, with one line per run, and
+## OUTDIR/benchmark_phases.csv, with the time of each phase of each run.
+## The lists of -sizes accept e.g. 1e4,1e5; the tensor of each size is generated once
+## and copied for each run.
+###########################################
+
+import argparse, bisect, csv, itertools, json, os, random, sys, time
+from collections import Counter
+import psycopg2
+from dcube import dcube
+from dcube_loader import LineReader
+from dcube_trace import TracingCursor
+
+
+class PlantedBlock(object):
+    """
+    A dense block planted in a synthetic tensor.
+    """
+
+    def __init__(self, values, density, mass):
+        """
+        Args:
+            values: N lists, the values of the block in each dimension
+            density: probability that each entry of the block is in the tensor
+            mass: the mass of each entry is drawn uniformly from 1 to mass
+        """
+        self.values = values
+        self.sets = [set(v) for v in values]
+        self.density = density
+        self.mass = mass
+
+    def contains(self, entry):
+        """
+        Whether the entry, a sequence of N values, lies in the block.
+        """
+        return all([entry[n] in self.sets[n] for n in range(len(self.sets))])
+
+    def to_dict(self):
+        return {"values": self.values, "density": self.density, "mass": self.mass}
+
+
+class SyntheticTensor(object):
+    """
+    An N-way tensor with planted dense blocks. Its entries are generated lazily, and
+    the same seed always gives the same entries.
+    """
+
+    def __init__(self, N=3, n_tuples=10000, card=1000, skew=0.0, mass=1,
+                n_blocks=3, block_size=10, block_density=0.5, block_mass=10, seed=0):
+        """
+        Args:
+            N: number of dimensions
+            n_tuples: number of entries outside of the planted blocks
+            card: number of distinct values in each dimension
+            skew: exponent of the Zipf distribution of the values; 0 is uniform
+            mass: the mass of the entries outside of the blocks is drawn from 1 to mass
+            n_blocks: number of planted blocks
+            block_size: number of values of each block in each dimension
+            block_density: probability that each entry of a block is in the tensor
+            block_mass: the mass of the entries of the blocks is drawn from 1 to block_mass
+            seed: random seed
+        """
+        self.N = N
+        self.n_tuples = n_tuples
+        self.card = card
+        self.mass = mass
+        self.seed = seed
+        ## cumulative weights of the values for the Zipf skew
+        self._cumulative = None
+        if skew > 0:
+            self._cumulative = cumulative_sum([1.0 / (i + 1) ** skew for i in range(card)])
+        rng = random.Random(seed)
+        self.blocks = [PlantedBlock([sorted([self.label(n, i) for i in
+                            rng.sample(range(card), min(block_size, card))])
+                        for n in range(N)], block_density, block_mass)
+                    for b in range(n_blocks)]
+        ## number of lines generated, and of those in a planted block; set by lines()
+        self.n_lines = 0
+        self.n_planted = 0
+
+    def label(self, n, i):
+        """
+        The i-th value of the n-th dimension.
+        """
+        return "%s%d" % (chr(ord("a") + n % 26), i)
+
+    def lines(self, sep=","):
+        """
+        Generate the lines of the tensor, each of them with N values and the mass.
+        The entries which lie in a planted block, including those drawn outside of
+        the blocks, are counted in n_planted.
+        """
+        rng = random.Random(self.seed + 1)
+        self.n_lines = 0
+        self.n_planted = 0
+        for t in xrange(self.n_tuples):
+            if self._cumulative is None:
+                entry = [self.label(n, rng.randrange(self.card)) for n in range(self.N)]
+            else:
+                total = self._cumulative[-1]
+                entry = [self.label(n, bisect.bisect(self._cumulative, rng.random() * total))
+                        for n in range(self.N)]
+            yield self._line(entry, rng.randint(1, self.mass), sep)
+        for block in self.blocks:
+            for entry in itertools.product(*block.values):
+                if rng.random() < block.density:
+                    yield self._line(entry, rng.randint(1, block.mass), sep)
+
+    def _line(self, entry, mass, sep):
+        self.n_lines += 1
+        if any([block.contains(entry) for block in self.blocks]):
+            self.n_planted += 1
+        return sep.join(entry) + sep + str(mass) + "\n"
+
+    def write_csv(self, outfile):
+        """
+        Write the tensor to a .csv file, and the planted blocks to outfile.blocks.json.
+        """
+        with open(outfile, mode="wt") as fout:
+            for line in self.lines():
+                fout.write(line)
+        with open(outfile + ".blocks.json", mode="wt") as fout:
+            json.dump({"N": self.N, "lines": self.n_lines, "planted": self.n_planted,
+                    "blocks": [block.to_dict() for block in self.blocks]}, fout, indent=1)
+
+    def copy_to_table(self, cur, data_table, col_names, X_name):
+        """
+        Create a relation and stream the tensor into it with COPY.
+        """
+        columns = [col_names[n] + " varchar" for n in range(self.N)]
+        cur.execute("CREATE TABLE %s (%s, %s double precision);" %
+                    (data_table, ",".join(columns), X_name))
+        cur.copy_from(LineReader(self.lines()), data_table, sep=",", size=1024*1024)
+
+
+def cumulative_sum(weights):
+    """
+    The cumulative sums of a list of weights.
+    """
+    total, sums = 0.0, []
+    for w in weights:
+        total += w
+        sums.append(total)
+    return sums
+
+
+def precision_recall(tensor, outdir, out_prefix, K):
+    """
+    Precision and recall of the entries of the detected blocks, against the entries
+    of the tensor which lie in a planted block.
+    The blocks are taken from the original tensor, so they may overlap; the detected
+    entries are their union, where an entry appearing m times counts m times.
+    Args:
+        tensor: the SyntheticTensor, after its lines are generated
+        outdir: output directory of dcube()
+        out_prefix: prefix of the output results of dcube()
+        K: number of detected blocks
+    Returns:
+        (precision, recall); precision is None if no entry is detected
+    """
+    union = Counter()
+    for k in range(K):
+        block_file = outdir + "/" + out_prefix + "_block" + str(k+1) + ".csv"
+        if not os.path.exists(block_file):
+            continue
+        with open(block_file, mode="rt") as fin:
+            union |= Counter([tuple(row) for row in csv.reader(fin)])
+    detected, hits = 0, 0
+    for (row, m) in union.iteritems():
+        detected += m
+        if any([block.contains(row) for block in tensor.blocks]):
+            hits += m
+    precision = float(hits) / detected if detected > 0 else None
+    recall = float(hits) / tensor.n_planted if tensor.n_planted > 0 else None
+    return (precision, recall)
+
+
+def index_options(index, N):
+    """
+    The index arguments of dcube() for an index setting, "on" or "off".
+    """
+    if index == "on":
+        return {"para_index": True, "b_index": min(2, N-1), "Bn_index": True}
+    else:
+        return {"para_index": False, "b_index": -1, "Bn_index": False}
+
+
+def run_benchmark(dbname, user, port, outdir, sizes, K, opts, dmeasures, policies,
+                indexes, generator_args):
+    """
+    Run dcube() for each setting at each size of the synthetic tensor.
+    Args:
+        dbname: an existing database name
+        user: user
+        port: port number
+        outdir: output directory
+        sizes: list of numbers of entries outside of the planted blocks
+        K: number of blocks to detect
+        opts: list of optimization methods, among "copy", "mark", "plpgsql" or "numpy"
+        dmeasures: list of density measures
+        policies: list of dimension selection policies
+        indexes: list of index settings, "on" (the defaults of dcube()) or "off"
+        generator_args: the other arguments of SyntheticTensor
+    Returns:
+        the list of results, one dict per run
+    """
+    N = generator_args["N"]
+    data_table = "test_data"
+    col_names = ["D"+str(i) for i in range(N)]
+    X_name = "measure"
+    results, phases = [], []
+    DSN = "dbname=%s user=%s port=%s host='/tmp/'" % (dbname, user, port)
+    for size in sizes:
+        tensor = SyntheticTensor(n_tuples=size, **generator_args)
+        with psycopg2.connect(DSN) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DROP SCHEMA public CASCADE;")
+                cur.execute("CREATE SCHEMA public;")
+                start = time.time()
+                tensor.copy_to_table(cur, "bench_data", col_names, X_name)
+                load_time = time.time() - start
+        print ("Generated %d entries (%d in planted blocks) in %.1fs." %
+                (tensor.n_lines, tensor.n_planted, load_time))
+
+        for (opt, dmeasure, policy, index) in itertools.product(opts, dmeasures,
+                                                                policies, indexes):
+            name = "%d_%s_%s_%s_%s" % (size, opt, dmeasure, policy, index)
+            run_outdir = os.path.join(outdir, name)
+            if not os.path.exists(run_outdir):
+                os.makedirs(run_outdir)
+            with psycopg2.connect(DSN) as conn:
+                with conn.cursor() as cur:
+                    ## a fresh copy of the tensor, as the 'mark' implementation alters it
+                    cur.execute("DROP TABLE IF EXISTS %s;" % data_table)
+                    cur.execute("CREATE TABLE %s AS SELECT * FROM bench_data;" % data_table)
+                    cur = TracingCursor(cur)
+                    start = time.time()
+                    dcube(data_table, col_names, X_name, K, N, cur, dmeasure, policy,
+                        outdir=run_outdir, out_prefix="bench", verbose=False, opt=opt,
+                        **index_options(index, N))
+                    elapsed = time.time() - start
+                    (by_phase, by_block) = cur.summary()
+            (precision, recall) = precision_recall(tensor, run_outdir, "bench", K)
+            result = {"tuples": tensor.n_lines, "opt": opt, "dmeasure": dmeasure,
+                    "policy": policy, "index": index, "seconds": elapsed,
+                    "throughput": tensor.n_lines / elapsed if elapsed > 0 else None,
+                    "precision": precision, "recall": recall}
+            results.append(result)
+            for (phase, total) in by_phase:
+                phases.append(dict(total, phase=phase, tuples=tensor.n_lines, opt=opt,
+                            dmeasure=dmeasure, policy=policy, index=index))
+            print ("%-40s %9.2fs %12.0f tuples/s  precision %s  recall %s" % (name,
+                    elapsed, result["throughput"] or 0, format_ratio(precision),
+                    format_ratio(recall)))
+
+    write_rows(os.path.join(outdir, "benchmark.csv"), results, ["tuples", "opt",
+            "dmeasure", "policy", "index", "seconds", "throughput", "precision", "recall"])
+    write_rows(os.path.join(outdir, "benchmark_phases.csv"), phases, ["tuples", "opt",
+            "dmeasure", "policy", "index", "phase", "wall", "sql", "statements", "rows"])
+    print ("Results are written to directory '%s'." % outdir)
+    return results
+
+
+def format_ratio(x):
+    return "-" if x is None else "%.3f" % x
+
+
+def write_rows(outfile, rows, fields):
+    with open(outfile, mode="wt") as fout:
+        writer = csv.DictWriter(fout, fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_list(value, convert=str):
+    return [convert(x) for x in value.split(",") if x]
+
+
+def parse_size(value):
+    return int(float(value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of D-Cube on synthetic tensors.")
+    subparsers = parser.add_subparsers(dest="command")
+    generate = subparsers.add_parser("generate", help="write a synthetic tensor to a file")
+    run = subparsers.add_parser("run", help="run the benchmark")
+    for sub in [generate, run]:
+        sub.add_argument("-N", "--N", type=int, default=3,
+            help="number of dimensions of the tensor")
+        sub.add_argument("-card", "--card", type=int, default=1000,
+            help="number of distinct values in each dimension; default is 1000")
+        sub.add_argument("-skew", "--skew", type=float, default=0.0,
+            help="exponent of the Zipf distribution of the values; default 0 is uniform")
+        sub.add_argument("-mass", "--mass", type=int, default=1,
+            help="""the mass of the entries outside of the blocks is drawn uniformly
+            from 1 to MASS; default is 1""")
+        sub.add_argument("-blocks", "--blocks", type=int, default=3,
+            help="number of planted blocks; default is 3")
+        sub.add_argument("-block_size", "--block_size", type=int, default=10,
+            help="number of values of each block in each dimension; default is 10")
+        sub.add_argument("-block_density", "--block_density", type=float, default=0.5,
+            help="probability that each entry of a block is present; default is 0.5")
+        sub.add_argument("-block_mass", "--block_mass", type=int, default=10,
+            help="""the mass of the entries of the blocks is drawn uniformly
+            from 1 to BLOCK_MASS; default is 10""")
+        sub.add_argument("-seed", "--seed", type=int, default=0,
+            help="random seed; default is 0")
+    generate.add_argument("-out", "--out", type=str, required=True,
+        help="the .csv file to write")
+    generate.add_argument("-tuples", "--tuples", type=parse_size, default=10000,
+        help="number of entries outside of the planted blocks; default is 1e4")
+    run.add_argument("-db", "--dbname", type=str, default=os.environ['USER'],
+        help="the name of the database to use; default is system $USER")
+    run.add_argument("-user", "--user", type=str, default=os.environ['USER'],
+        help="the database user; default is system $USER")
+    run.add_argument("-port", "--port", type=str, default="5432",
+        help="the database port number; default is 5432")
+    run.add_argument("-outdir", "--outdir", type=str, default="bench_out",
+        help="output directory; default is 'bench_out'")
+    run.add_argument("-sizes", "--sizes", type=str, default="1e4,1e5",
+        help="""comma-separated numbers of entries outside of the planted blocks;
+        default is 1e4,1e5""")
+    run.add_argument("-K", "--K", type=int, default=3,
+        help="number of dense blocks to detect; default is 3")
+    run.add_argument("-opt", "--opt", type=str, default="copy,mark",
+        help="comma-separated optimization methods; default is copy,mark")
+    run.add_argument("-dmeasure", "--dmeasure", type=str, default="arithmetic",
+        help="comma-separated density measures; default is arithmetic")
+    run.add_argument("-policy", "--policy", type=str, default="density",
+        help="comma-separated dimension selection policies; default is density")
+    run.add_argument("-index", "--index", type=str, default="on",
+        help="""comma-separated index settings, 'on' (the default indexes) or 'off'
+        (no index on the parameters, Btable and Bn); default is on""")
+    args = parser.parse_args()
+
+    generator_args = {"N": args.N, "card": args.card, "skew": args.skew,
+            "mass": args.mass, "n_blocks": args.blocks, "block_size": args.block_size,
+            "block_density": args.block_density, "block_mass": args.block_mass,
+            "seed": args.seed}
+    if args.command == "generate":
+        tensor = SyntheticTensor(n_tuples=args.tuples, **generator_args)
+        tensor.write_csv(args.out)
+        print ("%d entries (%d in planted blocks) are written to file '%s'." %
+                (tensor.n_lines, tensor.n_planted, args.out))
+        sys.exit(0)
+
+    ## check validity of the arguments
+    opts = parse_list(args.opt)
+    dmeasures = parse_list(args.dmeasure)
+    policies = parse_list(args.policy)
+    indexes = parse_list(args.index)
+    if not set(opts) <= set(["copy", "mark", "plpgsql", "numpy"]):
+        print "-opt must be among 'copy', 'mark', 'plpgsql' or 'numpy'."
+        sys.exit(1)
+    if not set(dmeasures) <= set(["arithmetic", "geometric", "suspicious"]):
+        print "-dmeasure must be among 'arithmetic', 'geometric' or 'suspicious'."
+        sys.exit(1)
+    if not set(policies) <= set(["density", "cardinality"]):
+        print "-policy must be among 'density' or 'cardinality'."
+        sys.exit(1)
+    if not set(indexes) <= set(["on", "off"]):
+        print "-index must be among 'on' or 'off'."
+        sys.exit(1)
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+
+    run_benchmark(args.dbname, args.user, args.port, args.outdir,
+        parse_list(args.sizes, parse_size), args.K, opts, dmeasures, policies, indexes,
+        generator_args)
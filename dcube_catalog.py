@@ -0,0 +1,149 @@
+#################################################
+## Catalog of persisted tensors for D-CUBE
+##
+## A tensor of the catalog is kept, with its distinct values and their mass in each
+## dimension and its total mass (see append_tensor in dcube_loader.py), in the schema
+## "dcube_catalog", which the runs do not drop. It is registered under a name with
+## the content hash of its input file, so that the runs on the same file reuse it
+## instead of loading and aggregating the file again.
+##
+## Dependency: Psycopg2 (Access PostgreSQL with Python)
+#################################################
+
+import hashlib, os, re
+import psycopg2
+
+CATALOG_SCHEMA = "dcube_catalog"
+## names of the tensors, which are used in the names of their relations
+TENSOR_NAME = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def file_hash(file_name, block_size=1024*1024):
+    """
+    The SHA-1 of the content of an input file, or of all the files in a directory
+    (e.g. of .npy arrays), with their names, in sorted order.
+    """
+    digest = hashlib.sha1()
+    if os.path.isdir(file_name):
+        paths = [os.path.join(root, name) for (root, dirs, names) in os.walk(file_name)
+                    for name in names]
+        paths = sorted(paths)
+    else:
+        paths = [file_name]
+    for path in paths:
+        if path != file_name:
+            digest.update(os.path.relpath(path, file_name) + "\0")
+        with open(path, mode="rb") as fin:
+            for data in iter(lambda: fin.read(block_size), ""):
+                digest.update(data)
+    return digest.hexdigest()
+
+
+def init_catalog(cur):
+    """
+    Create the schema of the catalog and its index, the relation "tensors", if needed.
+    """
+    cur.execute("CREATE SCHEMA IF NOT EXISTS %s;" % CATALOG_SCHEMA)
+    cur.execute(("CREATE TABLE IF NOT EXISTS %s.tensors " % CATALOG_SCHEMA)
+        + "(name varchar PRIMARY KEY, file_name varchar, file_hash varchar(40), "
+        + "col_names varchar, X_name varchar, entries bigint, total_mass double precision, "
+        + "updated timestamp);")
+
+
+def catalog_relation(name):
+    """
+    The relation of the tensor registered under name.
+    """
+    if not TENSOR_NAME.match(name):
+        raise ValueError("the name of a tensor must be a lowercase SQL identifier.")
+    return "%s.tensor_%s" % (CATALOG_SCHEMA, name)
+
+
+def find_tensor(cur, name):
+    """
+    The entry of the catalog for a tensor, as a dict, or None if it is not registered.
+    """
+    cur.execute(("SELECT name, file_name, file_hash, col_names, X_name, entries, total_mass "
+                + "FROM %s.tensors WHERE name=%%s;" % CATALOG_SCHEMA), (name,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    entry = dict(zip(["name", "file_name", "file_hash", "col_names", "X_name", "entries",
+                    "total_mass"], row))
+    entry["col_names"] = entry["col_names"].split(",")
+    entry["relation"] = catalog_relation(name)
+    return entry
+
+
+def lookup_tensor(cur, name, file_name, col_names, append=False):
+    """
+    Find the tensor registered under name for a run on file_name. If the file has
+    changed, the tensor is dropped, to be loaded again.
+    Args:
+        cur: cursor of database connection
+        name: name of the tensor
+        file_name: the input file, or None to use the registered tensor
+        col_names: column names of the relation for the N dimensions
+        append: whether the file is appended to the tensor (see append_tensor)
+    Returns:
+        (relation, reuse, digest): the relation of the tensor; whether it is used as it
+        is, i.e. file_name is None, or has the same content and is not appended; and
+        the content hash of the tensor once file_name is loaded into it
+    """
+    init_catalog(cur)
+    entry = find_tensor(cur, name)
+    relation = catalog_relation(name)
+    if entry is not None and entry["col_names"] != col_names:
+        raise ValueError("the tensor '%s' has the dimensions %s." % 
+                        (name, ",".join(entry["col_names"])))
+    if file_name is None:
+        if entry is None:
+            raise ValueError("the tensor '%s' is not in the catalog." % name)
+        return (relation, True, entry["file_hash"])
+
+    digest = file_hash(file_name)
+    if entry is not None and append:
+        return (relation, False, hashlib.sha1(entry["file_hash"] + digest).hexdigest())
+    elif entry is not None and entry["file_hash"] == digest:
+        return (relation, True, digest)
+    drop_tensor(cur, name, len(col_names))
+    return (relation, False, digest)
+
+
+def register_tensor(cur, name, file_name, digest, col_names, X_name):
+    """
+    Register (or update) a tensor, once its relation is loaded by append_tensor,
+    with the number of entries and the total mass of <relation>_stats.
+    Args:
+        cur: cursor of database connection
+        name: name of the tensor
+        file_name: the input file
+        digest: the content hash of the tensor, see file_hash
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+    """
+    relation = catalog_relation(name)
+    cur.execute(("INSERT INTO %s.tensors SELECT %%s, %%s, %%s, %%s, %%s, " % CATALOG_SCHEMA)
+        + ("(SELECT value FROM %s_stats WHERE par='entries')::bigint, " % relation)
+        + ("(SELECT value FROM %s_stats WHERE par='total_mass'), now() " % relation)
+        + "ON CONFLICT (name) DO UPDATE SET file_name=EXCLUDED.file_name, "
+        + "file_hash=EXCLUDED.file_hash, col_names=EXCLUDED.col_names, "
+        + "X_name=EXCLUDED.X_name, entries=EXCLUDED.entries, "
+        + "total_mass=EXCLUDED.total_mass, updated=EXCLUDED.updated;",
+        (name, file_name, digest, ",".join(col_names), X_name))
+
+
+def drop_tensor(cur, name, N):
+    """
+    Drop the relations of a tensor, if any, and remove it from the catalog.
+    Args:
+        cur: cursor of database connection
+        name: name of the tensor
+        N: number of dimension
+    """
+    relation = catalog_relation(name)
+    for n in range(N):
+        cur.execute("DROP TABLE IF EXISTS %s_R%d;" % (relation, n))
+    cur.execute("DROP TABLE IF EXISTS %s_stats;" % relation)
+    cur.execute("DROP TABLE IF EXISTS %s;" % relation)
+    cur.execute("DELETE FROM %s.tensors WHERE name=%%s;" % CATALOG_SCHEMA, (name,))
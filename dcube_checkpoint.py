@@ -0,0 +1,93 @@
+#################################################
+## Checkpoints of the D-CUBE runs
+##
+## With checkpoints, the SQL implementations commit their working relations (the
+## relation left after removing the blocks, its distinct values, the parameters and
+## the blocks) after each block but the last one, and record the block in the relation
+## "dcube_checkpoint_blocks". The relation "dcube_checkpoint" holds the setting of the
+## run. If the run is interrupted, e.g. the connection is lost or the process is killed,
+## what was done since the last checkpoint is rolled back with its transaction, and
+## the run resumes from there instead of starting over (see -resume in dcube.py).
+##
+## Dependency: Psycopg2 (Access PostgreSQL with Python)
+#################################################
+
+import json
+import psycopg2
+from dcube_utils import create_table, sync_parameters
+
+
+def init_checkpoint(cur, setting, storage="logged"):
+    """
+    Create the relations of the checkpoints of a run, once its tensor is loaded.
+    They are of the same kind as the working relations, so that they are lost together
+    (e.g. the unlogged relations, after a crash of the server).
+    Args:
+        cur: cursor of database connection
+        setting: dict of the arguments of the run, which a resumed run must have too
+        storage: "logged" or "unlogged", the kind of the working relations
+    """
+    cur.execute(create_table(storage) +
+                " dcube_checkpoint (par varchar(40) PRIMARY KEY, value varchar);")
+    cur.execute("INSERT INTO dcube_checkpoint VALUES ('setting', %s);",
+                (json.dumps(setting, sort_keys=True),))
+    cur.execute(create_table(storage) + " dcube_checkpoint_blocks (block int PRIMARY KEY, "
+                + "entries bigint, mass double precision, seconds double precision, "
+                + "saved timestamp);")
+
+
+def find_checkpoint(cur, setting=None):
+    """
+    Find the checkpoint of an interrupted run.
+    Args:
+        cur: cursor of database connection
+        setting: the setting of the run to resume; if None, it is not checked
+    Returns:
+        the number of blocks found before the checkpoint, or None if there is none
+    """
+    cur.execute("SELECT to_regclass('dcube_checkpoint') IS NULL;")
+    if cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT value FROM dcube_checkpoint WHERE par='setting';")
+    saved = json.loads(cur.fetchone()[0])
+    if setting is not None and saved != json.loads(json.dumps(setting)):
+        changed = sorted([par for par in set(saved) | set(setting)
+                        if saved.get(par) != setting.get(par)])
+        raise ValueError("the checkpoint is of a run with another %s." % ", ".join(changed))
+    return checkpoint_blocks(cur)
+
+
+def checkpoint_blocks(cur):
+    """
+    The number of blocks found before the last checkpoint, from which the run resumes.
+    """
+    cur.execute("SELECT count(*) FROM dcube_checkpoint_blocks;")
+    return cur.fetchone()[0]
+
+
+def save_checkpoint(cur, k, entries, mass, seconds, params=None):
+    """
+    Record the k-th block, once it is removed, and commit the working relations.
+    Args:
+        cur: cursor of database connection
+        k: the block, from 0
+        entries: number of entries of the block, in the relation it was found in
+        mass: mass of the block, in that relation
+        seconds: time to find and remove the block
+        params: client-side parameters, which are written to the relation "parameters"
+                to be read again by a resumed run; None if they are kept there already
+    """
+    if params is not None:
+        sync_parameters(cur, params)
+    cur.execute("INSERT INTO dcube_checkpoint_blocks VALUES (%s, %s, %s, %s, now());",
+                (k+1, entries, mass, seconds))
+    cur.connection.commit()
+    print ("\tCheckpoint after the %d-th block." % (k+1))
+
+
+def drop_checkpoint(cur):
+    """
+    Drop the relations of the checkpoints, once the run is done.
+    """
+    cur.execute("DROP TABLE IF EXISTS dcube_checkpoint_blocks;")
+    cur.execute("DROP TABLE IF EXISTS dcube_checkpoint;")
@@ -0,0 +1,253 @@
+###########################################
+## Concurrent runner of D-Cube jobs.
+##
+## A job runs D-Cube on one input with one setting of K, density measure, dimension
+## selection policy and implementation. The jobs are run by a pool of worker processes,
+## each of which keeps one connection to the database for all its jobs, so that at
+## most W connections are open at a time. Each job creates its relations in a schema
+## of its own (see -schema in dcube.py), which is dropped once the job is done, so
+## that the jobs running at the same time do not share any relation.
+###########################################
+## Usage:
+## $ python dcube_jobs.py -in INPUT1,INPUT2,... [-db DBNAME] [-user USERNAME]
+##            [-port PORT] [-outdir OUTDIR] [-N N] [-K K1,K2,...]
+##            [-dmeasure DM1,...] [-policy P1,...] [-opt OPT1,...] [-workers W]
+##            [-storage STORAGE] [-tune PROFILE]
+##
+## Each input is either a .csv file with N+1 columns, as -in of dcube.py, or
+## DATA:FILE for the datasets of -data in dcube.py, e.g. darpa:darpa.csv, which have
+## their own N, density measure and policy. A job is run for each combination of the
+## inputs and of the lists of settings; it writes its blocks and its output to
+## OUTDIR/<prefix>_K<K>_<dmeasure>_<policy>_<opt>/, and OUTDIR/jobs.csv has one line
+## per job, with its status and its time.
+###########################################
+
+import argparse, csv, itertools, multiprocessing, os, sys, time, traceback
+import psycopg2
+from dcube import dcube_custom, dcube_realdata, info_realdata
+from dcube_loader import tensor_name
+from dcube_utils import database_dsn, TUNING_PROFILES
+
+REAL_DATA = ["darpa", "wiki", "amazon", "yelp", "airforce"]
+
+## the connection of each worker process, opened by init_worker
+worker_conn = None
+
+
+def make_jobs(inputs, N, Ks, dmeasures, policies, opts):
+    """
+    The jobs for each combination of the inputs and of the settings. The datasets of
+    REAL_DATA have their own density measure and policy, so they have one job per K
+    and optimization method.
+    Args:
+        inputs: list of inputs, each a file name, or DATA:FILE for the datasets
+        N: number of dimensions of the files
+        Ks: list of numbers of blocks to detect
+        dmeasures: list of density measures
+        policies: list of dimension selection policies
+        opts: list of optimization methods
+    Returns:
+        list of dicts, with the keys name, data, file_name, N, K, dmeasure, policy, opt
+    """
+    jobs, names = [], {}
+    for (spec, K, dmeasure, policy, opt) in itertools.product(inputs, Ks, dmeasures,
+                                                            policies, opts):
+        (data, file_name, n_dims) = ("custom", spec, N)
+        if spec.split(":", 1)[0] in REAL_DATA:
+            (data, file_name) = spec.split(":", 1)
+            (data_table, n_dims, col_names, b_index, dmeasure) = info_realdata(data)
+            policy = "density"
+        name = "%s_K%d_%s_%s_%s" % (tensor_name(file_name), K, dmeasure, policy, opt)
+        if names.get(name, spec) != spec:
+            raise ValueError("the inputs %s and %s have the same name." %
+                            (names[name], spec))
+        elif name in names:
+            continue
+        names[name] = spec
+        jobs.append({"name": name, "data": data, "file_name": file_name, "N": n_dims,
+                    "K": K, "dmeasure": dmeasure, "policy": policy, "opt": opt})
+    return jobs
+
+
+def free_connections(DSN):
+    """
+    The number of connections which the server accepts besides the ones already open
+    (and those reserved for superusers).
+    """
+    with psycopg2.connect(DSN) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT current_setting('max_connections')::int "
+                + "- current_setting('superuser_reserved_connections')::int "
+                + "- (SELECT count(*) FROM pg_stat_activity);")
+            n_free = cur.fetchone()[0]
+    conn.close()
+    return n_free
+
+
+def init_worker(DSN):
+    """
+    Open the connection of a worker process, which is used by all its jobs.
+    """
+    global worker_conn
+    worker_conn = psycopg2.connect(DSN)
+
+
+def run_job(args):
+    """
+    Run a job in a worker process, in the schema of the job, with the connection of the
+    worker. The output of the job is written to <job outdir>/log.txt.
+    Args:
+        args: (job, dbname, user, port, outdir, options), where job is one of make_jobs()
+            with its schema, and options are keyword arguments of dcube_custom()
+    Returns:
+        the job, with its status ("done" or "failed"), error and seconds
+    """
+    global worker_conn
+    (job, dbname, user, port, outdir, options) = args
+    job_outdir = os.path.join(outdir, job["name"])
+    if not os.path.exists(job_outdir):
+        os.makedirs(job_outdir)
+    if worker_conn is None or worker_conn.closed:
+        ## e.g. the server was restarted by a previous job
+        worker_conn = psycopg2.connect(database_dsn(dbname, user, port))
+
+    result = dict(job, status="done", error="")
+    stdout = sys.stdout
+    start = time.time()
+    with open(os.path.join(job_outdir, "log.txt"), mode="wt") as log:
+        sys.stdout = log
+        try:
+            if job["data"] == "custom":
+                dcube_custom(dbname, user, port, job["file_name"], job["K"], job["N"],
+                        dmeasure=job["dmeasure"], policy=job["policy"], outdir=job_outdir,
+                        opt=job["opt"], schema=job["schema"], conn=worker_conn, **options)
+            else:
+                dcube_realdata(dbname, user, port, job["file_name"], job["K"], job["data"],
+                        outdir=job_outdir, opt=job["opt"], schema=job["schema"],
+                        conn=worker_conn, **options)
+        except Exception as e:
+            traceback.print_exc(file=log)
+            result["status"], result["error"] = "failed", repr(e)
+        finally:
+            sys.stdout = stdout
+    result["seconds"] = time.time() - start
+    return result
+
+
+def run_jobs(dbname, user, port, outdir, jobs, workers=None, options={}):
+    """
+    Run the jobs in a pool of worker processes, each with one connection and each job
+    in its own schema, and write OUTDIR/jobs.csv.
+    Args:
+        dbname: an existing database name
+        user: user
+        port: port number
+        outdir: output directory
+        jobs: list of jobs, see make_jobs()
+        workers: number of worker processes, and so of connections; default is the
+                number of CPUs, but no more than the free connections of the server
+        options: keyword arguments of dcube_custom() and dcube_realdata() for all jobs
+    Returns:
+        the list of results, see run_job()
+    """
+    DSN = database_dsn(dbname, user, port)
+    n_free = free_connections(DSN)
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs), max(n_free, 1))
+    print ("Running %d jobs with %d workers (%d free connections)..." %
+            (len(jobs), workers, n_free))
+
+    ## the schemas of the jobs are named after the runner, so that runners do not collide
+    for (i, job) in enumerate(jobs):
+        job["schema"] = "dcube_%d_job%d" % (os.getpid(), i+1)
+    pool = multiprocessing.Pool(processes=workers, initializer=init_worker,
+                                initargs=(DSN,))
+    results = []
+    start = time.time()
+    for result in pool.imap_unordered(run_job, [(job, dbname, user, port, outdir, options)
+                                                for job in jobs]):
+        results.append(result)
+        print ("[%d/%d] %-50s %-6s %9.2fs %s" % (len(results), len(jobs), result["name"],
+                result["status"], result["seconds"], result["error"]))
+    pool.close()
+    pool.join()
+    print ("%d jobs are done in %.2fs, %d failed." % (len(jobs), time.time() - start,
+            len([result for result in results if result["status"] != "done"])))
+
+    order = dict([(job["name"], i) for (i, job) in enumerate(jobs)])
+    results = sorted(results, key=lambda result: order[result["name"]])
+    with open(os.path.join(outdir, "jobs.csv"), mode="wt") as fout:
+        writer = csv.DictWriter(fout, ["name", "data", "file_name", "N", "K", "dmeasure",
+                                "policy", "opt", "schema", "status", "seconds", "error"])
+        writer.writeheader()
+        writer.writerows(results)
+    print ("Results are written to file '%s'." % os.path.join(outdir, "jobs.csv"))
+    return results
+
+
+def parse_list(value, convert=str):
+    return [convert(x) for x in value.split(",") if x]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent runner of D-Cube jobs.")
+    parser.add_argument("-db", "--dbname", type=str, default=os.environ['USER'],
+        help="the name of the database to use; default is system $USER")
+    parser.add_argument("-user", "--user", type=str, default=os.environ['USER'],
+        help="the database user; default is system $USER")
+    parser.add_argument("-port", "--port", type=str, default="5432",
+        help="the database port number; default is 5432")
+    parser.add_argument("-in", "--inputs", type=str, required=True,
+        help="""comma-separated inputs, each a .csv file with N+1 columns, or DATA:FILE
+        for the datasets 'darpa', 'wiki', 'amazon', 'yelp' and 'airforce'""")
+    parser.add_argument("-outdir", "--outdir", type=str, default="jobs_out",
+        help="output directory; default is 'jobs_out'")
+    parser.add_argument("-N", "--N", type=int, default=3,
+        help="number of dimensions of the .csv files; default is 3")
+    parser.add_argument("-K", "--K", type=str, default="3",
+        help="comma-separated numbers of dense blocks to detect; default is 3")
+    parser.add_argument("-dmeasure", "--dmeasure", type=str, default="arithmetic",
+        help="comma-separated density measures; default is arithmetic")
+    parser.add_argument("-policy", "--policy", type=str, default="density",
+        help="comma-separated dimension selection policies; default is density")
+    parser.add_argument("-opt", "--opt", type=str, default="copy",
+        help="comma-separated optimization methods; default is copy")
+    parser.add_argument("-workers", "--workers", type=int, default=None,
+        help="""number of worker processes, each with one connection; default is the
+        number of CPUs, but no more than the free connections of the server""")
+    parser.add_argument("-storage", "--storage", type=str, default="logged",
+        help="""kind of the loaded and working relations, one of 'logged', 'unlogged'
+        or 'temp'; default is 'logged'""")
+    parser.add_argument("-tune", "--tune", type=str, default="none",
+        help="tuning profile of the database sessions, 'none' or 'fast'; default 'none'")
+    args = parser.parse_args()
+
+    ## check validity of the arguments
+    inputs = parse_list(args.inputs)
+    Ks = parse_list(args.K, int)
+    opts = parse_list(args.opt)
+    dmeasures = parse_list(args.dmeasure)
+    policies = parse_list(args.policy)
+    if not set(opts) <= set(["copy", "mark", "plpgsql", "numpy"]):
+        print "-opt must be among 'copy', 'mark', 'plpgsql' or 'numpy'."
+        sys.exit(1)
+    if not set(dmeasures) <= set(["arithmetic", "geometric", "suspicious"]):
+        print "-dmeasure must be among 'arithmetic', 'geometric' or 'suspicious'."
+        sys.exit(1)
+    if not set(policies) <= set(["density", "cardinality"]):
+        print "-policy must be among 'density' or 'cardinality'."
+        sys.exit(1)
+    if args.storage not in ["logged", "unlogged", "temp"]:
+        print "-storage must be one of 'logged', 'unlogged' or 'temp'."
+        sys.exit(1)
+    if args.tune not in TUNING_PROFILES:
+        print "-tune must be one of 'none' or 'fast'."
+        sys.exit(1)
+    if args.workers is not None and args.workers < 1:
+        print "-workers must be positive."
+        sys.exit(1)
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+
+    jobs = make_jobs(inputs, args.N, Ks, dmeasures, policies, opts)
+    run_jobs(args.dbname, args.user, args.port, args.outdir, jobs, args.workers,
+            {"storage": args.storage, "profile": args.tune})
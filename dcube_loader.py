@@ -0,0 +1,568 @@
+#################################################
+## Parallel loader of the input tensor for D-CUBE
+##
+## The input file is split into byte ranges which are parsed in a process pool;
+## duplicate entries are aggregated before anything is sent to PostgreSQL. Each parser
+## hash-partitions its entries into one spill file per loader, and each loader merges
+## the files of its part and streams them through its own connection with binary COPY,
+## so that the parsed entries never pass through the main process.
+##
+## In append mode, the loaded relation is kept across runs, and each new file is merged
+## into it, along with the distinct values of each dimension and the total mass.
+##
+## Text inputs may be compressed (.gz, or .zst with zstandard), and are then streamed.
+## Pre-encoded tensors (the integer codes and the distinct values of each dimension, and
+## the mass, as .npy arrays or in a .npz file) are read with NumPy, memory-mapped, and
+## loaded with binary COPY, or given as they are to the NumPy implementation.
+##
+## Dependency: Psycopg2 (Access PostgreSQL with Python);
+## zstandard for .zst inputs, NumPy for pre-encoded tensors
+#################################################
+
+import argparse, glob, gzip, itertools, marshal, os, shutil, struct, sys, tempfile
+from io import BytesIO
+from multiprocessing import Pool, cpu_count
+import psycopg2
+from dcube_utils import create_table
+
+## header and trailer of PostgreSQL's binary COPY format
+PGCOPY_HEADER = "PGCOPY\n\377\r\n\0" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+
+
+def tensor_name(file_name):
+    """
+    The name of a tensor file: its base name without the .csv[.gz|.zst] or .npz extension.
+    """
+    name = os.path.basename(os.path.normpath(file_name))
+    return name.split(".csv")[0].split(".npz")[0]
+
+
+def is_compressed(file_name):
+    """
+    Whether a text input file is compressed, with gzip (.gz) or zstd (.zst).
+    """
+    return file_name.endswith(".gz") or file_name.endswith(".zst")
+
+
+def is_tensor_arrays(file_name):
+    """
+    Whether an input is a pre-encoded tensor: a directory of .npy arrays or a .npz file.
+    """
+    return os.path.isdir(file_name) or file_name.endswith(".npz")
+
+
+def open_tensor_file(file_name):
+    """
+    Open a text input file for reading; .gz and .zst files are decompressed on the fly.
+    """
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, mode="rb")
+    elif file_name.endswith(".zst"):
+        ## zstandard is only needed for .zst files
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(file_name, mode="rb"))
+    else:
+        return open(file_name, mode="rt")
+
+
+def read_chunks(fin, chunk_size):
+    """
+    Read a stream in chunks of about chunk_size bytes, which end with whole lines.
+    Args:
+        fin: a file-like object, read with read() only
+        chunk_size: number of bytes read at a time
+    """
+    rest = ""
+    while True:
+        data = fin.read(chunk_size)
+        if not data:
+            break
+        data = rest + data
+        cut = data.rfind("\n") + 1
+        (data, rest) = (data[:cut], data[cut:])
+        if data:
+            yield data
+    if rest:
+        yield rest
+
+
+def load_tensor_file(DSN, cur, file_name, data_table, col_names, X_name, sep=",",
+            count=False, workers=None, chunk_size=16*1024*1024, storage="logged"):
+    """
+    Load a tensor from file into a new relation, aggregating duplicate entries.
+    The entries are hash-partitioned into about one part per chunk_size bytes of the
+    input (and at least one per worker), so that each process holds the entries of one
+    chunk while parsing, and of one part while loading, whatever the size of the file.
+    Args:
+        DSN: connection string of the database, used by the parallel loaders
+        cur: cursor of database connection, used to create the relation
+        file_name: file to load data from; a compressed file is read as a stream
+        data_table: name of the relation to create
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        sep: delimiter for the input file; "," for .csv
+        count: if True, each line of the file has the N attributes only, and the measure
+                is the number of times the entry appears (double precision is replaced by
+                bigint, as with count(*)); otherwise each line has N+1 columns, where the
+                last column is the mass, and the masses of duplicate entries are summed
+        workers: number of processes and connections; default is the number of CPUs
+        chunk_size: number of bytes of the file parsed by each task, and of the input
+                of each part
+        storage: "logged", "unlogged" or "temp", the kind of the relation;
+                temporary relations are only visible to cur, so they are loaded through it
+    Returns:
+        the number of entries in the relation
+    """
+    if workers is None:
+        workers = cpu_count()
+    workers = max(1, workers)
+    N = len(col_names)
+    X_fmt = "bigint" if count else "double precision"
+    columns = [col_names[n] + " varchar" for n in range(N)] + [X_name + " " + X_fmt]
+    cur.execute(create_table(storage) + " %s (%s);" % (data_table, ",".join(columns)))
+
+    ## compressed files are assumed to be about 4 times smaller than their text
+    size = os.path.getsize(file_name) * (4 if is_compressed(file_name) else 1)
+    n_parts = max(workers, (size + chunk_size - 1) // max(1, chunk_size))
+
+    ## parse and aggregate the byte ranges; each of them is spilled in one file per part
+    spill_dir = tempfile.mkdtemp(prefix="dcube_load_")
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        if is_compressed(file_name):
+            ## a compressed file cannot be split into byte ranges: its chunks are read in
+            ## turn, and at most one of them per worker is read ahead of the parsers
+            with open_tensor_file(file_name) as fin:
+                tasks = ((parse_data, (data, sep, N, count, n_parts),
+                            os.path.join(spill_dir, "c%d" % i))
+                            for (i, data) in enumerate(read_chunks(fin, chunk_size)))
+                while True:
+                    batch = list(itertools.islice(tasks, workers))
+                    if not batch:
+                        break
+                    run_tasks(pool, spill_parts, batch)
+        else:
+            run_tasks(pool, spill_parts, [(parse_chunk,
+                        (file_name, start, end, sep, N, count, n_parts),
+                        os.path.join(spill_dir, "c%d" % i)) for (i, (start, end)) in
+                        enumerate(split_file(file_name, chunk_size))])
+
+        ## merge and load the parts; the relation must be committed before other
+        ## connections can see it
+        copy_sql = "COPY %s (%s) FROM STDIN WITH (FORMAT binary);" % (
+                    data_table, ",".join(col_names + [X_name]))
+        jobs = [(DSN, copy_sql, count, glob.glob(os.path.join(spill_dir, "c*_p%d" % p)))
+                for p in range(n_parts)]
+        if pool is not None and storage != "temp":
+            cur.connection.commit()
+            n_entries = sum(pool.map(load_part, jobs))
+        else:
+            n_entries = sum([load_part(job, cur) for job in jobs])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        shutil.rmtree(spill_dir)
+    return n_entries
+
+
+def run_tasks(pool, function, tasks):
+    """
+    Run a function on each task, in the pool if it is not None.
+    """
+    if pool is not None:
+        return pool.map(function, tasks)
+    else:
+        return map(function, tasks)
+
+
+def spill_parts(args):
+    """
+    Parse a chunk of the input, and write each part of its entries to a spill file.
+    Args:
+        args: (parse, parse_args, prefix), where parse is parse_chunk or parse_data,
+                and the p-th part is written to <prefix>_p<p> with marshal
+    Returns:
+        the number of entries of the chunk
+    """
+    (parse, parse_args, prefix) = args
+    parts = parse(parse_args)
+    for (p, part) in enumerate(parts):
+        if part:
+            with open("%s_p%d" % (prefix, p), mode="wb") as fout:
+                marshal.dump(part, fout)
+    return sum([len(part) for part in parts])
+
+
+def split_file(file_name, chunk_size):
+    """
+    Split a file into byte ranges of about chunk_size bytes.
+    A line belongs to the range in which it starts.
+    Args:
+        file_name: the file to split
+        chunk_size: number of bytes in each range
+    """
+    size = os.path.getsize(file_name)
+    starts = range(0, size, max(1, chunk_size))
+    return [(start, min(start + chunk_size, size)) for start in starts]
+
+
+def parse_chunk(args):
+    """
+    Parse the lines starting in a byte range of the input file, and aggregate the mass
+    of duplicate entries.
+    Args:
+        args: (file_name, start, end, sep, N, count, n_parts), where lines starting
+                in [start, end) are parsed, and the entries are hash-partitioned into
+                n_parts dicts
+    Returns:
+        a list of n_parts dicts from the entries (tuples of N values) to their mass
+    """
+    (file_name, start, end, sep, N, count, n_parts) = args
+    with open(file_name, mode="rb") as fin:
+        if start > 0:
+            ## the line which contains the byte start-1 belongs to the previous range
+            fin.seek(start - 1)
+            fin.readline()
+        begin = fin.tell()
+        data = fin.read(max(0, end - begin))
+        ## the last line starting in the range may end after it
+        if data and not data.endswith("\n"):
+            data += fin.readline()
+    return parse_data((data, sep, N, count, n_parts))
+
+
+def parse_data(args):
+    """
+    Parse lines of the input, and aggregate the mass of duplicate entries.
+    Args:
+        args: (data, sep, N, count, n_parts), where data are whole lines, and the entries
+                are hash-partitioned into n_parts dicts
+    Returns:
+        a list of n_parts dicts from the entries (tuples of N values) to their mass
+    """
+    (data, sep, N, count, n_parts) = args
+    parts = [{} for p in range(n_parts)]
+    for line in data.splitlines():
+        if line:
+            fields = line.split(sep)
+            if count:
+                (entry, mass) = (tuple(fields), 1)
+            else:
+                (entry, mass) = (tuple(fields[:-1]), float(fields[-1]))
+            if len(entry) != N:
+                raise ValueError("expected %d columns but found %d in line '%s'." %
+                    (N if count else N+1, len(fields), line))
+            part = parts[hash(entry) % n_parts]
+            part[entry] = part.get(entry, 0) + mass
+    return parts
+
+
+def load_part(args, cur=None):
+    """
+    Merge the spill files of one part and stream the entries with binary COPY.
+    Args:
+        args: (DSN, copy_sql, count, spill_files), where all the spill files have the
+                same part of the entries, and copy_sql is the COPY ... FROM STDIN command
+        cur: cursor of database connection; if None, a new connection to DSN is used
+    Returns:
+        the number of loaded entries
+    """
+    (DSN, copy_sql, count, spill_files) = args
+    merged = {}
+    for spill_file in spill_files:
+        with open(spill_file, mode="rb") as fin:
+            part = marshal.load(fin)
+        if not merged:
+            merged = part
+            continue
+        for (entry, mass) in part.iteritems():
+            merged[entry] = merged.get(entry, 0) + mass
+        del part
+
+    data = LineReader(iter_copy_binary(merged, count))
+    if cur is not None:
+        cur.copy_expert(copy_sql, data, size=1024*1024)
+    else:
+        with psycopg2.connect(DSN) as conn:
+            with conn.cursor() as cur:
+                cur.copy_expert(copy_sql, data, size=1024*1024)
+        conn.close()
+    return len(merged)
+
+
+def iter_copy_binary(entries, count, batch_size=10000):
+    """
+    Encode the entries in the binary COPY format, as a stream of strings of up to
+    batch_size entries each.
+    Args:
+        entries: dict from tuples of values to their mass
+        count: if True, the mass is encoded as bigint; otherwise as double precision
+        batch_size: number of entries in each string
+    """
+    mass_struct = struct.Struct(">iq" if count else ">id")
+    row_header = struct.pack(">h", len(next(entries.iterkeys())) + 1) if entries else ""
+    ## the values repeat across entries, so each of them is encoded once;
+    ## \N is NULL, as in the text format of COPY
+    encoded = {"\\N": struct.pack(">i", -1)}
+    yield PGCOPY_HEADER
+    buf = []
+    for (entry, mass) in entries.iteritems():
+        buf.append(row_header)
+        for value in entry:
+            field = encoded.get(value)
+            if field is None:
+                field = struct.pack(">i", len(value)) + value
+                encoded[value] = field
+            buf.append(field)
+        buf.append(mass_struct.pack(8, mass))
+        if len(buf) >= batch_size * (len(entry) + 2):
+            yield "".join(buf)
+            buf = []
+    buf.append(PGCOPY_TRAILER)
+    yield "".join(buf)
+
+
+class LineReader(object):
+    """
+    A file-like object over an iterator of lines (or of any strings), to stream them
+    into COPY.
+    """
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buf = ""
+
+    def read(self, size=-1):
+        chunks, n = [self._buf], len(self._buf)
+        while size < 0 or n < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            n += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buf = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        if not self._buf:
+            return next(self._lines, "")
+        (line, sep, rest) = self._buf.partition("\n")
+        self._buf = rest
+        return line + sep
+
+
+def read_tensor_arrays(file_name, col_names, X_name):
+    """
+    Read a pre-encoded tensor, which has for each dimension <name> the array <name> of
+    the integer code of each entry and the array <name>_values of its distinct values,
+    and the array X_name of the mass of each entry (see encode_tensor_file, and the
+    "columnar" block format in dcube_output.py without pyarrow).
+    Args:
+        file_name: a directory of <array>.npy files, which are memory-mapped,
+                or a .npz file, which is read into memory
+        col_names: column names of the N dimensions
+        X_name: column name of the measure attribute
+    Returns:
+        (values, codes, mass), where values[n] are the distinct values of the n-th
+        dimension, and codes[n] is the index of each entry into values[n]
+    """
+    ## NumPy is only needed for pre-encoded tensors
+    import numpy as np
+    if os.path.isdir(file_name):
+        read = lambda name: np.load(os.path.join(file_name, name + ".npy"), mmap_mode="r")
+        missing = IOError
+    else:
+        arrays = np.load(file_name)
+        read = lambda name: arrays[name]
+        missing = KeyError
+    try:
+        values = [read(name + "_values") for name in col_names]
+        codes = [read(name) for name in col_names]
+        mass = read(X_name)
+    except missing:
+        raise ValueError("%s must have the arrays %s." % (file_name,
+                ", ".join([name + ", " + name + "_values" for name in col_names] + [X_name])))
+    return (values, codes, mass)
+
+
+def load_tensor_arrays(cur, file_name, data_table, col_names, X_name, storage="logged",
+                    batch_size=1000000):
+    """
+    Load a pre-encoded tensor (see read_tensor_arrays) into a new relation, with binary
+    COPY; the values of each dimension are encoded once, and the entries are streamed
+    from the arrays in batches of batch_size.
+    Args:
+        cur: cursor of database connection
+        file_name: a directory of .npy arrays, or a .npz file
+        data_table: name of the relation to create
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        storage: "logged", "unlogged" or "temp", the kind of the relation
+        batch_size: number of entries in each COPY
+    Returns:
+        the number of entries in the relation
+    """
+    (values, codes, mass) = read_tensor_arrays(file_name, col_names, X_name)
+    N = len(col_names)
+    columns = [col_names[n] + " varchar" for n in range(N)] + [X_name + " double precision"]
+    cur.execute(create_table(storage) + " %s (%s);" % (data_table, ",".join(columns)))
+    copy_sql = "COPY %s (%s) FROM STDIN WITH (FORMAT binary);" % (
+                data_table, ",".join(col_names + [X_name]))
+
+    ## the field of each distinct value; \N is NULL, as in the text format of COPY
+    fields = [[struct.pack(">i", -1) if value == "\\N" else
+                struct.pack(">i", len(value)) + value
+                for value in [str(value) for value in values[n]]] for n in range(N)]
+    row_header = struct.pack(">h", N + 1)
+    mass_struct = struct.Struct(">id")
+    for start in range(0, len(mass), batch_size):
+        end = min(start + batch_size, len(mass))
+        batch = [[fields[n][code] for code in codes[n][start:end].tolist()]
+                    for n in range(N)]
+        buf = [PGCOPY_HEADER]
+        for (i, x) in enumerate(mass[start:end].tolist()):
+            buf.append(row_header)
+            buf.extend([column[i] for column in batch])
+            buf.append(mass_struct.pack(8, x))
+        buf.append(PGCOPY_TRAILER)
+        cur.copy_expert(copy_sql, BytesIO("".join(buf)))
+    return len(mass)
+
+
+def encode_tensor_file(file_name, outdir, col_names, X_name, sep=",", count=False,
+                    chunk_size=64*1024*1024):
+    """
+    Encode a text input file, which may be compressed, as a pre-encoded tensor: a
+    directory of .npy arrays (see read_tensor_arrays), with the distinct values of each
+    dimension sorted. Duplicate entries are aggregated, as in load_tensor_file.
+    Args:
+        file_name: file to read the tensor from
+        outdir: the directory of the arrays; it is created if it does not exist
+        col_names: column names of the N dimensions
+        X_name: column name of the measure attribute
+        sep: delimiter for the input file; "," for .csv
+        count: if True, each line has the N attributes only, and the measure is the
+                number of times the entry appears
+        chunk_size: number of bytes parsed at a time
+    Returns:
+        the number of entries of the tensor
+    """
+    import numpy as np
+    N = len(col_names)
+    merged = {}
+    with open_tensor_file(file_name) as fin:
+        for data in read_chunks(fin, chunk_size):
+            for (entry, mass) in parse_data((data, sep, N, count, 1))[0].iteritems():
+                merged[entry] = merged.get(entry, 0) + mass
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    entries = merged.keys()
+    for n in range(N):
+        (values, codes) = np.unique(np.array([entry[n] for entry in entries]),
+                                    return_inverse=True)
+        np.save(os.path.join(outdir, col_names[n] + "_values.npy"), values)
+        np.save(os.path.join(outdir, col_names[n] + ".npy"), codes.astype(np.int32))
+    np.save(os.path.join(outdir, X_name + ".npy"),
+            np.array([merged[entry] for entry in entries], dtype=np.float64))
+    return len(entries)
+
+
+def append_tensor(cur, delta_table, data_table, col_names, X_name, X_fmt="double precision",
+                storage="logged", keep_new=False):
+    """
+    Merge the entries of delta_table into data_table, which is created if it does not
+    exist; the masses of the entries already in data_table are summed (upsert).
+    The distinct values of each dimension and their mass are kept in <data_table>_R<n>,
+    and the total mass and number of entries in <data_table>_stats, so that neither the
+    merge nor D-Cube compute them from data_table (see persistent in dcube()).
+    delta_table is dropped.
+    Args:
+        cur: cursor of database connection
+        delta_table: the relation with the new entries, which may have duplicates
+        data_table: the relation kept across runs, which may be schema-qualified
+        col_names: column names of the relations for the N dimensions
+        X_name: column name of the measure attribute
+        X_fmt: type of the measure attribute
+        storage: "logged" or "unlogged", the kind of the relations which are kept;
+                temporary relations would not outlive the session
+        keep_new: whether to keep the distinct values of each dimension in delta_table
+                in <data_table>_new<n>, replacing those of the previous merge, for the
+                warm start of D-Cube (see find_warm_block in dcube_sql_copy.py)
+    Returns:
+        (n_new, n_entries), the number of entries of delta_table that were not
+        in data_table, and the number of entries of data_table after the merge
+    """
+    N = len(col_names)
+    cols = ",".join(col_names)
+    cur.execute("SELECT to_regclass('%s') IS NULL;" % data_table)
+    if cur.fetchone()[0]:
+        columns = [col_names[n] + " varchar" for n in range(N)] + [X_name + " " + X_fmt]
+        cur.execute(create_table(storage) + " %s (%s);" % (data_table, ",".join(columns)))
+        cur.execute("CREATE UNIQUE INDEX %s_entries ON %s (%s);" % 
+                    (data_table.split(".")[-1], data_table, cols))
+        for n in range(N):
+            cur.execute(create_table(storage) + 
+                " %s_R%d (value varchar PRIMARY KEY, mass double precision);" % (data_table, n))
+        cur.execute(create_table(storage) + 
+                    " %s_stats (par varchar(40) PRIMARY KEY, value double precision);" % data_table)
+        cur.execute("INSERT INTO %s_stats VALUES ('total_mass', 0), ('entries', 0);" % data_table)
+
+    ## upsert the aggregated new entries; xmax is 0 for the inserted rows
+    cur.execute(("WITH merged AS (INSERT INTO %s as T (%s, %s) " % (data_table, cols, X_name))
+        + ("SELECT %s, sum(%s) FROM %s GROUP BY %s " % (cols, X_name, delta_table, cols))
+        + ("ON CONFLICT (%s) DO UPDATE SET %s=T.%s+EXCLUDED.%s " % 
+            (cols, X_name, X_name, X_name))
+        + "RETURNING xmax = 0 as inserted) SELECT count(*) FILTER (WHERE inserted) FROM merged;")
+    n_new = cur.fetchone()[0]
+    for n in range(N):
+        cur.execute(("INSERT INTO %s_R%d as T SELECT %s, sum(%s) FROM %s GROUP BY %s " % 
+                        (data_table, n, col_names[n], X_name, delta_table, col_names[n]))
+            + "ON CONFLICT (value) DO UPDATE SET mass=T.mass+EXCLUDED.mass;")
+    cur.execute(("UPDATE %s_stats SET value=value+" % data_table)
+        + ("(SELECT coalesce(sum(%s), 0) FROM %s) WHERE par='total_mass';" % 
+            (X_name, delta_table)))
+    cur.execute(("UPDATE %s_stats SET value=value+%d " % (data_table, n_new))
+        + "WHERE par='entries' RETURNING value;")
+    n_entries = int(cur.fetchone()[0])
+    if keep_new:
+        for n in range(N):
+            cur.execute("DROP TABLE IF EXISTS %s_new%d;" % (data_table, n))
+            cur.execute(create_table(storage) + " %s_new%d AS SELECT DISTINCT %s as value FROM %s;" %
+                        (data_table, n, col_names[n], delta_table))
+    cur.execute("DROP TABLE %s;" % delta_table)
+    return (n_new, n_entries)
+
+
+if __name__ == "__main__":
+    ## encode a text input file once, so that it can be given to dcube.py -in as it is
+    parser = argparse.ArgumentParser(
+        description="Encode a tensor file as a directory of .npy arrays for D-Cube.")
+    parser.add_argument("file_name", type=str,
+        help="the .csv file to encode, which may be compressed (.gz or .zst)")
+    parser.add_argument("outdir", type=str, help="the directory of the arrays")
+    parser.add_argument("-N", "--N", type=int, required=True,
+        help="number of dimensions of the tensor")
+    parser.add_argument("-columns", "--columns", type=str, default=None,
+        help="""comma-separated names of the dimensions; default is D0,...,D<N-1>, as in
+        dcube.py -data custom (e.g. src,dst,time for -data darpa)""")
+    parser.add_argument("-count", "--count", action="store_true",
+        help="""each line has the N attributes only, and the measure is the number of
+        times the entry appears, as in the datasets of dcube.py -data""")
+    args = parser.parse_args()
+
+    if args.columns is not None:
+        col_names = args.columns.split(",")
+    else:
+        col_names = ["D"+str(n) for n in range(args.N)]
+    if len(col_names) != args.N:
+        print "-columns must have N names."
+        sys.exit(1)
+    n_entries = encode_tensor_file(args.file_name, args.outdir, col_names, "measure",
+                                    count=args.count)
+    print ("%d entries are encoded in '%s'." % (n_entries, args.outdir))
@@ -0,0 +1,342 @@
+#################################################
+## D-CUBE
+## using in-memory "NumPy" implementation
+##
+## Dependency: NumPy; Psycopg2 is only used to read the relation once
+#################################################
+
+import math
+import numpy as np
+from dcube_output import block_file, open_block_file, write_columnar, update_manifest
+from dcube_utils import compute_density, init_density, update_density
+
+
+def dcube_numpy(original_data_table, col_names, X_name, K, N, cur,
+            dmeasure="arithmetic", policy="cardinality",
+            outdir="out/", out_prefix="out", verbose=True, out_format="csv", tensor=None):
+    """
+    D-Cube algorithm. Find K dense blocks in a given tensor.
+    The relation is read from the database once, and everything else is done in memory.
+    Args:
+        original_data_table: name of the data relation; it has N+1 columns,
+                where the first N columns for the N dimensions with names col_names,
+                and the last column specifying the measure attribute with name X_name.
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        K: number of blocks
+        N: number of dimension
+        cur: cursor of database connection
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        policy: "cardinality" or "density"
+        outdir: output directory
+        out_prefix: prefix of the output results
+        verbose: whether to print the finded block to stdout
+        out_format: the format of the block files, one of OUT_FORMATS in dcube_output.py
+                except "binary", which only PostgreSQL writes
+        tensor: if given, the pre-encoded tensor (values, codes, mass), e.g. memory-mapped
+                by read_tensor_arrays in dcube_loader.py, which is used instead of
+                reading original_data_table
+    """
+    if out_format == "binary":
+        raise ValueError("out_format 'binary' is not supported by the NumPy implementation.")
+
+    ## initialization: integer-encode the relation
+    if tensor is not None:
+        (values, codes, mass) = sort_dictionaries(*tensor)
+    else:
+        (values, codes, mass) = load_tensor(original_data_table, col_names, X_name, N, cur)
+    card_R = [len(values[n]) for n in range(N)]
+    alive = np.ones(len(mass), dtype=bool)
+    total_mass = mass.sum()
+
+    ## repeatedly find dense sub-blocks
+    for k in range(K):
+        ## find single block
+        print ("Start finding the %d-th block ..." % (k+1))
+        final_B = find_single_block_numpy(codes, mass, alive, card_R, total_mass,
+                        N, dmeasure, policy)
+
+        in_block = save_block_numpy(values, codes, mass, final_B,
+                        k, N, outdir, out_prefix, verbose, col_names, X_name, out_format,
+                        alive)
+
+        ## remove the entries in the found block from data table
+        alive &= ~in_block
+        ## update total mass
+        total_mass = mass[alive].sum()
+
+        ## if no entries or no mass are left in the table, stop the loop
+        if not alive.any() or total_mass == 0:
+            print ("Algorithm stopped after finding %d blocks because no mass is left." %
+                (k+1))
+            break
+
+
+def find_single_block_numpy(codes, mass, alive, card_R, total_mass,
+            N, dmeasure, policy):
+    """
+    Args:
+        codes: list of N integer arrays, the encoded attribute values of each entry
+        mass: array of the measure attribute of each entry
+        alive: boolean array, whether each entry is still in the relation "R"
+        card_R: list of cardinalities of R_1, ..., R_N
+        total_mass: current total mass of R
+        N: number of dimension
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        policy: "cardinality" or "density"
+    Returns:
+        A list of N boolean arrays, indicating the values in each dimension of the block.
+    """
+    ## initialize: Btable, Bn(value, mass) and the cardinality of each Bn
+    B_codes = [codes[n][alive] for n in range(N)]
+    B_entries = mass[alive].astype(float)
+    in_B, B_n = [], []
+    for n in range(N):
+        in_B.append(np.bincount(B_codes[n], minlength=card_R[n]) > 0)
+        B_n.append(np.bincount(B_codes[n], weights=B_entries, minlength=card_R[n]))
+    card_B = [float(in_B[n].sum()) for n in range(N)]
+    B_mass = float(total_mass)
+
+    (max_dens, avg_card) = init_density(None, N, dmeasure,
+                                density_params(B_mass, card_B, card_R, total_mass, N))
+    R_mass = float(total_mass)
+    curr_order, max_order, density = 1, 1, max_dens
+    rm_value, rm_dim = [], []
+
+    ## repeatedly remove all entries in Btable
+    while any(card > 0 for card in card_B):
+        ## select dimension to remove
+        n_rm = select_dimension_numpy(B_n, in_B, B_mass, card_B, card_R, total_mass,
+                        N, policy, dmeasure)
+
+        ## entries that have mass smaller than the average will be removed
+        card = card_B[n_rm]
+        avg_mass = B_mass/card
+        candidates = np.flatnonzero(in_B[n_rm] & (B_n[n_rm] <= avg_mass))
+        candidates = candidates[np.argsort(B_n[n_rm][candidates], kind="mergesort")]
+
+        ## delete entries in B_rm in increasing order of mass
+        for (curr_value, curr_mass) in zip(candidates, B_n[n_rm][candidates]):
+            ## record the delete order
+            rm_value.append(curr_value)
+            rm_dim.append(n_rm)
+            curr_order += 1
+
+            ## new density, cardinality, and B_mass
+            (density, card, B_mass, avg_card) = update_density(density, N, dmeasure,
+                                        B_mass, card, float(curr_mass), avg_card, R_mass)
+            ## update maximal density
+            if density > max_dens:
+                max_dens, max_order = density, curr_order
+        card_B[n_rm] = card
+        in_B[n_rm][candidates] = False
+
+        ## "remove" these entries from Btable, then re-compute the mass of each Bn
+        removed = np.zeros(card_R[n_rm], dtype=bool)
+        removed[candidates] = True
+        kept = ~removed[B_codes[n_rm]]
+        B_codes = [B_codes[n][kept] for n in range(N)]
+        B_entries = B_entries[kept]
+        for n in range(N):
+            if n != n_rm:
+                B_n[n] = np.bincount(B_codes[n], weights=B_entries, minlength=card_R[n])
+
+    ## reconstruct the dense block
+    final_B = [np.zeros(card_R[n], dtype=bool) for n in range(N)]
+    for (value, n) in zip(rm_value[max_order-1:], rm_dim[max_order-1:]):
+        final_B[n][value] = True
+    return final_B
+
+
+def density_params(B_mass, card_B, card_R, total_mass, N):
+    """
+    The client-side parameters of the current block, which compute_density and
+    init_density in dcube_utils read.
+    Args:
+        B_mass: total mass of B
+        card_B: list of cardinalities of B_1, ..., B_N
+        card_R: list of cardinalities of R_1, ..., R_N
+        total_mass: total mass of R
+        N: number of dimensions
+    """
+    params = {"B_mass": B_mass, "total_mass": float(total_mass)}
+    for n in range(N):
+        params["card_B%d" % n] = card_B[n]
+        params["card_R%d" % n] = card_R[n]
+    return params
+
+
+def select_dimension_numpy(B_n, in_B, B_mass, card_B, card_R, total_mass,
+            N, policy, dmeasure):
+    """
+    Select the next dimension to remove, same as select_dimension in dcube_utils.
+    Args:
+        B_n: list of arrays, the mass of each value in B_1, ..., B_N
+        in_B: list of boolean arrays, whether each value is still in B_1, ..., B_N
+        B_mass: total mass of B
+        card_B: list of cardinalities of B_1, ..., B_N
+        card_R: list of cardinalities of R_1, ..., R_N
+        total_mass: total mass of R
+        N: number of total dimensions
+        policy: "cardinality" or "density"
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+    """
+    if policy == "cardinality":
+        max_dim, max_card = -1, -1
+        for n in range(N):
+            if card_B[n] > max_card:
+                max_dim, max_card = n, card_B[n]
+        return max_dim
+
+    elif policy == "density":
+        max_dens, max_dim = -10, 0 ## note: by construction density is always >= -1
+        params = density_params(B_mass, card_B, card_R, total_mass, N)
+        for n in range(N):
+            card = card_B[n]
+            if card > 0:
+                ## what will the density be if we remove all values with mass <= average
+                avg_mass = B_mass/float(card)
+                rm = in_B[n] & (B_n[n] <= avg_mass)
+                trial = dict(params)
+                trial["card_B%d" % n] = card - rm.sum()
+                trial["B_mass"] = B_mass - B_n[n][rm].sum()
+                density = compute_density(None, N, dmeasure, trial)
+                if density > max_dens:
+                    max_dim, max_dens = n, density
+        return max_dim
+
+    else:
+        raise ValueError("policy must be one of 'cardinality' or 'density'.")
+
+
+def load_tensor(data_table, col_names, X_name, N, cur):
+    """
+    Read the relation into memory, with each dimension encoded as integers.
+    Args:
+        data_table: name of the data relation
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        N: number of dimension
+        cur: cursor of database connection
+    Returns:
+        (values, codes, mass), where values[n] is the sorted array of distinct values
+        of the n-th dimension, codes[n] is the index of each entry into values[n],
+        and mass is the measure attribute of each entry.
+    """
+    cur.execute("SELECT %s FROM %s;" % (",".join(col_names + [X_name]), data_table))
+    rows = cur.fetchall()
+    values, codes = [], []
+    for n in range(N):
+        column = np.empty(len(rows), dtype=object)
+        column[:] = [row[n] for row in rows]
+        (uniq, inverse) = np.unique(column, return_inverse=True)
+        values.append(uniq)
+        codes.append(inverse)
+    mass = np.array([row[N] for row in rows], dtype=float)
+    return (values, codes, mass)
+
+
+def sort_dictionaries(values, codes, mass):
+    """
+    Sort the distinct values of each dimension of a pre-encoded tensor, as load_tensor
+    does, so that the ties are broken in the same order; the codes of a dimension are
+    only re-mapped (and read into memory) if its values are not sorted yet.
+    Args:
+        values: list of arrays of distinct values in each dimension
+        codes: list of N integer arrays, the encoded attribute values of each entry
+        mass: array of the measure attribute of each entry
+    Returns:
+        (values, codes, mass), with mass as an array of float
+    """
+    values, codes = list(values), list(codes)
+    for n in range(len(values)):
+        if len(values[n]) > 1 and not (values[n][:-1] <= values[n][1:]).all():
+            order = np.argsort(values[n], kind="mergesort")
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            (values[n], codes[n]) = (values[n][order], rank[codes[n]])
+    return (values, codes, np.asarray(mass, dtype=float))
+
+
+def save_block_numpy(values, codes, mass, final_B, k, N, outdir, out_prefix, verbose,
+            col_names=None, X_name="measure", out_format="csv", alive=None):
+    """
+    Save the k-th block, in the same format as save_block in dcube_sql_copy.
+    Args:
+        values: list of arrays of distinct values in each dimension
+        codes: list of N integer arrays, the encoded attribute values of each entry
+        mass: array of the measure attribute of each entry
+        final_B: list of N boolean arrays, the values in each dimension of the block
+        k: the current block to construct
+        N: number of dimension
+        outdir: output directory
+        out_prefix: prefix of the output results
+        verbose: whether to print the finded block to stdout
+        col_names: column names of the N dimensions, for the "columnar" format
+        X_name: column name of the measure attribute, for the "columnar" format
+        out_format: the format of the file, one of OUT_FORMATS except "binary"
+        alive: boolean array of the entries not in earlier blocks, for the mass of the
+                block in the manifest; if None, all the entries
+    Returns:
+        A boolean array indicating the entries in the block.
+    """
+    ## cunstruct the dense block
+    in_block = np.ones(len(mass), dtype=bool)
+    for n in range(N):
+        in_block &= final_B[n][codes[n]]
+
+    ## print block results to stdout
+    if verbose:
+        print ("\tFound block %d:" % (k+1))
+        for n in range(N):
+            print ("\tdimension %d:" % n)
+            print ("\t" + str([(value,) for value in values[n][final_B[n]]]))
+
+    ## save the block to disk
+    outfile = block_file(outdir, out_prefix, k, out_format)
+    col_names = col_names or ["D"+str(n) for n in range(N)]
+    if out_format == "columnar":
+        ## the codes of the block are re-numbered among its own values
+        uniques = [np.unique(codes[n][in_block], return_inverse=True) for n in range(N)]
+        write_columnar(outfile, col_names, X_name, [values[n][uniques[n][0]] for n in range(N)],
+                        [uniques[n][1] for n in range(N)], mass[in_block])
+    else:
+        fout = open_block_file(outfile, out_format)
+        try:
+            for i in np.flatnonzero(in_block):
+                fout.write(",".join([copy_text(values[n][codes[n][i]]) for n in range(N)] +
+                                    [format_mass(mass[i])]) + "\n")
+        finally:
+            fout.close()
+    update_manifest(outdir, out_prefix, k, outfile, out_format, col_names + [X_name],
+                    in_block.sum(), mass[in_block if alive is None else in_block & alive].sum())
+    print ("\tThe %d-th block is written to file '%s'." % (k+1, outfile))
+    return in_block
+
+
+def copy_text(value):
+    """
+    Format an attribute value the same way as PostgreSQL COPY in text format,
+    with ',' as the delimiter.
+    """
+    if value is None:
+        return "\\N"
+    value = str(value)
+    for (char, escaped) in [("\\", "\\\\"), ("\n", "\\n"), ("\r", "\\r"),
+                            ("\t", "\\t"), (",", "\\,")]:
+        value = value.replace(char, escaped)
+    return value
+
+
+def format_mass(x):
+    """
+    Format a mass the same way as PostgreSQL prints a double precision value.
+    """
+    if math.isinf(x):
+        return "Infinity" if x > 0 else "-Infinity"
+    elif math.isnan(x):
+        return "NaN"
+    elif x == int(x) and abs(x) < 1e15:
+        return "%d" % x
+    else:
+        return repr(float(x))
@@ -0,0 +1,223 @@
+#################################################
+## Output formats of the blocks found by D-CUBE
+##
+## "csv" is the text COPY format with ',' as the delimiter; "csv.gz" and "csv.zst"
+## compress it on the fly; "binary" is the binary COPY format of PostgreSQL;
+## "columnar" writes each dimension as a dictionary (the distinct values) and the
+## int32 codes of the entries, to Parquet if pyarrow is installed, or else to .npz.
+## A manifest <prefix>_manifest.json indexes the files of all the blocks, with the
+## number of entries in each file and the mass of each block when it was found.
+##
+## Dependency: Psycopg2 (Access PostgreSQL with Python);
+## zstandard for "csv.zst", pyarrow or NumPy for "columnar"
+#################################################
+
+import gzip, json, os
+import psycopg2
+
+OUT_FORMATS = ["csv", "csv.gz", "csv.zst", "binary", "columnar"]
+
+## number of entries fetched at a time when a block is written in the columnar format
+COLUMNAR_BATCH_SIZE = 10000
+
+
+def columnar_extension():
+    """
+    The extension of the "columnar" files: ".parquet" if pyarrow is installed,
+    or else ".npz".
+    """
+    try:
+        import pyarrow
+        return ".parquet"
+    except ImportError:
+        return ".npz"
+
+
+def block_file(outdir, out_prefix, k, out_format="csv"):
+    """
+    The path of the file of the k-th block.
+    Args:
+        outdir: output directory
+        out_prefix: prefix of the output results
+        k: the block, from 0
+        out_format: one of OUT_FORMATS
+    """
+    if out_format == "binary":
+        extension = ".bin"
+    elif out_format == "columnar":
+        extension = columnar_extension()
+    else:
+        extension = "." + out_format
+    return outdir+"/"+out_prefix+"_block"+str(k+1)+extension
+
+
+def open_block_file(outfile, out_format="csv"):
+    """
+    Open the file of a block for writing, compressed according to out_format.
+    """
+    if out_format == "csv.gz":
+        return gzip.open(outfile, mode="wb")
+    elif out_format == "csv.zst":
+        ## zstandard is only needed for this format
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(open(outfile, mode="wb"))
+    elif out_format == "binary":
+        return open(outfile, mode="wb")
+    else:
+        return open(outfile, mode="wt")
+
+
+def write_block_table(table, col_names, X_name, k, cur, outdir, out_prefix,
+                    out_format="csv"):
+    """
+    Write the relation of the k-th block to a file. It is added to the manifest with
+    update_manifest once its mass is known, when its entries are removed.
+    Args:
+        table: the relation holding the block, with the columns col_names and X_name
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        k: the block, from 0
+        cur: cursor of database connection
+        outdir: output directory
+        out_prefix: prefix of the output results
+        out_format: one of OUT_FORMATS
+    Returns:
+        (outfile, entries), the path of the written file and its number of entries.
+    """
+    outfile = block_file(outdir, out_prefix, k, out_format)
+    if out_format == "columnar":
+        ## the block is read and encoded in batches
+        named = cur.connection.cursor("dcube_write_block%d" % k)
+        try:
+            named.execute("SELECT %s FROM %s;" % (",".join(col_names + [X_name]), table))
+            entries = write_columnar_batches(outfile, col_names, X_name,
+                            iter(lambda: named.fetchmany(COLUMNAR_BATCH_SIZE), []))
+        finally:
+            named.close()
+    else:
+        fout = open_block_file(outfile, out_format)
+        try:
+            if out_format == "binary":
+                cur.copy_expert("COPY %s TO STDOUT (FORMAT binary);" % table, fout)
+            else:
+                cur.copy_to(fout, table, sep=',')
+            ## the number of entries written is the row count of the COPY
+            entries = cur.rowcount
+        finally:
+            fout.close()
+    return (outfile, entries)
+
+
+def write_columnar_batches(outfile, col_names, X_name, batches):
+    """
+    Write a block in the columnar format from batches of its entries, so that the
+    block is never held as Python objects at once. With pyarrow, each batch is a row
+    group of the Parquet file with its own dictionaries; with NumPy, the codes and the
+    mass of each batch are kept as arrays until the .npz file is written.
+    Args:
+        outfile: path of the file, ending with columnar_extension()
+        col_names: column names of the N dimensions
+        X_name: column name of the measure attribute
+        batches: iterable of lists of entries, each with the N values and the mass
+    Returns:
+        The number of entries written.
+    """
+    N = len(col_names)
+    entries = 0
+    if outfile.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([pa.field(name, pa.dictionary(pa.int32(), pa.string()))
+                            for name in col_names] + [pa.field(X_name, pa.float64())])
+        writer = pq.ParquetWriter(outfile, schema)
+        try:
+            for batch in batches:
+                arrays = []
+                for n in range(N):
+                    dictionary = {}
+                    codes = [dictionary.setdefault(row[n], len(dictionary)) for row in batch]
+                    arrays.append(pa.DictionaryArray.from_arrays(
+                                    pa.array(codes, type=pa.int32()),
+                                    pa.array(sorted(dictionary, key=dictionary.get),
+                                            type=pa.string())))
+                arrays.append(pa.array([row[-1] for row in batch], type=pa.float64()))
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                entries += len(batch)
+        finally:
+            writer.close()
+    else:
+        import numpy as np
+        dictionaries = [{} for n in range(N)]
+        codes = [[np.zeros(0, dtype=np.int32)] for n in range(N)]
+        mass = [np.zeros(0, dtype=np.float64)]
+        for batch in batches:
+            for n in range(N):
+                dictionary = dictionaries[n]
+                codes[n].append(np.fromiter((dictionary.setdefault(row[n], len(dictionary))
+                                            for row in batch), dtype=np.int32, count=len(batch)))
+            mass.append(np.fromiter((row[-1] for row in batch), dtype=np.float64,
+                                    count=len(batch)))
+            entries += len(batch)
+        write_columnar(outfile, col_names, X_name,
+                    [sorted(dictionary, key=dictionary.get) for dictionary in dictionaries],
+                    [np.concatenate(codes[n]) for n in range(N)], np.concatenate(mass))
+    return entries
+
+
+def write_columnar(outfile, col_names, X_name, values, codes, mass):
+    """
+    Write a block in the columnar format: for each dimension, the distinct values and
+    the int32 code of each entry, and the mass of each entry.
+    With pyarrow, the dimensions are dictionary columns of a Parquet file; with NumPy,
+    the arrays <name>_values, <name> (the codes) and X_name are saved in a .npz file.
+    Args:
+        outfile: path of the file, ending with columnar_extension()
+        col_names: column names of the N dimensions
+        X_name: column name of the measure attribute
+        values: list of N sequences, the distinct values of each dimension
+        codes: list of N sequences, the index in values[n] of each entry
+        mass: the mass of each entry
+    """
+    if outfile.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrays = [pa.DictionaryArray.from_arrays(pa.array(codes[n], type=pa.int32()),
+                                    pa.array(list(values[n]), type=pa.string()))
+                    for n in range(len(col_names))]
+        arrays.append(pa.array(mass, type=pa.float64()))
+        pq.write_table(pa.Table.from_arrays(arrays, names=col_names + [X_name]), outfile)
+    else:
+        ## NumPy is only needed for this format when pyarrow is missing
+        import numpy as np
+        arrays = {X_name: np.asarray(mass, dtype=np.float64)}
+        for n in range(len(col_names)):
+            arrays[col_names[n]] = np.asarray(codes[n], dtype=np.int32)
+            arrays[col_names[n] + "_values"] = np.asarray(list(values[n]), dtype=np.str_)
+        np.savez_compressed(outfile, **arrays)
+
+
+def update_manifest(outdir, out_prefix, k, outfile, out_format, columns, entries, mass):
+    """
+    Add the file of the k-th block to the manifest <out_prefix>_manifest.json, which
+    is started over with the first block.
+    Args:
+        outdir: output directory
+        out_prefix: prefix of the output results
+        k: the block, from 0
+        outfile: path of the file of the block
+        out_format: one of OUT_FORMATS
+        columns: the columns of the block, the N dimensions and the measure attribute
+        entries: number of entries in the file of the block
+        mass: mass of the block when it was found, without the entries of earlier blocks
+    """
+    manifest_file = outdir+"/"+out_prefix+"_manifest.json"
+    if k == 0 or not os.path.exists(manifest_file):
+        manifest = {"format": out_format, "columns": columns, "blocks": []}
+    else:
+        with open(manifest_file, mode="rt") as fin:
+            manifest = json.load(fin)
+    manifest["blocks"] = [block for block in manifest["blocks"] if block["block"] != k+1]
+    manifest["blocks"].append({"block": k+1, "file": os.path.basename(outfile),
+                            "entries": int(entries), "mass": float(mass)})
+    with open(manifest_file, mode="wt") as fout:
+        json.dump(manifest, fout, indent=1, sort_keys=True)
@@ -6,15 +6,20 @@
 ##################################################
 
 import psycopg2
-import math
+import math, time
 from dcube_utils import *
+from dcube_output import block_file, update_manifest, write_block_table
+from dcube_checkpoint import checkpoint_blocks, save_checkpoint
 
 
 def dcube_copy(original_data_table, col_names, X_name, K, N, cur, 
             dmeasure="arithmetic", policy="cardinality", 
             outdir="out/", out_prefix="out",
             verbose=True,
-            para_index=True, r_index=-1, b_index=0, Bn_index=True):
+            para_index=True, r_index=-1, b_index=0, Bn_index=True,
+            rm_batch=False, sync_params=False, encode_values=False, delta_Bmass=False,
+            grouping_sets=False, storage="logged", persistent=False,
+            output="tuples", out_format="csv", checkpoint=False, warm_start=False):
     """
     D-Cube algorithm. Find K dense blocks in a given tensor.
     Args:
@@ -35,46 +40,132 @@ def dcube_copy(original_data_table, col_names, X_name, K, N, cur,
         r_index: create an index for the i-th attribute in data_table
         b_index: create an index for the i-th attribute in Btable
         Bn_index: whether to create index on Bn
+        rm_batch: whether to remove the values of each dimension in one set-based pass
+        sync_params: whether to write the client-side parameters back to the relation
+                "parameters" after each pass, for debugging
+        encode_values: whether to work on int4 codes of the values instead of the values
+        delta_Bmass: whether to update the mass of Bn by subtracting the removed entries,
+                instead of re-computing it after each pass
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        persistent: whether the distinct values of each dimension and the total mass of
+                the data relation are kept in <relation>_R<n> and <relation>_stats
+                (see append_tensor in dcube_loader.py), instead of being computed from it
+        output: "tuples" to save the entries of each block, or "summary" to save only
+                its values, mass and density (see save_block_summary), without
+                building the relation block<k>
+        out_format: the format of the block files, one of OUT_FORMATS in dcube_output.py
+        checkpoint: whether to commit the working relations after each block but the
+                last one, and to resume after the last checkpoint (see dcube_checkpoint.py)
+        warm_start: whether to search each block first among the entries of the same
+                block of the previous run and of the values appended since, which are
+                kept with the persistent relation (see find_warm_block)
     """
-    ## initialization
+    for (k, params) in iter_blocks_copy(original_data_table, col_names, X_name, K, N, cur,
+                dmeasure, policy, outdir, out_prefix, verbose, para_index, r_index,
+                b_index, Bn_index, rm_batch, sync_params, encode_values, delta_Bmass,
+                grouping_sets, storage, persistent, output,
+                out_format, checkpoint, warm_start):
+        pass
+
+
+def iter_blocks_copy(original_data_table, col_names, X_name, K, N, cur, 
+            dmeasure="arithmetic", policy="cardinality", 
+            outdir="out/", out_prefix="out",
+            verbose=True,
+            para_index=True, r_index=-1, b_index=0, Bn_index=True,
+            rm_batch=False, sync_params=False, encode_values=False, delta_Bmass=False,
+            grouping_sets=False, storage="logged", persistent=False,
+            output="tuples", out_format="csv", checkpoint=False, warm_start=False):
+    """
+    D-Cube algorithm as a generator, which yields (k, params) as soon as the k-th block
+    is saved, where params are the client-side parameters.
+    At that point, the relations block<k> and final_B<n> hold the block, and the
+    client-side parameters still describe the relation before the block is removed.
+    The arguments are those of dcube_copy; if outdir is None, the blocks are not
+    written to files. If the generator is closed early, the working tables are dropped.
+    If output is "summary", block<k> is not built, and the block is saved once removed.
+    """
+    ## initialization, unless the tables are kept by a checkpoint
     data_table = "mydata"
-    init_dcube_tables(original_data_table, data_table, col_names, X_name, 
-                        K, N, cur, para_index, r_index)
+    k_start = checkpoint_blocks(cur) if checkpoint else 0
+    if k_start == 0:
+        set_phase(cur, "init_tables")
+        init_dcube_tables(original_data_table, data_table, col_names, X_name, 
+                        K, N, cur, para_index, r_index, encode_values, storage, persistent)
+    ## the parameters are kept in memory from now on
+    params = fetch_parameters(cur)
     # print ("\tStarted with %d entries." % compute_card(cur, data_table))
 
     ## repeatedly find dense sub-blocks
-    for k in range(K):
+    for k in range(k_start, K):
         ## find single block
         print ("Start finding the %d-th block ..." % (k+1))
-        find_single_block(data_table, col_names, X_name, N, cur, dmeasure, policy, 
-                        b_index, Bn_index)
-
-        save_block(original_data_table, col_names, X_name, 
-                    k, N, cur, outdir, out_prefix, verbose)
+        block_start = time.time()
+        set_block(cur, k)
+        density = None
+        if warm_start:
+            density = find_warm_block(original_data_table, data_table, col_names, X_name,
+                        k, N, cur, dmeasure, policy, b_index, Bn_index, rm_batch, params,
+                        sync_params, delta_Bmass, grouping_sets, storage)
+        if density is None:
+            density = find_single_block(data_table, col_names, X_name, N, cur, dmeasure,
+                        policy, b_index, Bn_index, rm_batch, params, sync_params,
+                        delta_Bmass, grouping_sets, storage,
+                        original_data_table if (persistent and k == 0 and not encode_values)
+                        else None)
+        if warm_start:
+            keep_block(original_data_table, k, N, cur, density, storage)
+
+        set_phase(cur, "save_block")
+        entries = None
+        if output == "tuples":
+            entries = save_block(original_data_table, col_names, X_name, 
+                        k, N, cur, outdir, out_prefix, verbose, encode_values, storage,
+                        out_format)
+        try:
+            yield (k, params)
+        except GeneratorExit:
+            set_block(cur, None)
+            set_phase(cur, "clean_up")
+            clean_up(data_table, N, k, cur, output == "tuples")
+            raise
    
         ## remove the entries in the found block from data table
-        condition = " and ".join(("R.%s=B.%s" % (col_names[n], col_names[n])) for n in range(N))
-        cur.execute(("DELETE FROM %s as R WHERE EXISTS " % data_table) + 
-                ("(SELECT 1 FROM block%d as B WHERE %s);" % (k, condition)))
-        ## update total mass
-        cur.execute(("UPDATE parameters SET value=(SELECT sum(%s) FROM %s) " 
-            % (X_name, data_table)) + " WHERE par='total_mass';" )
+        set_phase(cur, "remove_block")
+        prev_total_mass = get_parameter(cur, 'total_mass', params)
+        (R_card, total_mass, B_card, B_mass) = remove_block(data_table, col_names, X_name,
+                            k, N, cur, params, encode_values, output == "summary")
+        if output == "summary" and outdir is not None:
+            set_phase(cur, "save_block")
+            save_block_summary(k, N, cur, outdir, out_prefix, dmeasure, prev_total_mass,
+                            B_card, B_mass, params, encode_values)
+        if entries is not None:
+            update_manifest(outdir, out_prefix, k, block_file(outdir, out_prefix, k, out_format),
+                            out_format, col_names + [X_name], entries, B_mass)
+        if sync_params:
+            sync_parameters(cur, params)
 
         ## if no entries or no mass are left in the table, stop the loop
-        R_card = compute_card(cur, data_table)
-        total_mass = get_parameter(cur, 'total_mass')
         # print ("\tAfter removing the block, %d entries are left." % R_card)
         if R_card == 0 or total_mass == 0:
             print ("Algorithm stopped after finding %d blocks because no mass is left." %
                 (k+1))
             break
+        if checkpoint and k < K-1:
+            save_checkpoint(cur, k, B_card, B_mass, time.time() - block_start, params)
 
     ## clean up: drop the temporary tables
-    clean_up(data_table, N, k, cur)
+    set_block(cur, None)
+    set_phase(cur, "clean_up")
+    clean_up(data_table, N, k, cur, output == "tuples")
 
 
 def find_single_block(data_table, col_names, X_name, N, cur, dmeasure, policy, 
-            b_index=-1, Bn_index=True):
+            b_index=-1, Bn_index=True, rm_batch=False, params=None, sync_params=False,
+            delta_Bmass=False, grouping_sets=False, storage="logged", initial_Bn=None,
+            B_mass=None):
     """
     Args:
         data_table: the current relation table (the relation "R" in paper)
@@ -86,58 +177,97 @@ def find_single_block(data_table, col_names, X_name, N, cur, dmeasure, policy,
         policy: "cardinality" or "density"
         b_index: create an index for the i-th attribute in Btable
         Bn_index: whether to create index on Bn
+        rm_batch: whether to remove the values in B_rm in one set-based pass
+        params: client-side parameters; if None, they are read from the relation "parameters"
+        sync_params: whether to write the parameters back to the relation "parameters"
+                after each pass, for debugging
+        delta_Bmass: whether to update the mass of Bn by subtracting the removed entries,
+                instead of re-computing it from Btable after each pass
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        initial_Bn: if given, the relations <initial_Bn>_R<n>(value, mass) hold the mass
+                of each value in data_table, which is then not aggregated (see init_B_tables)
+        B_mass: the mass of data_table, if it is only a part of the current relation;
+                by default, the total mass in the parameters
+    Returns:
+        The density of the block found.
     """
     ## initialize
-    init_B_tables(data_table, col_names, X_name, N, cur, b_index, Bn_index)
-    (max_dens, avg_card) = compute_density(cur, N, dmeasure)
+    if params is None:
+        params = fetch_parameters(cur)
+    set_phase(cur, "init_B_tables")
+    init_B_tables(data_table, col_names, X_name, N, cur, b_index, Bn_index, params,
+                    delta_Bmass, grouping_sets, storage, initial_Bn, B_mass)
+    (max_dens, avg_card) = init_density(cur, N, dmeasure, params)
+    R_mass = get_parameter(cur, "total_mass", params)
     curr_order, max_order, density = 1, 1, max_dens
+    npass = 0
 
     ## repeatedly remove all entries in Btable
-    while has_remained_B(N, cur):
+    while has_remained_B(N, cur, params):
         ## select dimension to remove
-        n_rm = select_dimension(cur, N, policy, dmeasure)
+        set_phase(cur, "select_dimension", npass)
+        n_rm = select_dimension(cur, N, policy, dmeasure, params)
         B_rm = ("B%d" % n_rm)
 
         ## entries that have mass smaller than the average will be removed
-        card = float(get_parameter(cur, par=("card_B%d" % n_rm)))
-        B_mass = float(get_parameter(cur, par="B_mass"))
+        card = float(get_parameter(cur, ("card_B%d" % n_rm), params))
+        B_mass = float(get_parameter(cur, "B_mass", params))
         avg_mass = B_mass/card
 
-        ## "remove" these entries from Btable by setting mass=0
-        cur.execute("UPDATE Btable SET %s=0 WHERE EXISTS " % (X_name)
-            + ("(SELECT 1 FROM %s WHERE %s.mass <= %f and %s.value=Btable.%s);" % 
-                (B_rm, B_rm, avg_mass, B_rm, col_names[n_rm])))
-
-        ## repeatedly delete entries in B_rm
-        curr_row = get_next_Brow(B_rm, cur)
-        while curr_row and curr_row[1] <= avg_mass:
-            (curr_value, curr_mass) = (curr_row[0], float(curr_row[1]))
-
-            ## record the delete order
-            cur.execute("INSERT INTO rmOrder (value, dimension, r) " + 
-                    "VALUES ('%s', %d, %d);" % (curr_value, n_rm, curr_order))
-            curr_order += 1
-            
-            ## remove this entry from B_rm
-            cur.execute("DELETE FROM %s WHERE value='%s';" % (B_rm, curr_value))
-
-            ## new density, cardinality, and B_mass
-            (density, card, B_mass, avg_card) = update_density(density, N, cur, dmeasure, 
-                                                    B_rm, B_mass, card, curr_mass, avg_card)
-            ## update maximal density
-            if density > max_dens:
-                max_dens, max_order = density, curr_order
-            ## move to the next row
-            curr_row = get_next_Brow(B_rm, cur)
-
-        ## update mass and cardinality in the "parameters" relation
-        cur.execute("UPDATE parameters SET value=%f WHERE par='card_%s';" % (card, B_rm))
-        cur.execute("UPDATE parameters SET value=%f WHERE par='B_mass';" % B_mass)
-
-        ## because we have removed entries from Btable, we need to re-compute the mass
-        recompute_Bmass(col_names, X_name, N, cur, Bn_index, n_rm)
+        ## "remove" these entries from Btable
+        set_phase(cur, "remove", npass)
+        remove_from_Btable(cur, X_name, "EXISTS " 
+            + ("(SELECT 1 FROM %s WHERE %s.mass <= %r and %s.value=Btable.%s)" % 
+                (B_rm, B_rm, avg_mass, B_rm, col_names[n_rm])), delta_Bmass)
+
+        if rm_batch:
+            ## delete all these entries in B_rm at once
+            (rm_card, rm_mass, best_order, best_dens) = remove_batch(cur, N, n_rm, 
+                                                avg_mass, curr_order, dmeasure, params=params)
+            curr_order += rm_card
+            (card, B_mass) = (card - rm_card, B_mass - rm_mass)
+            if best_dens > max_dens:
+                max_dens, max_order = best_dens, best_order
+        else:
+            ## repeatedly delete entries in B_rm, in increasing order of mass
+            removed = RemovalBuffer(cur, n_rm)
+            for curr_row in iter_Brows(B_rm, cur, avg_mass):
+                (curr_value, curr_mass) = (curr_row[0], float(curr_row[1]))
+
+                ## record the delete order, and remove this entry from B_rm
+                removed.add(curr_value, curr_order)
+                curr_order += 1
+
+                ## new density, cardinality, and B_mass
+                (density, card, B_mass, avg_card) = update_density(density, N, dmeasure,
+                                                B_mass, card, curr_mass, avg_card, R_mass)
+                ## update maximal density
+                if density > max_dens:
+                    max_dens, max_order = density, curr_order
+
+            ## write the delete order and remove the entries from B_rm, all at once
+            removed.flush()
+
+        ## update mass and cardinality in the parameters
+        remove_Bn_prefix(cur, n_rm, card, B_mass, params)
+        update_parameter(cur, "card_%s" % B_rm, card, params)
+        update_parameter(cur, "B_mass", B_mass, params)
+
+        ## because we have removed entries from Btable, we need to update the mass
+        set_phase(cur, "recompute_Bmass", npass)
+        if delta_Bmass:
+            update_Bmass_delta(col_names, X_name, N, cur, n_rm, params=params)
+        else:
+            recompute_Bmass(col_names, X_name, N, cur, Bn_index, n_rm, params, grouping_sets,
+                            storage)
+        if sync_params:
+            sync_parameters(cur, params)
+        npass += 1
    
     ## reconstruct the dense block
+    set_phase(cur, "final_B")
     for n in range(N):
         cur.execute(("INSERT INTO final_B%d (value) " % n) 
              + ("(SELECT R.value as value FROM R%d as R, rmOrder " % (n))
@@ -146,56 +276,129 @@ def find_single_block(data_table, col_names, X_name, N, cur, dmeasure, policy,
 
     ## clean up: drop the temporary table
     cur.execute("DROP TABLE Btable;")
+    if delta_Bmass:
+        cur.execute("DROP TABLE Bdelta;")
+    return max_dens
 
 
-def update_density(density, N, cur, dmeasure, 
-            B_rm, B_mass, card, curr_mass, avg_card):
+def find_warm_block(original_data_table, data_table, col_names, X_name, k, N, cur,
+            dmeasure, policy, b_index=-1, Bn_index=True, rm_batch=False, params=None,
+            sync_params=False, delta_Bmass=False, grouping_sets=False, storage="logged"):
+    """
+    Warm start: search the k-th block among the candidate entries of data_table, whose
+    values are all in the k-th block of the previous run, <original_data_table>_prevB<k>_<n>
+    (see keep_block), or among the values appended since, <original_data_table>_new<n>
+    (see append_tensor in dcube_loader.py). The search then scales with these entries
+    instead of the whole relation. The block is only kept if it is at least as dense as
+    the previous one, which only gains mass with the appended entries; it may differ
+    from the block of a search from scratch.
+    Args:
+        the arguments of find_single_block, and
+        original_data_table: the persistent relation, with which the blocks are kept
+        k: the current block to find
+    Returns:
+        The density of the block, or None if there is no previous block or the block
+        is less dense, and find_single_block is to be run on data_table.
+    """
+    cur.execute("SELECT value FROM %s_stats WHERE par='density%d';" % (original_data_table, k))
+    previous = cur.fetchone()
+    if previous is None:
+        return None
+    set_phase(cur, "warm_start")
+    condition = " and ".join([("R.%s IN (SELECT value FROM %s_prevB%d_%d " % 
+                                (col_names[n], original_data_table, k, n))
+                            + ("UNION SELECT value FROM %s_new%d)" % (original_data_table, n))
+                            for n in range(N)])
+    cur.execute(create_table(storage) + " warm_data AS SELECT R.* FROM %s as R WHERE %s;" %
+                (data_table, condition))
+    cur.execute("SELECT coalesce(sum(%s), 0) FROM warm_data;" % X_name)
+    B_mass = cur.fetchone()[0]
+    density = find_single_block("warm_data", col_names, X_name, N, cur, dmeasure, policy,
+                        b_index, Bn_index, rm_batch, params, sync_params, delta_Bmass,
+                        grouping_sets, storage, None, B_mass)
+    cur.execute("DROP TABLE warm_data;")
+    if density < previous[0]:
+        return None
+    print ("\tThe block is found among the entries of the previous block and of the "
+            + "appended values.")
+    return density
+
+
+def keep_block(original_data_table, k, N, cur, density, storage="logged"):
     """
-    Update the density after removing 1 element from B_rm.
+    Keep the values final_B<n> of the k-th block in <original_data_table>_prevB<k>_<n>,
+    and its density in <original_data_table>_stats, for the warm start of the next run
+    (see find_warm_block).
     Args:
-        density: current density
+        original_data_table: the persistent relation
+        k: the current block
         N: number of dimension
         cur: cursor of database connection
-        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
-        B_rm: the current Bn that are removed
-        B_mass: current total mass in B
-        card: current cardinality of B
-        curr_mass: the mass to be removed
-        avg_card: used for arithmetic dmeasure, average cardinality of all Bn's
+        density: the density of the block
+        storage: "logged" or "unlogged", the kind of the kept relations
     """
-    if dmeasure == "suspicious":
-        ## update mass and cardinality to compute the density after deleting
-        cur.execute("UPDATE parameters SET value=value-1 WHERE par='card_%s';" % B_rm)
-        cur.execute("UPDATE parameters SET value=value-%f WHERE par='B_mass';" % curr_mass)
-        ## density after deleting
-        density, _ = compute_density(cur, N, dmeasure)
-    ## for the other two density measures, we have simplier updating method
-    elif dmeasure == "geometric":
-        if B_mass == 0 or card <= 1:
-            density = -1
-        else:
-            density *= (B_mass - curr_mass) / B_mass
-            density *= math.pow(card, 1.0/N)/math.pow(card-1, 1.0/N)     
-    elif dmeasure == "arithmetic":
-        if B_mass == 0 or avg_card <= 1.0/N:
-            density = -1
-        else:
-            density *= (B_mass - curr_mass) / B_mass
-            density *= avg_card/(avg_card - 1.0/N)
-        avg_card -= 1.0/N
-    card -= 1
-    B_mass -= curr_mass
-
-    return (density, card, B_mass, avg_card)
+    for n in range(N):
+        cur.execute("DROP TABLE IF EXISTS %s_prevB%d_%d;" % (original_data_table, k, n))
+        cur.execute(create_table(storage) + " %s_prevB%d_%d AS SELECT value FROM final_B%d;" %
+                    (original_data_table, k, n, n))
+    cur.execute(("INSERT INTO %s_stats VALUES (%%s, %%s) " % original_data_table)
+                + "ON CONFLICT (par) DO UPDATE SET value=EXCLUDED.value;",
+                ("density%d" % k, density))
 
 
-def clean_up(data_table, N, k, cur):
+def remove_block(data_table, col_names, X_name, k, N, cur, params=None,
+                encode_values=False, semi_join=False):
+    """
+    Remove the entries in the k-th block from the data table, and update the total mass.
+    Args:
+        data_table: the current relation table (the relation "R" in paper)
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        k: the block to remove
+        N: number of dimension
+        cur: cursor of database connection
+        params: client-side parameters; if None, use the relation "parameters"
+        encode_values: whether data_table stores int4 codes; if so, the block, which has
+                the original values, is not used and the entries whose values are all
+                in final_Bn are removed instead
+        semi_join: whether to remove the entries whose values are all in final_Bn,
+                when the relation block<k> is not built
+    Returns:
+        (R_card, total_mass, B_card, B_mass), the number of entries and the total mass
+        that are left, and the number of entries and the mass that are removed.
+    """
+    if encode_values or semi_join:
+        condition = " and ".join(("EXISTS (SELECT 1 FROM final_B%d as B WHERE B.value=R.%s)" % 
+                                (n, col_names[n])) for n in range(N))
+        cur.execute(("WITH removed AS (DELETE FROM %s as R WHERE %s " % (data_table, condition))
+                + ("RETURNING R.%s) " % X_name)
+                + ("SELECT count(*), coalesce(sum(%s), 0)::double precision FROM removed;" % 
+                    X_name))
+    else:
+        condition = " and ".join(("R.%s=B.%s" % (col_names[n], col_names[n])) for n in range(N))
+        cur.execute(("WITH removed AS (DELETE FROM %s as R WHERE EXISTS " % data_table) + 
+                ("(SELECT 1 FROM block%d as B WHERE %s) RETURNING R.%s) " % 
+                    (k, condition, X_name))
+                + ("SELECT count(*), coalesce(sum(%s), 0)::double precision FROM removed;" % 
+                    X_name))
+    (B_card, B_mass) = cur.fetchone()
+    ## update total mass
+    cur.execute("SELECT count(*), coalesce(sum(%s), 0)::double precision FROM %s;" % 
+                (X_name, data_table))
+    (R_card, total_mass) = cur.fetchone()
+    update_parameter(cur, 'total_mass', total_mass, params)
+
+    return (R_card, total_mass, B_card, B_mass)
+
+
+def clean_up(data_table, N, k, cur, drop_blocks=True):
     """
     Clean up the temporary tables.
     Args:
         data_table: the copy of data
         N: the dimension
         k: the number of found block - 1
+        drop_blocks: whether the relations block<k> were built
     """
     cur.execute("DROP TABLE %s;" % data_table)
     cur.execute("DROP TABLE parameters;")
@@ -205,12 +408,13 @@ def clean_up(data_table, N, k, cur):
         cur.execute("DROP TABLE R%d;" % n)
         cur.execute("DROP TABLE B%d;" % n)
         cur.execute("DROP TABLE final_B%d;" % n)
-    for kk in range(k+1):
+    for kk in range(k+1 if drop_blocks else 0):
         cur.execute("DROP TABLE block%d;"%kk)
 
 
 def save_block(original_data_table, col_names, X_name, 
-            k, N, cur, outdir, out_prefix, verbose):
+            k, N, cur, outdir, out_prefix, verbose, encode_values=False, storage="logged",
+            out_format="csv"):
     """
     Construct and save the k-th block.
     Args:
@@ -222,15 +426,26 @@ def save_block(original_data_table, col_names, X_name,
         k: the current block to construct
         N: number of dimension
         cur: cursor of database connection
-        outdir: output directory
+        outdir: output directory; if None, the block is only kept in the relation block<k>
         out_prefix: prefix of the output results
         verbose: whether to print the finded block to stdout
+        encode_values: whether final_Bn stores int4 codes, which are decoded with Rn
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        out_format: the format of the file, one of OUT_FORMATS in dcube_output.py
+    Returns:
+        The number of entries of the block, or None if it is not written to a file.
     """
     columns = ",".join(col_names + [X_name])
     ## cunstruct the dense block
-    condition = " and ".join([("R.%s=final_B%d.value" % (col_names[n], n)) for n in range(N)])
-    final_Bs = ",".join(["final_B"+str(n) for n in range(N)])
-    cur.execute(("CREATE TABLE block%d AS " % k) 
+    if encode_values:
+        ## decode the values in final_Bn back to the original ones
+        condition = " and ".join([("R.%s=L%d.label and L%d.value=final_B%d.value" % 
+                                    (col_names[n], n, n, n)) for n in range(N)])
+        final_Bs = ",".join([("R%d as L%d, final_B%d" % (n, n, n)) for n in range(N)])
+    else:
+        condition = " and ".join([("R.%s=final_B%d.value" % (col_names[n], n)) for n in range(N)])
+        final_Bs = ",".join(["final_B"+str(n) for n in range(N)])
+    cur.execute((create_table(storage) + " block%d AS " % k) 
         + ("SELECT %s FROM %s as R, %s " %  (columns, original_data_table, final_Bs)) 
         + ("WHERE %s;" % condition))
 
@@ -239,19 +454,26 @@ def save_block(original_data_table, col_names, X_name,
         print ("\tFound block %d:" % (k+1))
         for n in range(N):        
             print ("\tdimension %d:" % n)
-            cur.execute("SELECT * FROM final_B%d;" % n)
+            if encode_values:
+                cur.execute(("SELECT L.label FROM final_B%d as B, R%d as L " % (n, n))
+                    + "WHERE B.value=L.value;")
+            else:
+                cur.execute("SELECT * FROM final_B%d;" % n)
             print "\t", cur.fetchall()
             
     ## save the block to disk
-    outfile = outdir+"/"+out_prefix+"_block"+str(k+1)+".csv"
-    with open(outfile, mode="wt") as fout:
-        cur.copy_to(fout, ("block%d" % k), sep=',')
+    if outdir is None:
+        return None
+    (outfile, entries) = write_block_table("block%d" % k, col_names, X_name, k, cur, outdir,
+                                        out_prefix, out_format)
     print ("\tThe %d-th block is written to file '%s'." % (k+1, outfile))
+    return entries
 
 
 
 def init_B_tables(data_table, col_names, X_name, N, cur, 
-            b_index, Bn_index):
+            b_index, Bn_index, params=None, delta_Bmass=False, grouping_sets=False,
+            storage="logged", initial_Bn=None, B_mass=None):
     """
     Initialize and create the tables needed for find_single_block.
     Args:
@@ -262,15 +484,29 @@ def init_B_tables(data_table, col_names, X_name, N, cur,
         cur: cursor for database connection
         b_index: create an index for the i-th attribute in Btable
         Bn_index: whether to create index on Bn
+        params: client-side parameters; if None, use the relation "parameters"
+        delta_Bmass: whether to create the relation "Bdelta" for the removed entries,
+                and an index on Bn (mass) since Bn will not be re-inserted in order
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        initial_Bn: if given, Bn is copied from <initial_Bn>_R<n>(value, mass), which
+                are kept with a persistent relation (see append_tensor in dcube_loader.py)
+                and hold the mass of each value when data_table is the whole relation
+        B_mass: the mass of data_table; by default, the total mass in the parameters
     """
     ## initialize the Btable; this table will be eliminated in the end
-    cur.execute("CREATE TABLE Btable AS SELECT * FROM %s;" % data_table)
+    cur.execute(create_table(storage) + " Btable AS SELECT * FROM %s;" % data_table)
+    if delta_Bmass:
+        cur.execute(create_table(storage) + " Bdelta (LIKE Btable);")
     if b_index >= 0 and b_index < N:
         cur.execute("CREATE INDEX ON Btable (%s);" % (col_names[b_index]))
         # print ("\tcreated index on Btable (%s)" % col_names[b_index])
 
     ## total mass in Btable; initially equals to current total mass
-    update_parameter(cur, 'B_mass', get_parameter(cur, 'total_mass'))
+    if B_mass is None:
+        B_mass = get_parameter(cur, 'total_mass', params)
+    update_parameter(cur, 'B_mass', B_mass, params)
 
     ## clean up temporary tables
     cur.execute("DELETE FROM rmOrder;")
@@ -278,18 +514,34 @@ def init_B_tables(data_table, col_names, X_name, N, cur,
         cur.execute("DELETE FROM final_B%d;" % n)
         cur.execute("DELETE FROM B%d;" % n)
     ## Bn (value, mass)
+    if grouping_sets and initial_Bn is None:
+        aggregate_Btable(col_names, X_name, cur, range(N), storage)
     for n in range(N):
-        cur.execute(("INSERT INTO B%d (value, mass) " % n)
-            + ("(SELECT %s as value, sum(%s) as mass " % (col_names[n], X_name))
-            + ("FROM Btable GROUP BY value ORDER BY mass);"))
+        if initial_Bn is not None:
+            Bn = "SELECT value, mass FROM %s_R%d ORDER BY mass" % (initial_Bn, n)
+        elif grouping_sets:
+            Bn = "SELECT value, mass FROM Bagg WHERE dimension=%d ORDER BY mass" % n
+        else:
+            Bn = (("SELECT %s as value, sum(%s) as mass " % (col_names[n], X_name))
+                + "FROM Btable GROUP BY value ORDER BY mass")
+        ## with the cumulative mass and count, for select_dim_by_dens
+        cur.execute("INSERT INTO B%d (%s);" % (n, cumulative_Bn(Bn)))
         ## record its cardinality
-        update_parameter(cur, 'card_B%d' % n, compute_card(cur, "B%d" % n))
+        update_parameter(cur, 'card_B%d' % n, cur.rowcount, params)
+        reset_Bn_prefix(cur, n, params)
         ## create index
         if Bn_index:
             cur.execute("CREATE INDEX ON B%d (value);" % n)
+        if delta_Bmass:
+            cur.execute("CREATE INDEX ON B%d (mass, value);" % n)
+        elif Bn_index:
+            cur.execute("CREATE INDEX ON B%d (mass);" % n)
+    if grouping_sets and initial_Bn is None:
+        cur.execute("DROP TABLE Bagg;")
 
 
-def recompute_Bmass(col_names, X_name, N, cur, Bn_index, n_rm):
+def recompute_Bmass(col_names, X_name, N, cur, Bn_index, n_rm, params=None,
+                grouping_sets=False, storage="logged"):
     """
     After deleting some entries from Btable, 
     we need to re-compute the mass for each Bn=a.
@@ -301,35 +553,41 @@ def recompute_Bmass(col_names, X_name, N, cur, Bn_index, n_rm):
         Bn_index: whether to create index on Bn
         n_rm: the current dimension that the algorithm is removing; 
               this Bn does not need to be updated. 
+        params: client-side parameters; if None, use the relation "parameters"
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
     """
+    ## nothing to aggregate if there is only one dimension
+    grouping_sets = grouping_sets and N > 1
+    if grouping_sets:
+        aggregate_Btable(col_names, X_name, cur, [n for n in range(N) if n != n_rm], storage)
     for n in range(N):
         if n != n_rm:
             ## it's faster to delete and re-insert than updating the old one
             cur.execute("DELETE FROM new_B;")
-            cur.execute("INSERT INTO new_B (value, mass) " 
-                 + ("(SELECT value, sum(%s) as mass " % (X_name))
-                 + ("FROM Btable JOIN B%d ON Btable.%s=B%d.value " % (n, col_names[n], n))
-                 + ("GROUP BY value ORDER BY mass);"))
+            if grouping_sets:
+                Bn = (("SELECT A.value, A.mass FROM Bagg as A JOIN B%d ON A.value=B%d.value "
+                        % (n, n))
+                     + ("WHERE A.dimension=%d ORDER BY mass" % n))
+            else:
+                Bn = (("SELECT value, sum(%s) as mass " % (X_name))
+                     + ("FROM Btable JOIN B%d ON Btable.%s=B%d.value " % (n, col_names[n], n))
+                     + ("GROUP BY value ORDER BY mass"))
+            cur.execute("INSERT INTO new_B (%s);" % cumulative_Bn(Bn))
             cur.execute("DELETE FROM B%d;" % n)
-            cur.execute("INSERT INTO B%d (value, mass) (SELECT * FROM new_B);" % n)
+            cur.execute("INSERT INTO B%d (SELECT * FROM new_B);" % n)
 
             ## update its cardinality
-            update_parameter(cur, 'card_B%d' % n, compute_card(cur, "B%d" % n))
-
-
-def get_next_Brow(Bn, cur):
-    """
-    Get the top row in table Bn, which has the smallest mass.
-    Args:
-        Bn: table name, one of B0 ... B(N-1)
-        cur: cursor for database connection
-    """
-    cur.execute("SELECT value, mass FROM %s LIMIT 1;" % Bn)
-    return cur.fetchone()
+            update_parameter(cur, 'card_B%d' % n, cur.rowcount, params)
+            reset_Bn_prefix(cur, n, params)
+    if grouping_sets:
+        cur.execute("DROP TABLE Bagg;")
 
 
 def init_dcube_tables(original_data_table, data_table, col_names, X_name, 
-                    K, N, cur, para_index, r_index):
+                    K, N, cur, para_index, r_index, encode_values=False, storage="logged",
+                    persistent=False):
     """
     Initialize the tables for D-cube.
     Args:
@@ -344,9 +602,35 @@ def init_dcube_tables(original_data_table, data_table, col_names, X_name,
         cur: cursor of database connection
         para_index: whether to create index for the 'parameters' relation
         r_index: create an index for the i-th attribute in data_table
+        encode_values: whether to replace the values of each dimension by int4 codes;
+                Rn(value, label) then maps each code to the original value
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        persistent: whether the distinct values of each dimension and the total mass
+                are read from <original_data_table>_R<n> and <original_data_table>_stats
     """
-    ## copy the original data table; the new data_table will be modified
-    cur.execute("CREATE TABLE %s AS SELECT * FROM %s;" % (data_table, original_data_table))
+    ## the distinct values of each dimension
+    if persistent:
+        distinct = ["SELECT value FROM %s_R%d" % (original_data_table, n) for n in range(N)]
+    else:
+        distinct = ["SELECT DISTINCT %s as value FROM %s" % (col_names[n], original_data_table)
+                    for n in range(N)]
+    if encode_values:
+        ## create tables Rn to store the unique values in each dimension, numbered 1, 2, ...
+        for n in range(N):
+            cur.execute((create_table(storage) + " R%d AS SELECT " % n)
+                + "(row_number() OVER (ORDER BY label))::int4 as value, label "
+                + ("FROM (%s) as T(label);" % distinct[n]))
+        ## the data table stores the codes instead of the original values
+        codes = ",".join(["R%d.value as %s" % (n, col_names[n]) for n in range(N)])
+        condition = " and ".join([("D.%s=R%d.label" % (col_names[n], n)) for n in range(N)])
+        cur.execute((create_table(storage) + " %s AS SELECT %s, D.%s " % 
+                (data_table, codes, X_name))
+            + ("FROM %s as D, %s " % (original_data_table, ",".join(["R"+str(n) for n in range(N)])))
+            + ("WHERE %s;" % condition))
+    else:
+        ## copy the original data table; the new data_table will be modified
+        cur.execute(create_table(storage) + " %s AS SELECT * FROM %s;" % 
+                    (data_table, original_data_table))
 
     ## create index on the i-th attribute
     if r_index >= 0 and r_index < N:
@@ -354,7 +638,8 @@ def init_dcube_tables(original_data_table, data_table, col_names, X_name,
         # print ("\tcreated index in Rtable on %s" % col_names[r_index])
 
     ## create a table for global parameters
-    cur.execute("CREATE TABLE parameters (par varchar(40), value double precision);")
+    cur.execute(create_table(storage) + 
+                " parameters (par varchar(40), value double precision);")
     cur.execute("INSERT INTO parameters (par) VALUES ('total_mass');")
     cur.execute("INSERT INTO parameters (par) VALUES ('B_mass');")
     for n in range(N):    
@@ -365,22 +650,32 @@ def init_dcube_tables(original_data_table, data_table, col_names, X_name,
         cur.execute("CREATE INDEX ON parameters (par);")
         # print "\tcreated index on parameters."
     ## total mass
-    cur.execute(("UPDATE parameters SET value=(SELECT sum(%s) FROM %s) " 
+    if persistent:
+        cur.execute(("UPDATE parameters SET value=(SELECT value FROM %s_stats " 
+                        % original_data_table) + "WHERE par='total_mass') WHERE par='total_mass';")
+    else:
+        cur.execute(("UPDATE parameters SET value=(SELECT sum(%s) FROM %s) " 
                         % (X_name, data_table)) + " WHERE par='total_mass';" )
 
     ## create tables Rn to store the unique values in each dimension
     for n in range(N):
-        cur.execute("CREATE TABLE R%d AS SELECT DISTINCT %s as value FROM %s;" % 
-                    (n, col_names[n], data_table))
+        if not encode_values:
+            cur.execute(create_table(storage) + " R%d AS %s;" % (n, distinct[n]))
         update_parameter(cur, 'card_R%d' % n, compute_card(cur, "R"+str(n)))
 
     ## create temporary tables
-    cur.execute("CREATE TABLE new_B (value varchar, mass double precision);")
+    value_type = "int4" if encode_values else "varchar"
+    cur.execute(create_table(storage) + 
+                " new_B (value %s, mass double precision, " % value_type
+                + "cum_mass double precision, cum_card bigint);")
     ## a table to keep track of the removal order of each entry
-    cur.execute("CREATE TABLE rmOrder (value varchar, dimension int, r int);")
-    ## the Bn(value, mass) used for find_single_block and final_Bn for found blocks
+    cur.execute(create_table(storage) + " rmOrder (value %s, dimension int, r int);" % value_type)
+    ## the Bn(value, mass, cum_mass, cum_card) used for find_single_block 
+    ## and final_Bn for found blocks
     for n in range(N):
-        cur.execute("CREATE TABLE B%d (value varchar, mass double precision);" % n)
-        cur.execute("CREATE TABLE final_B%d (value varchar);" % n)
+        cur.execute(create_table(storage) + 
+                    " B%d (value %s, mass double precision, " % (n, value_type)
+                    + "cum_mass double precision, cum_card bigint);")
+        cur.execute(create_table(storage) + " final_B%d (value %s);" % (n, value_type))
 
 
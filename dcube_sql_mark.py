@@ -6,14 +6,19 @@
 #################################################
 
 import psycopg2
-import math
+import math, time
 from dcube_utils import *
+from dcube_output import block_file, update_manifest, write_block_table
+from dcube_checkpoint import checkpoint_blocks, save_checkpoint
 
 
 def dcube_mark(data_table, col_names, X_name, K, N, cur, 
             dmeasure="arithmetic", policy="cardinality", 
             outdir="out/", out_prefix="out", verbose=True,
-            para_index=True, r_index=-1, b_index=-1, Bn_index=False):
+            para_index=True, r_index=-1, b_index=-1, Bn_index=False,
+            rm_batch=False, sync_params=False, delta_Bmass=False, grouping_sets=False,
+            storage="logged", persistent=False, output="tuples",
+            out_format="csv", checkpoint=False):
     """
     D-Cube algorithm. Find K dense blocks in a given tensor.
     Args:
@@ -31,26 +36,86 @@ def dcube_mark(data_table, col_names, X_name, K, N, cur,
         r_index: create an index for the i-th attribute in data_table
         b_index: create an index for the i-th attribute in Btable
         Bn_index: whether to create index on Bn
+        rm_batch: whether to remove the values of each dimension in one set-based pass
+        sync_params: whether to write the client-side parameters back to the relation
+                "parameters" after each pass, for debugging
+        delta_Bmass: whether to update the mass of Bn by subtracting the removed entries,
+                instead of re-computing it after each pass
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        persistent: whether the distinct values of each dimension are read from
+                <data_table>_R<n> (see append_tensor in dcube_loader.py), instead of
+                being computed from data_table
+        output: "tuples" to save the entries of each block, or "summary" to save only
+                its values, mass and density (see save_block_summary), without
+                building the relation block<k>
+        out_format: the format of the block files, one of OUT_FORMATS in dcube_output.py
+        checkpoint: whether to commit the working relations after each block but the
+                last one, and to resume after the last checkpoint (see dcube_checkpoint.py)
     """
-    ## add a column to data table indicating whether entry has been removed
-    cur.execute("ALTER TABLE %s ADD COLUMN exists int;" % data_table)
-    cur.execute("UPDATE %s SET exists = 1;" % data_table)
+    for (k, params) in iter_blocks_mark(data_table, col_names, X_name, K, N, cur, dmeasure, policy,
+                outdir, out_prefix, verbose, para_index, r_index, b_index, Bn_index,
+                rm_batch, sync_params, delta_Bmass, grouping_sets, storage, persistent,
+                output, out_format, checkpoint):
+        pass
 
-    ## create index on the i-th attribute
-    if r_index >= 0 and r_index < N:
-        cur.execute("CREATE INDEX ON %s USING hash (%s);" % (data_table, col_names[r_index]))
-        # print ("\tcreated index in Rtable on %s" % col_names[r_index])
 
-    ## initialize needed tables
-    init_dcube_tables_mark(data_table, col_names, X_name, K, N, cur, para_index)
+def iter_blocks_mark(data_table, col_names, X_name, K, N, cur, 
+            dmeasure="arithmetic", policy="cardinality", 
+            outdir="out/", out_prefix="out", verbose=True,
+            para_index=True, r_index=-1, b_index=-1, Bn_index=False,
+            rm_batch=False, sync_params=False, delta_Bmass=False, grouping_sets=False,
+            storage="logged", persistent=False, output="tuples",
+            out_format="csv", checkpoint=False):
+    """
+    D-Cube algorithm as a generator, which yields (k, params) as soon as the k-th block
+    is saved, where params are the client-side parameters.
+    At that point, the relations block<k> and final_B<n> hold the block, and the
+    client-side parameters still describe the relation before the block is removed.
+    The arguments are those of dcube_mark; if outdir is None, the blocks are not
+    written to files. If the generator is closed early, the working tables are dropped.
+    If output is "summary", block<k> is not built, and the block is saved once removed.
+    If persistent, the entries are marked in a copy of data_table, "mydata", since
+    data_table is kept across runs and may be read by other runs at the same time.
+    """
+    run_table = "mydata" if persistent else data_table
+
+    ## the marks and the tables may be kept by a checkpoint
+    k_start = checkpoint_blocks(cur) if checkpoint else 0
+    if k_start == 0:
+        ## add a column to data table indicating whether entry has been removed
+        set_phase(cur, "init_tables")
+        if persistent:
+            cur.execute(create_table(storage) + " %s AS SELECT *, 1 as exists FROM %s;" %
+                        (run_table, data_table))
+        else:
+            cur.execute("ALTER TABLE %s ADD COLUMN IF NOT EXISTS exists int;" % data_table)
+            cur.execute("UPDATE %s SET exists = 1;" % data_table)
+
+        ## create index on the i-th attribute
+        if r_index >= 0 and r_index < N:
+            cur.execute("CREATE INDEX ON %s USING hash (%s);" % 
+                        (run_table, col_names[r_index]))
+            # print ("\tcreated index in Rtable on %s" % col_names[r_index])
+
+        ## initialize needed tables
+        init_dcube_tables_mark(data_table, col_names, X_name, K, N, cur, para_index, storage,
+                                persistent)
+    ## the parameters are kept in memory from now on
+    params = fetch_parameters(cur)
 
     ## repeatedly find dense sub-blocks
-    for k in range(K):
+    for k in range(k_start, K):
         ## update total mass according to current table
-        cur.execute(("UPDATE parameters SET value=(SELECT sum(%s) FROM %s WHERE exists=1) " 
-            % (X_name, data_table)) + " WHERE par='total_mass';" )
-
-        total_mass = get_parameter(cur, 'total_mass')
+        block_start = time.time()
+        set_block(cur, k)
+        set_phase(cur, "init_B_tables")
+        cur.execute("SELECT coalesce(sum(%s), 0)::double precision FROM %s WHERE exists=1;" %
+                    (X_name, run_table))
+        update_parameter(cur, 'total_mass', cur.fetchone()[0], params)
+
+        total_mass = get_parameter(cur, 'total_mass', params)
         if total_mass == 0:
             print ("Algorithm stopped after finding %d blocks because no mass is left." %
                 (k+1))
@@ -58,19 +123,23 @@ def dcube_mark(data_table, col_names, X_name, K, N, cur,
 
         ## find single block
         print ("Start finding the %d-th block ..." % (k+1))
-        find_single_block_mark(data_table, col_names, X_name, N, cur, dmeasure, policy, 
-                        b_index, Bn_index)
+        find_single_block_mark(run_table, col_names, X_name, N, cur, dmeasure, policy, 
+                        b_index, Bn_index, rm_batch, params, sync_params, delta_Bmass,
+                        grouping_sets, storage)
 
         ## the found block
-        cur.execute(("CREATE TABLE block%d AS " % k) + 
-               ("SELECT %s FROM %s as R, %s " %  
-                    (",".join(col_names + [X_name]), data_table,
-                         ",".join(["final_B"+str(n) for n in range(N)]))) + 
-               ("WHERE %s;" % 
-                    " and ".join([("R.%s=final_B%d.value" % (col_names[n], n)) for n in range(N)])))
+        set_phase(cur, "save_block")
+        if output == "tuples":
+            cur.execute((create_table(storage) + " block%d AS " % k) + 
+                   ("SELECT %s FROM %s as R, %s " %  
+                        (",".join(col_names + [X_name]), run_table,
+                             ",".join(["final_B"+str(n) for n in range(N)]))) + 
+                   ("WHERE %s;" % 
+                        " and ".join([("R.%s=final_B%d.value" % (col_names[n], n))
+                                        for n in range(N)])))
 
         ## print block results to stdout
-        if verbose:
+        if verbose and output == "tuples":
             print ("\tFound block %d:" % (k+1))
             for n in range(N):        
                 print ("\tdimension %d:" % n)
@@ -78,39 +147,87 @@ def dcube_mark(data_table, col_names, X_name, K, N, cur,
                 print "\t", cur.fetchall()
                 
         ## save the block to disk
-        outfile = outdir+"/"+out_prefix+"_block"+str(k+1)+".csv"
-        with open(outfile, mode="wt") as fout:
-            cur.copy_to(fout, ("block%d" % k), sep=',')
-        print ("\tThe %d-th block is written to file '%s'." % (k+1, outfile))
+        entries = None
+        if outdir is not None and output == "tuples":
+            (outfile, entries) = write_block_table("block%d" % k, col_names, X_name, k, cur,
+                                                outdir, out_prefix, out_format)
+            print ("\tThe %d-th block is written to file '%s'." % (k+1, outfile))
+        try:
+            yield (k, params)
+        except GeneratorExit:
+            set_block(cur, None)
+            set_phase(cur, "clean_up")
+            for n in range(N):
+                cur.execute("DROP TABLE final_B%d;" % n)
+            if output == "tuples":
+                cur.execute("DROP TABLE block%d;" % k)
+            clean_up_mark(N, cur, run_table if persistent else None)
+            raise
   
-        ## remove the entries in the found block from current table
-        cur.execute(("UPDATE %s SET exists=0 WHERE EXISTS " % data_table) + 
-            ("(SELECT 1 FROM block%d as B WHERE %s);" % 
-                (k, " and ".join([("%s.%s=B.%s" % (data_table, col_names[n], col_names[n])) 
-                                    for n in range(N)]))))
+        ## remove the entries in the found block from current table, with their mass
+        set_phase(cur, "remove_block")
+        if output == "tuples":
+            condition = ("EXISTS (SELECT 1 FROM block%d as B WHERE %s)" % 
+                    (k, " and ".join([("%s.%s=B.%s" % (run_table, col_names[n], col_names[n])) 
+                                        for n in range(N)])))
+        else:
+            ## the entries left whose values are all in final_Bn
+            condition = " and ".join([("EXISTS (SELECT 1 FROM final_B%d as B WHERE " % n)
+                        + ("B.value=%s.%s)" % (run_table, col_names[n])) for n in range(N)])
+        cur.execute(("WITH removed AS (UPDATE %s SET exists=0 " % run_table)
+            + ("WHERE exists=1 and %s RETURNING %s) " % (condition, X_name))
+            + ("SELECT count(*), coalesce(sum(%s), 0)::double precision FROM removed;" %
+                X_name))
+        (B_card, B_mass) = cur.fetchone()
+        if output == "summary" and outdir is not None:
+            set_phase(cur, "save_block")
+            save_block_summary(k, N, cur, outdir, out_prefix, dmeasure, total_mass,
+                            B_card, B_mass, params)
+        if entries is not None:
+            update_manifest(outdir, out_prefix, k, block_file(outdir, out_prefix, k, out_format),
+                            out_format, col_names + [X_name], entries, B_mass)
 
         ## clean up: drop the final_Bn and block-k tables
         for n in range(N):
             cur.execute("DROP TABLE final_B%d;" % n)
-        cur.execute("DROP TABLE block%d;"%k)
+        if output == "tuples":
+            cur.execute("DROP TABLE block%d;"%k)
 
         ## if nothing left, then stop
-        R_card = compute_card_mark(cur, data_table)
+        R_card = compute_card_mark(cur, run_table)
         # print ("\tAfter removing the block, %d entries are left." % R_card)
         if R_card == 0:
             print ("Algorithm stopped after finding %d blocks because no entries are left." %
                 (k+1))
             break
+        if checkpoint and k < K-1:
+            save_checkpoint(cur, k, B_card, B_mass, time.time() - block_start, params)
 
     ## clean up: drop the temporary tables
+    set_block(cur, None)
+    set_phase(cur, "clean_up")
+    clean_up_mark(N, cur, run_table if persistent else None)
+
+
+def clean_up_mark(N, cur, data_table=None):
+    """
+    Clean up the tables which are kept across the blocks.
+    Args:
+        N: the dimension
+        cur: cursor of database connection
+        data_table: if given, the copy of a relation kept across runs, which is dropped
+    """
     cur.execute("DROP TABLE parameters;")
     for n in range(N):
         cur.execute("DROP TABLE R%d;" % n)
+    if data_table is not None:
+        cur.execute("DROP TABLE %s;" % data_table)
 
 
 
 def find_single_block_mark(data_table, col_names, X_name, N, cur, dmeasure, policy, 
-            b_index, Bn_index):
+            b_index, Bn_index, rm_batch=False, params=None, sync_params=False,
+            delta_Bmass=False, grouping_sets=False, storage="logged"):
     """
     Args:
         data_table: the current relation table (the relation "R" in paper)
@@ -122,69 +239,113 @@ def find_single_block_mark(data_table, col_names, X_name, N, cur, dmeasure, poli
         policy: "cardinality" or "density"
         b_index: create an index for the i-th attribute in Btable
         Bn_index: whether to create index on Bn
+        rm_batch: whether to remove the values in B_rm in one set-based pass
+        params: client-side parameters; if None, they are read from the relation "parameters"
+        sync_params: whether to write the parameters back to the relation "parameters"
+                after each pass, for debugging
+        delta_Bmass: whether to update the mass of Bn by subtracting the removed entries,
+                instead of re-computing it from Btable after each pass
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
     """
     ## initialize
-    init_B_tables_mark(data_table, col_names, X_name, N, cur, b_index, Bn_index)
-    max_dens, _ = compute_density(cur, N, dmeasure)
-    curr_order, max_order = 1, 1
+    if params is None:
+        params = fetch_parameters(cur)
+    set_phase(cur, "init_B_tables")
+    init_B_tables_mark(data_table, col_names, X_name, N, cur, b_index, Bn_index, params,
+                    delta_Bmass, grouping_sets, storage)
+    (max_dens, avg_card) = init_density(cur, N, dmeasure, params)
+    R_mass = get_parameter(cur, "total_mass", params)
+    curr_order, max_order, density = 1, 1, max_dens
+    npass = 0
 
     ## repeatedly remove all entries in Btable
-    while has_remained_B(N, cur):
+    while has_remained_B(N, cur, params):
         ## select dimension to remove
-        n_rm = select_dimension_mark(cur, N, policy, dmeasure)
+        set_phase(cur, "select_dimension", npass)
+        n_rm = select_dimension_mark(cur, N, policy, dmeasure, params)
         B_rm = ("B%d" % n_rm)
 
         ## entries that have mass smaller than the average will be removed
-        card = get_parameter(cur, par=("card_B%d" % n_rm))
-        B_mass = get_parameter(cur, par="B_mass")
-        avg_mass = B_mass/float(card)
-
-        ## repeatedly delete entries in B_rm
-        curr_row = get_next_Brow_mark(B_rm, cur)
-        while curr_row and curr_row[1] <= avg_mass:
-            (curr_value, curr_mass) = curr_row
-
-            ## record the delete order
-            cur.execute("INSERT INTO rmOrder (value, dimension, r) " + 
-                    "VALUES ('%s', %d, %d);" % (curr_value, n_rm, curr_order))
-            curr_order += 1
-            
-            ## remove this entry
-            cur.execute("UPDATE %s SET exists=0 WHERE value='%s';" % (B_rm, curr_value))
-            cur.execute("UPDATE Btable SET %s=0 WHERE %s='%s';" % 
-                        (X_name, col_names[n_rm], curr_value)) 
-
-            ## update mass and cardinality to compute the density after deleting
-            cur.execute("UPDATE parameters SET value=value-1 WHERE par='card_%s';" % B_rm)
-            cur.execute("UPDATE parameters SET value=value-%f WHERE par='B_mass';" % curr_mass)
-        
-            ## density after deleting
-            density, _ = compute_density(cur, N, dmeasure)
-            if density > max_dens:
-                max_dens, max_order = density, curr_order
-
-            ## move to the next row
-            curr_row = get_next_Brow_mark(B_rm, cur)
-
-        ## because we have changed Btable, we need to re-compute the mass
-        recompute_Bmass_mark(col_names, X_name, N, cur, Bn_index)
+        card = float(get_parameter(cur, ("card_B%d" % n_rm), params))
+        B_mass = float(get_parameter(cur, "B_mass", params))
+        avg_mass = B_mass/card
+
+        set_phase(cur, "remove", npass)
+        if rm_batch:
+            ## "remove" these entries from Btable
+            remove_from_Btable(cur, X_name, "EXISTS "
+                + ("(SELECT 1 FROM %s WHERE %s.mass <= %r and %s.exists=1 and %s.value=Btable.%s)"
+                    % (B_rm, B_rm, avg_mass, B_rm, B_rm, col_names[n_rm])), delta_Bmass)
+
+            ## delete all these entries in B_rm at once
+            (rm_card, rm_mass, best_order, best_dens) = remove_batch(cur, N, n_rm, 
+                                    avg_mass, curr_order, dmeasure, mark=True, params=params)
+            curr_order += rm_card
+            (card, B_mass) = (card - rm_card, B_mass - rm_mass)
+            if best_dens > max_dens:
+                max_dens, max_order = best_dens, best_order
+        else:
+            ## repeatedly delete entries in B_rm, in increasing order of mass
+            removed = RemovalBuffer(cur, n_rm, mark=True)
+            for curr_row in iter_Brows(B_rm, cur, avg_mass, mark=True):
+                (curr_value, curr_mass) = (curr_row[0], float(curr_row[1]))
+
+                ## record the delete order, and remove this entry
+                removed.add(curr_value, curr_order)
+                curr_order += 1
+
+                ## new density, cardinality, and B_mass
+                (density, card, B_mass, avg_card) = update_density(density, N, dmeasure,
+                                                B_mass, card, curr_mass, avg_card, R_mass)
+                ## update maximal density
+                if density > max_dens:
+                    max_dens, max_order = density, curr_order
+
+            ## write the delete order and mark the entries in B_rm, all at once,
+            ## then "remove" these entries from Btable
+            if removed.flush() > 0:
+                remove_from_Btable(cur, X_name, "%s IN (%s)" %
+                                    (col_names[n_rm], removed.removed_values()), delta_Bmass)
+
+        ## update mass and cardinality in the parameters
+        remove_Bn_prefix(cur, n_rm, card, B_mass, params)
+        update_parameter(cur, "card_%s" % B_rm, card, params)
+        update_parameter(cur, "B_mass", B_mass, params)
+
+        ## because we have changed Btable, we need to update the mass
+        set_phase(cur, "recompute_Bmass", npass)
+        if delta_Bmass:
+            update_Bmass_delta(col_names, X_name, N, cur, n_rm, mark=True, params=params)
+        else:
+            recompute_Bmass_mark(col_names, X_name, N, cur, Bn_index, grouping_sets, storage,
+                                params)
+        if sync_params:
+            sync_parameters(cur, params)
+        npass += 1
       
     ## reconstruct the dense block
+    set_phase(cur, "final_B")
     for n in range(N):
-        cur.execute(("CREATE TABLE final_B%d AS SELECT R.value FROM R%d as R, rmOrder " % (n,n)) 
+        cur.execute((create_table(storage) + 
+                    " final_B%d AS SELECT R.value FROM R%d as R, rmOrder " % (n,n)) 
              + ("WHERE R.value=rmOrder.value and rmOrder.dimension=%d and rmOrder.r >= %d;" 
                 % (n, max_order)))
 
     ## clean up: drop the temporary tables
     cur.execute("DROP TABLE Btable;")
     cur.execute("DROP TABLE rmOrder;")
+    if delta_Bmass:
+        cur.execute("DROP TABLE Bdelta;")
     for n in range(N):
         cur.execute("DROP TABLE B%d;" % n)
 
 
 
 def init_B_tables_mark(data_table, col_names, X_name, N, cur, 
-            b_index, Bn_index):
+            b_index, Bn_index, params=None, delta_Bmass=False, grouping_sets=False,
+            storage="logged"):
     """
     Initialize and create the tables needed for find_single_block.
     Args:
@@ -195,9 +356,18 @@ def init_B_tables_mark(data_table, col_names, X_name, N, cur,
         cur: cursor for database connection
         b_index: create an index for the i-th attribute in Btable
         Bn_index: whether to create index on Bn
+        params: client-side parameters; if None, use the relation "parameters"
+        delta_Bmass: whether to create the relation "Bdelta" for the removed entries,
+                and an index on Bn (mass) since Bn will not be re-created in order
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
     """
     ## initialize the Btable; this table will be eliminated in the end
-    cur.execute("CREATE TABLE Btable AS SELECT * FROM %s WHERE exists = 1;" % data_table)
+    cur.execute(create_table(storage) + 
+                " Btable AS SELECT * FROM %s WHERE exists = 1;" % data_table)
+    if delta_Bmass:
+        cur.execute(create_table(storage) + " Bdelta (LIKE Btable);")
 
     ## create index on the i-th attribute
     if b_index >= 0 and b_index < N:
@@ -205,25 +375,41 @@ def init_B_tables_mark(data_table, col_names, X_name, N, cur,
         # print ("\tcreated index on Btable (%s)" % col_names[b_index])
 
     ## total mass in Btable; initially equals to current total mass
-    update_parameter(cur, 'B_mass', get_parameter(cur, 'total_mass'))
+    update_parameter(cur, 'B_mass', get_parameter(cur, 'total_mass', params), params)
 
     ## a table to keep track of the removal order of each entry
-    cur.execute("CREATE TABLE rmOrder (value varchar(80), dimension int, r int);")
+    cur.execute(create_table(storage) + " rmOrder (value varchar(80), dimension int, r int);")
 
     ## create tables Bn(value, mass) to store all values in Rn and the mass
+    if grouping_sets:
+        aggregate_Btable(col_names, X_name, cur, range(N), storage)
     for n in range(N):
-        cur.execute( ("CREATE TABLE B%d AS SELECT %s as value, exists, sum(%s) as mass " % 
-            (n, col_names[n], X_name))
-             + ("FROM Btable WHERE Btable.exists=1")
-             + ("GROUP BY value, exists ORDER BY mass;"))
+        if grouping_sets:
+            Bn = ("SELECT value, 1 as exists, mass "
+                 + ("FROM Bagg WHERE dimension=%d ORDER BY mass" % n))
+        else:
+            Bn = (("SELECT %s as value, exists, sum(%s)::double precision as mass " % 
+                    (col_names[n], X_name))
+                 + ("FROM Btable WHERE Btable.exists=1 ")
+                 + ("GROUP BY value, exists ORDER BY mass"))
+        ## with the cumulative mass and count, for select_dim_by_dens_mark
+        cur.execute(create_table(storage) + " B%d AS %s;" % (n, cumulative_Bn(Bn, mark=True)))
         ## record its cardinality
-        update_parameter(cur, 'card_B%d' % n, compute_card_mark(cur, "B"+str(n)))
+        update_parameter(cur, 'card_B%d' % n, compute_card_mark(cur, "B"+str(n)), params)
+        reset_Bn_prefix(cur, n, params)
         ## create index
         if Bn_index:
             cur.execute("CREATE INDEX ON B%d (value);" % n)
+        if delta_Bmass:
+            cur.execute("CREATE INDEX ON B%d (mass, value);" % n)
+        elif Bn_index:
+            cur.execute("CREATE INDEX ON B%d (mass);" % n)
+    if grouping_sets:
+        cur.execute("DROP TABLE Bagg;")
 
 
-def recompute_Bmass_mark(col_names, X_name, N, cur, Bn_index):
+def recompute_Bmass_mark(col_names, X_name, N, cur, Bn_index, grouping_sets=False,
+                storage="logged", params=None):
     """
     After updating Btable, we need to re-compute the mass for each Bn=a.
     Args:
@@ -232,23 +418,41 @@ def recompute_Bmass_mark(col_names, X_name, N, cur, Bn_index):
         N: number of dimensions
         cur: cursor for database connection
         Bn_index: whether to create index on Bn
+        grouping_sets: whether to compute the mass of all Bn with a single GROUPING SETS
+                query, instead of one query per dimension
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        params: client-side parameters; if None, use the relation "parameters"
     """
+    ## the entries in Btable all have exists=1
+    if grouping_sets:
+        aggregate_Btable(col_names, X_name, cur, range(N), storage)
     for n in range(N):
         ## it's faster to re-create a new table than updating the old one
-        cur.execute( ("CREATE TABLE new_B AS SELECT value, B%d.exists as exists, sum(%s) as mass " 
-            % (n, X_name))
-             + ("FROM Btable JOIN B%d ON Btable.%s=B%d.value WHERE Btable.exists=1" % 
-                    (n, col_names[n], n))
-             + ("GROUP BY value, B%d.exists ORDER BY mass;" % n))
+        if grouping_sets:
+            Bn = (("SELECT A.value, B%d.exists as exists, A.mass " % n)
+                 + ("FROM Bagg as A JOIN B%d ON A.value=B%d.value " % (n, n))
+                 + ("WHERE A.dimension=%d ORDER BY mass" % n))
+        else:
+            Bn = (("SELECT value, B%d.exists as exists, " % n)
+                 + ("sum(%s)::double precision as mass " % X_name)
+                 + ("FROM Btable JOIN B%d ON Btable.%s=B%d.value WHERE Btable.exists=1 " % 
+                        (n, col_names[n], n))
+                 + ("GROUP BY value, B%d.exists ORDER BY mass" % n))
+        cur.execute(create_table(storage) + " new_B AS %s;" % cumulative_Bn(Bn, mark=True))
         cur.execute("DROP TABLE B%d;" % n)
-        cur.execute("CREATE TABLE B%d AS SELECT * FROM new_B;" % n)
+        cur.execute(create_table(storage) + " B%d AS SELECT * FROM new_B;" % n)
         cur.execute("DROP TABLE new_B;")
+        reset_Bn_prefix(cur, n, params)
         ## create index
         if Bn_index:
             cur.execute("CREATE INDEX ON B%d (value);" % n)
+            cur.execute("CREATE INDEX ON B%d (mass);" % n)
+    if grouping_sets:
+        cur.execute("DROP TABLE Bagg;")
 
 
-def init_dcube_tables_mark(data_table, col_names, X_name, K, N, cur, para_index):
+def init_dcube_tables_mark(data_table, col_names, X_name, K, N, cur, para_index,
+                storage="logged", persistent=False):
     """
     Initialize the tables for D-cube.
     Args:
@@ -259,14 +463,22 @@ def init_dcube_tables_mark(data_table, col_names, X_name, K, N, cur, para_index)
         N: number of dimension
         cur: cursor of database connection
         para_index: whether to create index for parameters
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        persistent: whether the distinct values of each dimension are read from
+                <data_table>_R<n>
     """
     ## create tables Rn to store the unique values in each dimension
     for n in range(N):
-        cur.execute("CREATE TABLE R%d AS SELECT DISTINCT %s as value FROM %s; " % 
-                    (n, col_names[n], data_table))
+        if persistent:
+            cur.execute(create_table(storage) + " R%d AS SELECT value FROM %s_R%d;" % 
+                        (n, data_table, n))
+        else:
+            cur.execute(create_table(storage) + " R%d AS SELECT DISTINCT %s as value FROM %s; " % 
+                        (n, col_names[n], data_table))
 
     ## create a table for global parameters
-    cur.execute("CREATE TABLE parameters (par varchar(80), value double precision);")
+    cur.execute(create_table(storage) + 
+                " parameters (par varchar(80), value double precision);")
     ## total Mass M_R and M_B
     cur.execute("INSERT INTO parameters (par) VALUES ('total_mass');")
     cur.execute("INSERT INTO parameters (par) VALUES ('B_mass');")
@@ -0,0 +1,387 @@
+#################################################
+## D-CUBE
+## using a server-side PL/pgSQL implementation of find_single_block
+##
+## Dependency: Psycopg2 (Access PostgreSQL with Python), PostgreSQL >= 11
+#################################################
+
+import psycopg2
+import time
+from dcube_utils import *
+from dcube_sql_copy import init_dcube_tables, save_block, remove_block, clean_up
+from dcube_output import block_file, update_manifest
+from dcube_checkpoint import checkpoint_blocks, save_checkpoint
+
+
+def dcube_plpgsql(original_data_table, col_names, X_name, K, N, cur,
+            dmeasure="arithmetic", policy="cardinality",
+            outdir="out/", out_prefix="out",
+            verbose=True,
+            para_index=True, r_index=-1, b_index=0, Bn_index=True,
+            encode_values=False, storage="logged", persistent=False,
+            output="tuples", out_format="csv", checkpoint=False):
+    """
+    D-Cube algorithm. Find K dense blocks in a given tensor.
+    Each block is found by a single CALL of a stored procedure, so that the ordered
+    removal does not need any client/server round-trip.
+    Args:
+        original_data_table: name of the data relation; it has N+1 columns,
+                where the first N columns for the N dimensions with names col_names,
+                and the last column specifying the measure attribute with name X_name.
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        K: number of blocks
+        N: number of dimension
+        cur: cursor of database connection
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        policy: "cardinality" or "density"
+        outdir: output directory
+        out_prefix: prefix of the output results
+        verbose: whether to print the finded block to stdout
+        para_index: whether to create a hash index for parameters
+        r_index: create an index for the i-th attribute in data_table
+        b_index: create an index for the i-th attribute in Btable
+        Bn_index: whether to create index on Bn
+        encode_values: whether to work on int4 codes of the values instead of the values
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+        persistent: whether the distinct values of each dimension and the total mass of
+                the data relation are kept in <relation>_R<n> and <relation>_stats
+                (see append_tensor in dcube_loader.py), instead of being computed from it
+        output: "tuples" to save the entries of each block, or "summary" to save only
+                its values, mass and density (see save_block_summary), without
+                building the relation block<k>
+        out_format: the format of the block files, one of OUT_FORMATS in dcube_output.py
+        checkpoint: whether to commit the working relations after each block but the
+                last one, and to resume after the last checkpoint (see dcube_checkpoint.py)
+    """
+    for (k, params) in iter_blocks_plpgsql(original_data_table, col_names, X_name, K, N, cur,
+                dmeasure, policy, outdir, out_prefix, verbose, para_index, r_index,
+                b_index, Bn_index, encode_values, storage, persistent, output,
+                out_format, checkpoint):
+        pass
+
+
+def iter_blocks_plpgsql(original_data_table, col_names, X_name, K, N, cur,
+            dmeasure="arithmetic", policy="cardinality",
+            outdir="out/", out_prefix="out",
+            verbose=True,
+            para_index=True, r_index=-1, b_index=0, Bn_index=True,
+            encode_values=False, storage="logged", persistent=False,
+            output="tuples", out_format="csv", checkpoint=False):
+    """
+    D-Cube algorithm as a generator, which yields (k, params) as soon as the k-th block
+    is saved, where params are the client-side parameters, None here as they are
+    kept in the relation "parameters".
+    At that point, the relations block<k> and final_B<n> hold the block, and the
+    relation "parameters" still describes the relation before the block is removed.
+    The arguments are those of dcube_plpgsql; if outdir is None, the blocks are not
+    written to files. If the generator is closed early, the working tables are dropped.
+    If output is "summary", block<k> is not built, and the block is saved once removed.
+    """
+    ## initialization: the same tables as the "Copy" implementation, unless the tables
+    ## are kept by a checkpoint
+    data_table = "mydata"
+    k_start = checkpoint_blocks(cur) if checkpoint else 0
+    set_phase(cur, "init_tables")
+    if k_start == 0:
+        init_dcube_tables(original_data_table, data_table, col_names, X_name,
+                        K, N, cur, para_index, r_index, encode_values, storage, persistent)
+    install_procedures(cur)
+
+    ## repeatedly find dense sub-blocks
+    for k in range(k_start, K):
+        ## find single block
+        print ("Start finding the %d-th block ..." % (k+1))
+        block_start = time.time()
+        set_block(cur, k)
+        set_phase(cur, "find_single_block")
+        cur.execute("CALL dcube_find_single_block(%s, %s, %s, %s, %s, %s, %s, %s);",
+                    (data_table, col_names, X_name, dmeasure, policy, b_index, Bn_index,
+                     create_table(storage)))
+
+        set_phase(cur, "save_block")
+        entries = None
+        if output == "tuples":
+            entries = save_block(original_data_table, col_names, X_name,
+                        k, N, cur, outdir, out_prefix, verbose, encode_values, storage,
+                        out_format)
+        try:
+            yield (k, None)
+        except GeneratorExit:
+            set_block(cur, None)
+            set_phase(cur, "clean_up")
+            clean_up(data_table, N, k, cur, output == "tuples")
+            raise
+
+        ## remove the entries in the found block from data table
+        set_phase(cur, "remove_block")
+        prev_total_mass = get_parameter(cur, 'total_mass')
+        (R_card, total_mass, B_card, B_mass) = remove_block(data_table, col_names, X_name,
+                            k, N, cur, None, encode_values, output == "summary")
+        if output == "summary" and outdir is not None:
+            set_phase(cur, "save_block")
+            save_block_summary(k, N, cur, outdir, out_prefix, dmeasure, prev_total_mass,
+                            B_card, B_mass, None, encode_values)
+        if entries is not None:
+            update_manifest(outdir, out_prefix, k, block_file(outdir, out_prefix, k, out_format),
+                            out_format, col_names + [X_name], entries, B_mass)
+
+        ## if no entries or no mass are left in the table, stop the loop
+        if R_card == 0 or total_mass == 0:
+            print ("Algorithm stopped after finding %d blocks because no mass is left." %
+                (k+1))
+            break
+        if checkpoint and k < K-1:
+            save_checkpoint(cur, k, B_card, B_mass, time.time() - block_start)
+
+    ## clean up: drop the temporary tables
+    set_block(cur, None)
+    set_phase(cur, "clean_up")
+    clean_up(data_table, N, k, cur, output == "tuples")
+
+
+def install_procedures(cur):
+    """
+    Install (or replace) the stored procedures used by dcube_plpgsql.
+    Args:
+        cur: cursor of database connection
+    """
+    cur.execute(DENSITY_FUNCTION)
+    cur.execute(FIND_SINGLE_BLOCK_PROCEDURE)
+
+
+## dcube_density(dmeasure, B_mass, card_B, card_R, total_mass) returns the pair
+## (density, average cardinality or product), the same as compute_density in dcube_utils;
+## arrays are compared lexicographically, the same as the Python tuples
+DENSITY_FUNCTION = """
+CREATE OR REPLACE FUNCTION dcube_density(dmeasure text, B_mass double precision,
+        card_B double precision[], card_R double precision[],
+        total_mass double precision)
+RETURNS double precision[] LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+    num_dims int := array_length(card_B, 1);
+    avg_card double precision;
+    product double precision := 1;
+BEGIN
+    IF dmeasure = 'arithmetic' THEN
+        avg_card := 0;
+        FOR n IN 1..num_dims LOOP
+            avg_card := avg_card + card_B[n] / num_dims::double precision;
+        END LOOP;
+        IF avg_card = 0 THEN
+            RETURN ARRAY[-1, 0]::double precision[];
+        END IF;
+        RETURN ARRAY[B_mass / avg_card, avg_card];
+
+    ELSIF dmeasure = 'geometric' THEN
+        avg_card := 1;
+        FOR n IN 1..num_dims LOOP
+            avg_card := avg_card * card_B[n];
+        END LOOP;
+        avg_card := power(avg_card, 1.0::double precision / num_dims);
+        IF avg_card = 0 THEN
+            RETURN ARRAY[-1, 0]::double precision[];
+        END IF;
+        RETURN ARRAY[B_mass / avg_card, avg_card];
+
+    ELSIF dmeasure = 'suspicious' THEN
+        FOR n IN 1..num_dims LOOP
+            product := product * (card_B[n] / card_R[n]);
+        END LOOP;
+        IF product = 0 OR B_mass = 0 OR total_mass = 0 THEN
+            RETURN ARRAY[-1, product];
+        END IF;
+        RETURN ARRAY[B_mass * (ln(B_mass / total_mass) - 1) + total_mass * product
+                        - B_mass * ln(product), product];
+    END IF;
+    RAISE EXCEPTION 'dmeasure must be one of arithmetic, geometric or suspicious.';
+END $$;
+"""
+
+
+## dcube_find_single_block runs find_single_block of the "Copy" implementation;
+## dimensions are 0-based in table names and rmOrder, and 1-based in the arrays
+FIND_SINGLE_BLOCK_PROCEDURE = """
+CREATE OR REPLACE PROCEDURE dcube_find_single_block(data_table text, col_names text[],
+        X_name text, dmeasure text, policy text, b_index int, Bn_index boolean,
+        create_table text)
+LANGUAGE plpgsql AS $$
+DECLARE
+    num_dims int := array_length(col_names, 1);
+    card_B double precision[];
+    card_R double precision[];
+    trial_card double precision[];
+    dens double precision[];
+    max_dim_dens double precision[];
+    total_mass double precision;
+    B_mass double precision;
+    avg_mass double precision;
+    avg_card double precision;
+    density double precision;
+    max_dens double precision;
+    card double precision;
+    rm_mass double precision;
+    rm_card bigint;
+    num_rows bigint;
+    curr_order int := 1;
+    max_order int := 1;
+    n_rm int;
+    rec record;
+BEGIN
+    -- initialize the Btable; this table will be eliminated in the end
+    EXECUTE format('%s Btable AS SELECT * FROM %s', create_table, data_table);
+    IF b_index >= 0 AND b_index < num_dims THEN
+        EXECUTE format('CREATE INDEX ON Btable (%s)', col_names[b_index+1]);
+    END IF;
+
+    -- total mass in Btable; initially equals to current total mass
+    SELECT value INTO total_mass FROM parameters WHERE par = 'total_mass';
+    B_mass := total_mass;
+
+    -- clean up temporary tables, and compute Bn (value, mass)
+    DELETE FROM rmOrder;
+    FOR n IN 0..num_dims-1 LOOP
+        EXECUTE format('DELETE FROM final_B%s', n);
+        EXECUTE format('DELETE FROM B%s', n);
+        EXECUTE format('INSERT INTO B%s (value, mass) '
+            || '(SELECT %s as value, sum(%s) as mass FROM Btable GROUP BY value ORDER BY mass)',
+            n, col_names[n+1], X_name);
+        GET DIAGNOSTICS num_rows = ROW_COUNT;
+        card_B[n+1] := num_rows;
+        IF Bn_index THEN
+            EXECUTE format('CREATE INDEX IF NOT EXISTS B%s_value_idx ON B%s (value)', n, n);
+        END IF;
+        SELECT value INTO card FROM parameters WHERE par = 'card_R' || n;
+        card_R[n+1] := card;
+    END LOOP;
+
+    dens := dcube_density(dmeasure, B_mass, card_B, card_R, total_mass);
+    max_dens := dens[1];
+    avg_card := dens[2];
+    IF dmeasure = 'suspicious' THEN
+        -- the logarithm of the product, see init_density in dcube_utils
+        avg_card := CASE WHEN avg_card > 0 THEN ln(avg_card) ELSE '-Infinity' END;
+    END IF;
+    density := max_dens;
+
+    -- repeatedly remove all entries in Btable
+    WHILE EXISTS (SELECT 1 FROM unnest(card_B) AS c WHERE c > 0) LOOP
+        -- select dimension to remove
+        IF policy = 'cardinality' THEN
+            n_rm := -1;
+            card := -1;
+            FOR n IN 0..num_dims-1 LOOP
+                IF card_B[n+1] > card THEN
+                    n_rm := n;
+                    card := card_B[n+1];
+                END IF;
+            END LOOP;
+        ELSIF policy = 'density' THEN
+            n_rm := 0;
+            max_dim_dens := NULL;
+            FOR n IN 0..num_dims-1 LOOP
+                IF card_B[n+1] > 0 THEN
+                    -- the density if we remove all values with mass <= average
+                    EXECUTE format('SELECT sum(mass), count(*) FROM B%s WHERE mass <= $1', n)
+                        INTO rm_mass, rm_card USING B_mass / card_B[n+1];
+                    trial_card := card_B;
+                    trial_card[n+1] := card_B[n+1] - rm_card;
+                    dens := dcube_density(dmeasure, B_mass - rm_mass, trial_card,
+                                            card_R, total_mass);
+                    IF max_dim_dens IS NULL OR dens > max_dim_dens THEN
+                        n_rm := n;
+                        max_dim_dens := dens;
+                    END IF;
+                END IF;
+            END LOOP;
+        ELSE
+            RAISE EXCEPTION 'policy must be one of cardinality or density.';
+        END IF;
+
+        -- entries that have mass smaller than the average will be removed
+        card := card_B[n_rm+1];
+        avg_mass := B_mass / card;
+
+        -- "remove" these entries from Btable by setting mass=0
+        EXECUTE format('UPDATE Btable SET %s=0 WHERE EXISTS '
+            || '(SELECT 1 FROM B%s WHERE B%s.mass <= $1 and B%s.value=Btable.%s)',
+            X_name, n_rm, n_rm, n_rm, col_names[n_rm+1]) USING avg_mass;
+
+        -- delete entries in B_rm in increasing order of mass
+        FOR rec IN EXECUTE format('SELECT value, mass FROM B%s WHERE mass <= $1 '
+                || 'ORDER BY mass, value', n_rm) USING avg_mass LOOP
+            -- record the delete order
+            INSERT INTO rmOrder (value, dimension, r) VALUES (rec.value, n_rm, curr_order);
+            curr_order := curr_order + 1;
+
+            -- new density, the same as update_density in dcube_utils
+            IF dmeasure = 'suspicious' THEN
+                IF card <= 1 THEN
+                    avg_card := '-Infinity';
+                ELSE
+                    avg_card := avg_card + ln((card - 1) / card);
+                END IF;
+                IF avg_card = '-Infinity' OR B_mass - rec.mass <= 0 OR total_mass = 0 THEN
+                    density := -1;
+                ELSE
+                    density := (B_mass - rec.mass) * (ln((B_mass - rec.mass) / total_mass) - 1)
+                                + total_mass * exp(avg_card) - (B_mass - rec.mass) * avg_card;
+                END IF;
+            ELSIF dmeasure = 'geometric' THEN
+                IF B_mass = 0 OR card <= 1 THEN
+                    density := -1;
+                ELSE
+                    density := density * ((B_mass - rec.mass) / B_mass);
+                    density := density * (power(card, 1.0::double precision / num_dims)
+                                        / power(card - 1, 1.0::double precision / num_dims));
+                END IF;
+            ELSIF dmeasure = 'arithmetic' THEN
+                IF B_mass = 0 OR avg_card <= 1.0::double precision / num_dims THEN
+                    density := -1;
+                ELSE
+                    density := density * ((B_mass - rec.mass) / B_mass);
+                    density := density * (avg_card / (avg_card - 1.0::double precision / num_dims));
+                END IF;
+                avg_card := avg_card - 1.0::double precision / num_dims;
+            END IF;
+            card := card - 1;
+            B_mass := B_mass - rec.mass;
+            card_B[n_rm+1] := card;
+
+            -- update maximal density
+            IF density > max_dens THEN
+                max_dens := density;
+                max_order := curr_order;
+            END IF;
+        END LOOP;
+        EXECUTE format('DELETE FROM B%s WHERE mass <= $1', n_rm) USING avg_mass;
+
+        -- because we have removed entries from Btable, we need to re-compute the mass
+        FOR n IN 0..num_dims-1 LOOP
+            IF n <> n_rm THEN
+                DELETE FROM new_B;
+                EXECUTE format('INSERT INTO new_B (value, mass) '
+                    || '(SELECT value, sum(%s) as mass FROM Btable JOIN B%s ON Btable.%s=B%s.value '
+                    || 'GROUP BY value ORDER BY mass)', X_name, n, col_names[n+1], n);
+                EXECUTE format('DELETE FROM B%s', n);
+                EXECUTE format('INSERT INTO B%s (value, mass) (SELECT value, mass FROM new_B)', n);
+                GET DIAGNOSTICS num_rows = ROW_COUNT;
+                card_B[n+1] := num_rows;
+            END IF;
+        END LOOP;
+    END LOOP;
+
+    -- reconstruct the dense block
+    FOR n IN 0..num_dims-1 LOOP
+        EXECUTE format('INSERT INTO final_B%s (value) '
+            || '(SELECT R.value as value FROM R%s as R, rmOrder '
+            || 'WHERE R.value=rmOrder.value and rmOrder.dimension=%s and rmOrder.r >= %s)',
+            n, n, n, max_order);
+        UPDATE parameters SET value = card_B[n+1] WHERE par = 'card_B' || n;
+    END LOOP;
+    UPDATE parameters SET value = B_mass WHERE par = 'B_mass';
+
+    -- clean up: drop the temporary table
+    DROP TABLE Btable;
+END $$;
+"""
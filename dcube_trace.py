@@ -0,0 +1,297 @@
+#################################################
+## Instrumentation for D-CUBE
+##
+## TracingCursor wraps the cursor of database connection and records, for each phase
+## of each block and pass, the wall time, the time spent in SQL statements,
+## the number of statements and the number of rows affected.
+## The implementations mark the phases with set_block and set_phase in dcube_utils.
+##
+## ProfilingCursor additionally captures EXPLAIN (ANALYZE, BUFFERS) of the first execution
+## of each distinct statement shape, and the table statistics of each phase.
+#################################################
+
+import json, re, time
+import psycopg2
+
+
+class TracingCursor(object):
+    """
+    A cursor that records a trace of the statements it executes.
+    All other attributes are those of the wrapped cursor.
+    """
+
+    def __init__(self, cur):
+        """
+        Args:
+            cur: cursor of database connection
+        """
+        self._cur = cur
+        self._block = None
+        self._key = (None, None, "other")
+        self._since = time.time()
+        ## (block, pass, phase) -> record, in order of first appearance
+        self._records = {}
+        self._keys = []
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def set_block(self, k):
+        """
+        Record the following statements for the k-th block; None outside of the blocks.
+        """
+        self._block = k
+
+    def set_phase(self, phase, npass=None):
+        """
+        Record the following statements for the phase of the current block.
+        Args:
+            phase: name of the phase
+            npass: the pass of find_single_block, if the phase is repeated in each pass
+        """
+        self._close()
+        self._key = (self._block, npass, phase)
+
+    def _close(self):
+        """
+        Add the wall time since the last change of phase to the current phase.
+        """
+        now = time.time()
+        self._record()["wall"] += now - self._since
+        self._since = now
+
+    def _record(self):
+        if self._key not in self._records:
+            self._records[self._key] = {"block": self._key[0], "pass": self._key[1],
+                    "phase": self._key[2], "wall": 0.0, "sql": 0.0,
+                    "statements": 0, "rows": 0}
+            self._keys.append(self._key)
+        return self._records[self._key]
+
+    def _timed(self, method, *args, **kwargs):
+        start = time.time()
+        result = method(*args, **kwargs)
+        record = self._record()
+        record["sql"] += time.time() - start
+        record["statements"] += 1
+        record["rows"] += max(self._cur.rowcount, 0)
+        return result
+
+    def execute(self, *args, **kwargs):
+        return self._timed(self._cur.execute, *args, **kwargs)
+
+    def copy_from(self, *args, **kwargs):
+        return self._timed(self._cur.copy_from, *args, **kwargs)
+
+    def copy_to(self, *args, **kwargs):
+        return self._timed(self._cur.copy_to, *args, **kwargs)
+
+    def copy_expert(self, *args, **kwargs):
+        return self._timed(self._cur.copy_expert, *args, **kwargs)
+
+    def records(self):
+        """
+        The records of the trace, in order of first appearance.
+        """
+        self._close()
+        return [self._records[key] for key in self._keys]
+
+    def summary(self):
+        """
+        Aggregate the records by phase and by block.
+        Returns:
+            (by_phase, by_block), two lists of (name, record) in order of first appearance
+        """
+        by_phase, by_block = [], []
+        for (groups, field) in [(by_phase, "phase"), (by_block, "block")]:
+            index = {}
+            for record in self.records():
+                name = record[field]
+                if name not in index:
+                    index[name] = len(groups)
+                    groups.append((name, {"wall": 0.0, "sql": 0.0,
+                                        "statements": 0, "rows": 0}))
+                total = groups[index[name]][1]
+                for x in total:
+                    total[x] += record[x]
+        return (by_phase, by_block)
+
+    def write_trace(self, outfile):
+        """
+        Write the trace and its summary to a JSON file.
+        Args:
+            outfile: path of the output file
+        """
+        (by_phase, by_block) = self.summary()
+        trace = {"records": self.records(),
+                "phases": [dict(total, phase=name) for (name, total) in by_phase],
+                "blocks": [dict(total, block=name) for (name, total) in by_block]}
+        with open(outfile, mode="wt") as fout:
+            json.dump(trace, fout, indent=1, sort_keys=True)
+
+    def print_summary(self):
+        """
+        Print the time, statements and rows of each phase and each block to stdout.
+        """
+        (by_phase, by_block) = self.summary()
+        wall = sum([total["wall"] for (name, total) in by_phase]) or 1.0
+        fmt = "%-18s %10s %10s %7s %11s %11s"
+        for (groups, title) in [(by_phase, "phase"), (by_block, "block")]:
+            print (fmt % (title, "wall(s)", "sql(s)", "%wall", "statements", "rows"))
+            for (name, total) in groups:
+                if name is None:
+                    name = "-"
+                elif title == "block":
+                    name = str(name + 1)
+                print (fmt % (name, "%.3f" % total["wall"], "%.3f" % total["sql"],
+                            "%.1f" % (100.0 * total["wall"] / wall),
+                            total["statements"], total["rows"]))
+
+
+## statements that EXPLAIN ANALYZE can run
+EXPLAINABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH"
+                r"|CREATE\s+((UNLOGGED|TEMP)\s+)?TABLE\s+\w+\s+AS)\b", re.I)
+## string and numeric literals, which do not change the shape of a statement
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+## counters of pg_stat_xact_user_tables, which are up to date within the transaction
+TABLE_COUNTERS = ["seq_scan", "seq_tup_read", "idx_scan", "idx_tup_fetch",
+                "n_tup_ins", "n_tup_upd", "n_tup_del"]
+
+
+def statement_shape(sql):
+    """
+    The statement with its literals replaced by '?' and its whitespace normalized.
+    """
+    return " ".join(LITERALS.sub("?", sql).split())
+
+
+def plan_nodes(plan):
+    """
+    All the nodes of a plan given by EXPLAIN (FORMAT JSON).
+    """
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+class ProfilingCursor(TracingCursor):
+    """
+    A TracingCursor that also runs EXPLAIN (ANALYZE, BUFFERS) for the first execution of
+    each distinct statement shape, in a savepoint which is rolled back before the statement
+    itself is executed, and records the changes of pg_stat_xact_user_tables in each phase.
+    PostgreSQL only reports temporary files at the end of the transaction, so the temp
+    bytes of a phase are those written by the statements explained in it.
+    """
+
+    def __init__(self, cur):
+        """
+        Args:
+            cur: cursor of database connection
+        """
+        TracingCursor.__init__(self, cur)
+        self._shapes = set()
+        self._plans = []
+        cur.execute("SELECT current_setting('block_size')::int;")
+        self._block_size = cur.fetchone()[0]
+        self._tables = self._table_stats()
+
+    def execute(self, sql, args=None):
+        if args is not None:
+            sql = self._cur.mogrify(sql, args)
+        shape = statement_shape(sql)
+        if shape not in self._shapes and EXPLAINABLE.match(sql):
+            self._shapes.add(shape)
+            self._explain(sql, shape)
+        return TracingCursor.execute(self, sql)
+
+    def _explain(self, sql, shape):
+        """
+        Record the plan of a statement, without keeping its effects.
+        """
+        (block, npass, phase) = self._key
+        entry = {"block": block, "pass": npass, "phase": phase, "shape": shape, "sql": sql}
+        start = time.time()
+        before = self._table_stats()
+        self._cur.execute("SAVEPOINT dcube_profile;")
+        try:
+            self._cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)
+            result = self._cur.fetchone()[0]
+            if not isinstance(result, list):
+                result = json.loads(result)
+            plan = result[0]
+            nodes = plan_nodes(plan["Plan"])
+            entry["plan"] = plan
+            entry["execution_time"] = plan.get("Execution Time", 0.0) / 1000.0
+            entry["temp_bytes"] = self._block_size * plan["Plan"].get("Temp Written Blocks", 0)
+            entry["seq_scans"] = sorted(set([node["Relation Name"] for node in nodes
+                        if node["Node Type"] == "Seq Scan" and "Relation Name" in node]))
+        except psycopg2.Error as e:
+            entry["error"] = str(e).strip()
+        self._cur.execute("ROLLBACK TO SAVEPOINT dcube_profile;")
+        self._cur.execute("RELEASE SAVEPOINT dcube_profile;")
+        ## the statistics count the rolled back execution too; it is excluded from the phase
+        for (relid, (relname, counters)) in self._table_stats().iteritems():
+            if relid in self._tables:
+                prev = before.get(relid, (relname, counters))[1]
+                shifted = [base + after - b for (base, after, b) in
+                            zip(self._tables[relid][1], counters, prev)]
+                self._tables[relid] = (relname, shifted)
+        entry["profile_time"] = time.time() - start
+        self._plans.append(entry)
+        record = self._record()
+        record["temp_bytes"] = record.get("temp_bytes", 0) + entry.get("temp_bytes", 0)
+
+    def _table_stats(self):
+        """
+        The counters of pg_stat_xact_user_tables, by relid.
+        """
+        self._cur.execute(("SELECT relid, relname, %s FROM pg_stat_xact_user_tables;" % 
+                ",".join(["coalesce(%s, 0)" % counter for counter in TABLE_COUNTERS])))
+        return dict([(row[0], (row[1], row[2:])) for row in self._cur.fetchall()])
+
+    def _close(self):
+        """
+        Also add the changes of the table statistics since the last change of phase
+        to the current phase. A table re-created with the same name is a new relid.
+        """
+        TracingCursor._close(self)
+        tables = self._table_stats()
+        changes = self._record().setdefault("tables", {})
+        for (relid, (relname, counters)) in tables.iteritems():
+            before = self._tables.get(relid, (relname, [0] * len(TABLE_COUNTERS)))[1]
+            delta = [after - prev for (after, prev) in zip(counters, before)]
+            if any(delta):
+                change = changes.setdefault(relname, dict.fromkeys(TABLE_COUNTERS, 0))
+                for (counter, d) in zip(TABLE_COUNTERS, delta):
+                    change[counter] += d
+        self._tables = tables
+        self._since = time.time()
+
+    def write_profile(self, outfile):
+        """
+        Write the plans and the statistics of each phase to a JSON file.
+        Args:
+            outfile: path of the output file
+        """
+        profile = {"plans": self._plans, "phases": self.records()}
+        with open(outfile, mode="wt") as fout:
+            json.dump(profile, fout, indent=1, sort_keys=True, default=str)
+
+    def print_profile(self, top=10):
+        """
+        Print the explained statements with the longest execution time to stdout,
+        with the relations they scan sequentially and the bytes they write to temp files.
+        Args:
+            top: number of statements to print
+        """
+        plans = sorted([entry for entry in self._plans if "plan" in entry],
+                        key=lambda entry: -entry["execution_time"])
+        print ("%d statement shapes were explained; the slowest ones:" % len(self._plans))
+        for entry in plans[:top]:
+            print ("%9.3fs %10d temp bytes  seq scans on %s" % (entry["execution_time"],
+                    entry["temp_bytes"], ",".join(entry["seq_scans"]) or "-"))
+            print ("\t%s" % entry["shape"][:150])
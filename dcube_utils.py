@@ -1,43 +1,46 @@
 ## Utility functions for DCube
 ##
 
-import math
+import csv, math
+from io import BytesIO
 import psycopg2
 
-def compute_density(cur, N, dmeasure):
+def compute_density(cur, N, dmeasure, params=None):
     """
     Args:
         cur: cursor of database connection
         N: number of dimensions
         dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        params: client-side parameters; if None, use the relation "parameters"
     """
     if dmeasure == "arithmetic":
-        return compute_density_ari(cur, N)
+        return compute_density_ari(cur, N, params)
 
     elif dmeasure == "geometric":
-        return compute_density_geo(cur, N)
+        return compute_density_geo(cur, N, params)
 
     elif dmeasure == "suspicious":
-        return compute_density_susp(cur, N)
+        return compute_density_susp(cur, N, params)
 
 
-def compute_density_susp(cur, N):
+def compute_density_susp(cur, N, params=None):
     """
     Compute density using the suspiciousness
     Args:
         cur: cursor of database connection
         N: number of dimensions
+        params: client-side parameters; if None, use the relation "parameters"
     """
     ## first compute \prod_n |B_n|/|R_n|
     product = 1
     for n in range(N):
-        B_card = get_parameter(cur, par=("card_B%d" % n))
-        R_card = get_parameter(cur, par=("card_R%d" % n))
+        B_card = get_parameter(cur, ("card_B%d" % n), params)
+        R_card = get_parameter(cur, ("card_R%d" % n), params)
         product *= (B_card / float(R_card))
 
     ## suspiciousness
-    B_mass = get_parameter(cur, par="B_mass")
-    R_mass = get_parameter(cur, par="total_mass")
+    B_mass = get_parameter(cur, "B_mass", params)
+    R_mass = get_parameter(cur, "total_mass", params)
     if product == 0 or B_mass == 0 or R_mass == 0: 
         return (-1, product)
     else:
@@ -46,38 +49,40 @@ def compute_density_susp(cur, N):
         return (susp, product)
 
 
-def compute_density_ari(cur, N):
+def compute_density_ari(cur, N, params=None):
     """
     Compute density using the arithmetic average mass
     Args:
         cur: cursor of database connection
         N: number of dimensions
+        params: client-side parameters; if None, use the relation "parameters"
     """
     ## arithmetic average cardinality
     avg_card = 0
     for n in range(N):
-        card = get_parameter(cur, par=("card_B%d" % n))
+        card = get_parameter(cur, ("card_B%d" % n), params)
         avg_card += card / float(N)
 
     ## average mass
     if avg_card == 0:
         return (-1, 0)
     else:
-        return (get_parameter(cur, par="B_mass") / avg_card, avg_card)
+        return (get_parameter(cur, "B_mass", params) / avg_card, avg_card)
 
 
-def compute_density_geo(cur, N):
+def compute_density_geo(cur, N, params=None):
     """
     Compute density using the geometric average mass
     Args:
         cur: cursor of database connection
         N: number of dimensions
+        params: client-side parameters; if None, use the relation "parameters"
     """
     ## geometric average cardinality
     avg_card = 1
 
     for n in range(N):
-        card = get_parameter(cur, par=("card_B%d" % n))
+        card = get_parameter(cur, ("card_B%d" % n), params)
         avg_card *= card
     avg_card = math.pow(avg_card, 1.0/N)
 
@@ -85,74 +90,702 @@ def compute_density_geo(cur, N):
     if avg_card == 0:
         return (-1, 0)
     else:
-        return (get_parameter(cur, par="B_mass") / avg_card, avg_card)
+        return (get_parameter(cur, "B_mass", params) / avg_card, avg_card)
 
 
-def select_dim_by_card(cur, N):
+def init_density(cur, N, dmeasure, params=None):
+    """
+    Compute the density of the current block, and the state which update_density
+    keeps along with it: the average cardinality of all Bn's for the arithmetic and
+    geometric dmeasure, and the logarithm of \prod_n |B_n|/|R_n| for the suspiciousness.
+    Args:
+        cur: cursor of database connection
+        N: number of dimensions
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        params: client-side parameters; if None, use the relation "parameters"
+    """
+    (density, avg_card) = compute_density(cur, N, dmeasure, params)
+    if dmeasure == "suspicious":
+        avg_card = math.log(avg_card) if avg_card > 0 else float("-inf")
+    return (density, avg_card)
+
+
+def update_density(density, N, dmeasure, B_mass, card, curr_mass, avg_card, R_mass):
+    """
+    Update the density after removing 1 element from B_rm, in O(1) time, without
+    reading the parameters.
+    Args:
+        density: current density
+        N: number of dimension
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        B_mass: current total mass in B
+        card: current cardinality of B_rm
+        curr_mass: the mass to be removed
+        avg_card: the state of init_density, i.e. the average cardinality of all Bn's,
+                or the logarithm of \prod_n |B_n|/|R_n| for the suspiciousness
+        R_mass: total mass of R, used for the suspiciousness
+    Returns:
+        (density, card, B_mass, avg_card) after removing the element
+    """
+    if dmeasure == "suspicious":
+        ## log(\prod_n |B_n|/|R_n|) changes only by the factor of B_rm
+        if card <= 1:
+            avg_card = float("-inf")
+        else:
+            avg_card += math.log((card - 1) / float(card))
+        if avg_card == float("-inf") or B_mass - curr_mass <= 0 or R_mass == 0:
+            density = -1
+        else:
+            density = ((B_mass - curr_mass) * (math.log((B_mass - curr_mass)/float(R_mass)) - 1)
+                        + R_mass * math.exp(avg_card) - (B_mass - curr_mass) * avg_card)
+    ## for the other two density measures, we have simplier updating method
+    elif dmeasure == "geometric":
+        if B_mass == 0 or card <= 1:
+            density = -1
+        else:
+            density *= (B_mass - curr_mass) / B_mass
+            density *= math.pow(card, 1.0/N)/math.pow(card-1, 1.0/N)
+    elif dmeasure == "arithmetic":
+        if B_mass == 0 or avg_card <= 1.0/N:
+            density = -1
+        else:
+            density *= (B_mass - curr_mass) / B_mass
+            density *= avg_card/(avg_card - 1.0/N)
+        avg_card -= 1.0/N
+    card -= 1
+    B_mass -= curr_mass
+
+    return (density, card, B_mass, avg_card)
+
+
+def select_dim_by_card(cur, N, params=None):
     """
     Select the next dimension to remove with the largest cardinality.
     Args:
         cur: cursor of database connection
         N: number of total dimensions
+        params: client-side parameters; if None, use the relation "parameters"
     """
     max_dim, max_card = -1, -1
     for n in range(N):
         ## cardinality of B_n
-        card = get_parameter(cur, par=("card_B%d" % n))
+        card = get_parameter(cur, ("card_B%d" % n), params)
         if card > max_card:
             max_dim, max_card = n, card
     return max_dim
 
 
-def select_dim_by_dens(cur, N, dmeasure):
+def select_dim_by_dens(cur, N, dmeasure, params=None):
     """
     Select the next dimension to remove by density.
     Args:
         cur: cursor of database connection
         N: number of total dimensions
         dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        params: client-side parameters; if None, use the relation "parameters"
     """
     max_dens, max_dim = -10, 0 ## note: by construction density is always >= -1
-    B_mass = get_parameter(cur, par="B_mass")
+    if params is None:
+        params = fetch_parameters(cur)
+    B_mass = get_parameter(cur, "B_mass", params)
+
+    ## the mass and number of the values with mass <= average in each Bn
+    cards = [get_parameter(cur, ("card_B%d" % n), params) for n in range(N)]
+    removed = select_Bn_prefix(cur, [(n, B_mass/float(cards[n])) for n in range(N)
+                                    if cards[n] > 0], params)
 
     for n in range(N):
-        card = get_parameter(cur, par=("card_B%d" % n))
+        card = cards[n]
         if card > 0:
             ## what will the density be if we remove all values with mass <= average
-            avg_mass = B_mass/float(card)
-            cur.execute("SELECT sum(mass), count(*) FROM B%d WHERE mass <= %f;" % (n, avg_mass))
-            (rm_mass, rm_card) = cur.fetchone()
+            (rm_mass, rm_card) = removed[n]
 
-            update_parameter(cur, ("card_B%d" % n), card - rm_card)
-            cur.execute("UPDATE parameters SET value=value-%f WHERE par='B_mass';" % rm_mass)
-            density = compute_density(cur, N, dmeasure)
+            ## evaluate it on a copy of the parameters
+            trial = dict(params)
+            trial["card_B%d" % n] = card - rm_card
+            trial["B_mass"] = B_mass - rm_mass
+            density = compute_density(cur, N, dmeasure, trial)
             if density > max_dens:
                 max_dim, max_dens = n, density
 
-            ## need to change the parameters back
-            update_parameter(cur, ("card_B%d" % n), card)
-            update_parameter(cur, "B_mass", B_mass)
-
     return max_dim
 
 
 
-def select_dimension(cur, N, policy, dmeasure):
+def select_Bn_prefix(cur, thresholds, params=None):
+    """
+    Find the total mass and the number of the values with mass <= a threshold in each
+    given Bn, with one lookup of the B-tree on Bn (mass) per dimension, all in one query.
+    The cumulative columns of Bn (see cumulative_Bn) count the values that were removed
+    from Bn since they were computed, which are subtracted (see remove_Bn_prefix).
+    Args:
+        cur: cursor of database connection
+        thresholds: list of (n, threshold), with the dimensions to look up
+        params: client-side parameters; if None, use the relation "parameters"
+    Returns:
+        dict of n to (mass, count)
+    """
+    if not thresholds:
+        return {}
+    cur.execute(" UNION ALL ".join([(("(SELECT %d, cum_mass, cum_card FROM B%d " % (n, n))
+                    + ("WHERE mass <= %r ORDER BY mass DESC LIMIT 1)" % threshold))
+                    for (n, threshold) in thresholds]) + ";")
+    found = dict([(n, (cum_mass, cum_card)) for (n, cum_mass, cum_card) in cur.fetchall()])
+
+    prefix = {}
+    for (n, threshold) in thresholds:
+        (cum_mass, cum_card) = found.get(n, (0, 0))
+        prefix[n] = (max(cum_mass - get_parameter(cur, "rm_mass_B%d" % n, params), 0),
+                    max(cum_card - get_parameter(cur, "rm_card_B%d" % n, params), 0))
+    return prefix
+
+
+def cumulative_Bn(select, mark=False):
+    """
+    SQL query of Bn with its cumulative columns: cum_mass and cum_card are the total mass
+    and the number of the values with mass <= the mass of each value. The rows are in
+    increasing order of mass, in the same order as those of select.
+    Args:
+        select: SQL query of the values and their mass (and exists, for the mark
+                implementation), in increasing order of mass
+        mark: whether Bn has the "exists" column of the mark implementation, in which
+                case only the values with exists=1 are counted
+    """
+    if mark:
+        (cols, weight, count) = ("value, exists, mass", "mass*exists", "sum(exists)")
+    else:
+        (cols, weight, count) = ("value, mass", "mass", "count(*)")
+    return (("SELECT %s, sum(%s) OVER w AS cum_mass, %s OVER w AS cum_card " %
+                (cols, weight, count))
+        + ("FROM (%s) AS S WINDOW w AS (ORDER BY mass) ORDER BY mass" % select))
+
+
+def reset_Bn_prefix(cur, n, params=None):
+    """
+    Record that the cumulative columns of Bn are (re-)computed, so that no value has
+    been removed since.
+    """
+    update_parameter(cur, "rm_mass_B%d" % n, 0, params)
+    update_parameter(cur, "rm_card_B%d" % n, 0, params)
+
+
+def remove_Bn_prefix(cur, n_rm, card, B_mass, params=None):
+    """
+    Record the values removed from B_{n_rm} in a pass, before card_B<n_rm> and B_mass are
+    updated. They are the values with the smallest mass, and the mass of the others is
+    unchanged, so their cumulative columns are only offset by the removed mass and number.
+    Args:
+        cur: cursor of database connection
+        n_rm: the dimension removed in the pass
+        card: cardinality of B_{n_rm} after the pass
+        B_mass: total mass in B after the pass
+        params: client-side parameters; if None, use the relation "parameters"
+    """
+    update_parameter(cur, "rm_mass_B%d" % n_rm, get_parameter(cur, "rm_mass_B%d" % n_rm, params)
+                    + get_parameter(cur, "B_mass", params) - B_mass, params)
+    update_parameter(cur, "rm_card_B%d" % n_rm, get_parameter(cur, "rm_card_B%d" % n_rm, params)
+                    + get_parameter(cur, "card_B%d" % n_rm, params) - card, params)
+
+
+def select_dimension(cur, N, policy, dmeasure, params=None):
     """
     Args:
         cur: cursor of database connection
         N: number of total dimensions
         policy: "cardinality" or "density"
+        params: client-side parameters; if None, use the relation "parameters"
     """
     if policy == "cardinality":
-        return select_dim_by_card(cur, N)
+        return select_dim_by_card(cur, N, params)
     elif policy == "density":
-        return select_dim_by_dens(cur, N, dmeasure)
+        return select_dim_by_dens(cur, N, dmeasure, params)
     else:
         raise ValueError("policy must be one of 'cardinality' or 'density'.")
 
 
 
+def iter_Brows(Bn, cur, avg_mass, mark=False, itersize=10000):
+    """
+    Iterate over the values of Bn with mass <= avg_mass, in increasing order of mass
+    (and of value, among the values with the same mass), through a server-side cursor
+    which fetches itersize rows at a time. The values are selected when the iteration
+    starts, so they may be removed from Bn while they are read.
+    Args:
+        Bn: table name, one of B0 ... B(N-1)
+        cur: cursor for database connection
+        avg_mass: values with mass <= avg_mass are read
+        mark: whether Bn uses the "exists" column of the mark implementation, in which
+                case only the values with exists=1 are read
+        itersize: number of rows fetched at a time
+    """
+    condition = "mass <= %r" % avg_mass
+    if mark:
+        condition += " and exists=1"
+    named = cur.connection.cursor("dcube_%s" % Bn)
+    named.itersize = itersize
+    try:
+        named.execute("SELECT value, mass FROM %s WHERE %s ORDER BY mass, value;" %
+                        (Bn, condition))
+        for row in named:
+            yield row
+    finally:
+        named.close()
+
+
+class RemovalBuffer(object):
+    """
+    Write-behind buffer of the values removed from B_{n_rm} one at a time in a pass.
+    The removals are only recorded in memory, and flush() writes them with one COPY
+    into rmOrder and one set-based statement on B_{n_rm}, instead of one INSERT and one
+    DELETE (or UPDATE) per value.
+    """
+
+    def __init__(self, cur, n_rm, mark=False):
+        """
+        Args:
+            cur: cursor of database connection
+            n_rm: the dimension to remove
+            mark: whether the Bn tables use the "exists" column of the mark implementation,
+                    in which case the removed values are marked with exists=0
+        """
+        self._cur = cur
+        self._n_rm = n_rm
+        self._mark = mark
+        self._rows = []
+        self._first_order = None
+
+    def add(self, value, order):
+        """
+        Record the removal of a value, with its order in rmOrder.
+        """
+        if self._first_order is None:
+            self._first_order = order
+        value = str(value)
+        for (char, escaped) in [("\\", "\\\\"), ("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t")]:
+            value = value.replace(char, escaped)
+        self._rows.append("%s\t%d\t%d\n" % (value, self._n_rm, order))
+
+    def removed_values(self):
+        """
+        SQL query of the values written by flush().
+        """
+        return ("SELECT value FROM rmOrder WHERE dimension=%d and r >= %d" %
+                (self._n_rm, self._first_order))
+
+    def flush(self):
+        """
+        Write the recorded removals into rmOrder, and remove the values from B_{n_rm}.
+        Returns:
+            the number of removed values
+        """
+        if not self._rows:
+            return 0
+        self._cur.copy_expert("COPY rmOrder (value, dimension, r) FROM STDIN;",
+                            BytesIO("".join(self._rows)))
+        B_rm = "B%d" % self._n_rm
+        if self._mark:
+            self._cur.execute(("UPDATE %s SET exists=0 FROM (%s) AS R " %
+                                (B_rm, self.removed_values()))
+                + ("WHERE %s.value=R.value;" % B_rm))
+        else:
+            self._cur.execute(("DELETE FROM %s USING (%s) AS R " % (B_rm, self.removed_values()))
+                + ("WHERE %s.value=R.value;" % B_rm))
+        n_removed = len(self._rows)
+        self._rows = []
+        return n_removed
+
+
+def remove_batch(cur, N, n_rm, avg_mass, curr_order, dmeasure, mark=False, params=None):
+    """
+    Remove all values with mass <= avg_mass from B_{n_rm} with a few set-based statements,
+    instead of one value at a time. The values are ranked by mass in rmOrder, and the
+    density after removing each of them is computed from the cumulative mass and count.
+    Args:
+        cur: cursor of database connection
+        N: number of total dimensions
+        n_rm: the dimension to remove
+        avg_mass: values with mass <= avg_mass are removed
+        curr_order: the order of the first value to be removed
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        mark: whether the Bn tables use the "exists" column of the mark implementation
+        params: client-side parameters; if None, use the relation "parameters"
+    Returns:
+        (rm_card, rm_mass, best_order, best_dens), where rm_card and rm_mass are the number
+        and the total mass of removed values, and best_dens is the largest density during
+        this pass, reached when the next removed value would have order best_order.
+    """
+    B_rm = "B%d" % n_rm
+    condition = "mass <= %r" % avg_mass
+    if mark:
+        condition += " and exists=1"
+
+    ## record the delete order, in increasing order of mass
+    cur.execute("INSERT INTO rmOrder (value, dimension, r) "
+        + ("SELECT value, %d, %d + row_number() OVER (ORDER BY mass, value) " %
+            (n_rm, curr_order-1))
+        + ("FROM %s WHERE %s;" % (B_rm, condition)))
+
+    ## the remaining mass and cardinality of B_rm after removing the i-th value
+    traj = (("SELECT row_number() OVER w AS i, %r - sum(mass) OVER w AS b, " %
+                float(get_parameter(cur, "B_mass", params)))
+        + ("%r - row_number() OVER w AS c, " %
+                float(get_parameter(cur, "card_%s" % B_rm, params)))
+        + "count(*) OVER () AS rm_card, sum(mass) OVER () AS rm_mass "
+        + ("FROM %s WHERE %s " % (B_rm, condition))
+        + "WINDOW w AS (ORDER BY mass, value ROWS UNBOUNDED PRECEDING)")
+    cur.execute(("SELECT i, %s AS density, rm_card, rm_mass " %
+                    density_sql(cur, N, n_rm, dmeasure, params))
+        + ("FROM (%s) AS traj ORDER BY density DESC, i LIMIT 1;" % traj))
+    (best_i, best_dens, rm_card, rm_mass) = cur.fetchone()
+
+    ## remove these values from B_rm
+    if mark:
+        cur.execute("UPDATE %s SET exists=0 WHERE %s;" % (B_rm, condition))
+    else:
+        cur.execute("DELETE FROM %s WHERE %s;" % (B_rm, condition))
+
+    return (rm_card, rm_mass, curr_order + best_i, best_dens)
+
+
+def density_sql(cur, N, n_rm, dmeasure, params=None):
+    """
+    SQL expression of the density after removing values from B_{n_rm}, in terms of
+    the remaining mass "b" of B and the remaining cardinality "c" of B_{n_rm}.
+    Args:
+        cur: cursor of database connection
+        N: number of total dimensions
+        n_rm: the dimension to remove
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        params: client-side parameters; if None, use the relation "parameters"
+    """
+    others = [n for n in range(N) if n != n_rm]
+    if dmeasure == "arithmetic":
+        ## sum of the other cardinalities
+        total = float(sum(get_parameter(cur, ("card_B%d" % n), params) for n in others))
+        return ("(CASE WHEN %r + c <= 0 THEN -1 ELSE b / ((%r + c) / %d.0) END)" %
+                    (total, total, N))
+
+    elif dmeasure == "geometric":
+        ## product of the other cardinalities
+        product = 1.0
+        for n in others:
+            product *= get_parameter(cur, ("card_B%d" % n), params)
+        return ("(CASE WHEN %r * c <= 0 THEN -1 ELSE b / power(%r * c, 1.0/%d) END)" %
+                    (product, product, N))
+
+    elif dmeasure == "suspicious":
+        ## \prod_n |B_n|/|R_n| is (product * c)
+        product = 1.0 / get_parameter(cur, ("card_R%d" % n_rm), params)
+        for n in others:
+            product *= (get_parameter(cur, ("card_B%d" % n), params) /
+                        float(get_parameter(cur, ("card_R%d" % n), params)))
+        R_mass = float(get_parameter(cur, "total_mass", params))
+        return (("(CASE WHEN %r * c <= 0 or b <= 0 or %r <= 0 THEN -1 " % (product, R_mass))
+            + ("ELSE b * (ln(b / %r) - 1) + %r * %r * c - b * ln(%r * c) END)" %
+                (R_mass, R_mass, product, product)))
+
+
+def aggregate_Btable(col_names, X_name, cur, dims, storage="logged"):
+    """
+    Compute the mass of each value in the given dimensions with a single scan of Btable,
+    using GROUP BY GROUPING SETS, instead of one GROUP BY query per dimension.
+    The result is stored in the relation "Bagg" (dimension, value, mass), 
+    which should be dropped by the caller.
+    Args:
+        col_names: list of column names, with length N
+        X_name: column name of the measure attribute
+        cur: cursor for database connection
+        dims: list of dimensions to aggregate
+        storage: "logged", "unlogged" or "temp", the kind of the working relations
+    """
+    ## GROUPING(col)=0 iff the row is grouped by col
+    dimension = " ".join([("WHEN GROUPING(%s)=0 THEN %d" % (col_names[n], n)) for n in dims])
+    value = " ".join([("WHEN GROUPING(%s)=0 THEN %s" % (col_names[n], col_names[n])) 
+                        for n in dims])
+    sets = ",".join([("(%s)" % col_names[n]) for n in dims])
+    cur.execute((create_table(storage) + " Bagg AS SELECT CASE %s END as dimension, " % dimension)
+        + ("CASE %s END as value, sum(%s)::double precision as mass " % (value, X_name))
+        + ("FROM Btable GROUP BY GROUPING SETS (%s);" % sets))
+
+
+def set_block(cur, k):
+    """
+    Record the following statements for the k-th block, if cur records a trace
+    (see TracingCursor in dcube_trace.py).
+    Args:
+        cur: cursor of database connection
+        k: the block; None outside of the blocks
+    """
+    if hasattr(cur, "set_block"):
+        cur.set_block(k)
+
+
+def set_phase(cur, phase, npass=None):
+    """
+    Record the following statements for a phase of the current block, if cur records
+    a trace (see TracingCursor in dcube_trace.py).
+    Args:
+        cur: cursor of database connection
+        phase: name of the phase
+        npass: the pass of find_single_block, if the phase is repeated in each pass
+    """
+    if hasattr(cur, "set_phase"):
+        cur.set_phase(phase, npass)
+
+
+class DenseBlock(object):
+    """
+    A dense block found by D-Cube.
+    Attributes:
+        k: the block is the (k+1)-th one found
+        values: N sets, the values of the block in each dimension
+        cardinalities: the number of values of the block in each dimension
+        mass: the total mass of the entries of the block
+        density: the density of the block, in the density measure of the run
+    """
+
+    def __init__(self, k, values, mass, density, cur, columns):
+        self.k = k
+        self.values = values
+        self.cardinalities = [len(v) for v in values]
+        self.mass = mass
+        self.density = density
+        self._cur = cur
+        self._columns = columns
+
+    def tuples(self, itersize=2000):
+        """
+        Iterate over the entries of the block, each of them a tuple of the N values
+        and the mass, through a server-side cursor which fetches itersize rows at a time.
+        The entries are only available until the next block is requested.
+        """
+        named = self._cur.connection.cursor("dcube_block%d" % self.k)
+        named.itersize = itersize
+        named.execute("SELECT %s FROM block%d;" % (self._columns, self.k))
+        for row in named:
+            yield row
+        named.close()
+
+    def __repr__(self):
+        return ("DenseBlock(k=%d, cardinalities=%s, mass=%r, density=%r)" %
+                (self.k, self.cardinalities, self.mass, self.density))
+
+
+def fetch_dense_block(k, col_names, X_name, N, cur, dmeasure, params=None,
+                    encode_values=False):
+    """
+    Describe the k-th block, while the relations block<k> and final_B<n> hold it.
+    Its density is computed from the mass and the cardinalities of the block, with the
+    cardinalities and total mass of the relation in which it was found.
+    Args:
+        k: the block
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        N: number of dimension
+        cur: cursor of database connection
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        params: client-side parameters; if None, use the relation "parameters"
+        encode_values: whether final_Bn stores int4 codes, which are decoded with Rn
+    Returns:
+        a DenseBlock
+    """
+    values = []
+    for n in range(N):
+        if encode_values:
+            cur.execute(("SELECT L.label FROM final_B%d as B, R%d as L " % (n, n))
+                + "WHERE B.value=L.value;")
+        else:
+            cur.execute("SELECT value FROM final_B%d;" % n)
+        values.append(set([row[0] for row in cur.fetchall()]))
+    cur.execute("SELECT coalesce(sum(%s), 0)::double precision FROM block%d;" % (X_name, k))
+    mass = cur.fetchone()[0]
+
+    ## the density measures read the parameters of the block from params
+    block_params = dict(params) if params is not None else fetch_parameters(cur)
+    block_params["B_mass"] = mass
+    for n in range(N):
+        block_params["card_B%d" % n] = len(values[n])
+    (density, avg_card) = compute_density(cur, N, dmeasure, block_params)
+    return DenseBlock(k, values, mass, density, cur, ",".join(col_names + [X_name]))
+
+
+def save_block_summary(k, N, cur, outdir, out_prefix, dmeasure, total_mass, B_card, B_mass,
+                    params=None, encode_values=False):
+    """
+    Save the values of the k-th block in each dimension, from final_Bn, to
+    <out_prefix>_block<k+1>_values.csv, and its number of entries, mass, density and
+    cardinalities to a line of <out_prefix>_summary.csv, without building the block.
+    Args:
+        k: the current block
+        N: number of dimension
+        cur: cursor of database connection
+        outdir: output directory
+        out_prefix: prefix of the output results
+        dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        total_mass: the total mass of the relation in which the block was found
+        B_card: number of entries of the block, in that relation
+        B_mass: mass of the block, in that relation
+        params: client-side parameters; if None, use the relation "parameters"
+        encode_values: whether final_Bn stores int4 codes, which are decoded with Rn
+    """
+    block_params = {"total_mass": total_mass, "B_mass": B_mass}
+    cards = []
+    values_file = outdir+"/"+out_prefix+"_block"+str(k+1)+"_values.csv"
+    with open(values_file, mode="wt") as fout:
+        writer = csv.writer(fout)
+        for n in range(N):
+            if encode_values:
+                cur.execute(("SELECT L.label FROM final_B%d as B, R%d as L " % (n, n))
+                    + "WHERE B.value=L.value;")
+            else:
+                cur.execute("SELECT value FROM final_B%d;" % n)
+            values = cur.fetchall()
+            writer.writerows([(n, value) for (value,) in values])
+            cards.append(len(values))
+            block_params["card_B%d" % n] = len(values)
+            block_params["card_R%d" % n] = get_parameter(cur, "card_R%d" % n, params)
+    (density, avg_card) = compute_density(cur, N, dmeasure, block_params)
+
+    summary_file = outdir+"/"+out_prefix+"_summary.csv"
+    rows = [["block", "entries", "mass", "density"] + ["card_%d" % n for n in range(N)]]
+    if k > 0:
+        ## the lines of the previous blocks; a run resumed from a checkpoint may have
+        ## written the lines of the next ones already
+        with open(summary_file, mode="rt") as fin:
+            rows = [row for row in csv.reader(fin) if row[0] == "block" or int(row[0]) <= k]
+    with open(summary_file, mode="wt") as fout:
+        writer = csv.writer(fout)
+        writer.writerows(rows)
+        writer.writerow([k+1, B_card, repr(B_mass), repr(density)] + cards)
+    print ("\tThe %d-th block is summarized in files '%s' and '%s'." % 
+            (k+1, values_file, summary_file))
+
+
+## session settings of the tuning profiles, applied when connecting to the database;
+## the working relations are throwaway state, so commits need not wait for the WAL flush
+TUNING_PROFILES = {
+    "none": [],
+    "fast": [("work_mem", "256MB"), ("maintenance_work_mem", "1GB"),
+             ("temp_buffers", "256MB"), ("synchronous_commit", "off")],
+}
+
+
+def set_tuning_profile(cur, profile="none"):
+    """
+    Apply the session settings of a tuning profile.
+    This should be done right after connecting, since temp_buffers cannot be changed
+    once a temporary table has been used in the session.
+    Args:
+        cur: cursor of database connection
+        profile: "none" or "fast", a key of TUNING_PROFILES
+    """
+    if profile not in TUNING_PROFILES:
+        raise ValueError("profile must be one of %s." % 
+                    " or ".join(["'%s'" % p for p in sorted(TUNING_PROFILES)]))
+    for (setting, value) in TUNING_PROFILES[profile]:
+        cur.execute("SET %s = '%s';" % (setting, value))
+
+
+def database_dsn(dbname, user, port, schema=None):
+    """
+    Get the DSN of a connection to the local database. If schema is given, the
+    sessions create and find their relations in it (it is their search_path), so that
+    runs in different schemas do not share any relation.
+    Args:
+        dbname: an existing database name
+        user: user
+        port: port number
+        schema: name of the schema of the run; default is the search_path of the server
+    """
+    DSN = "dbname=%s user=%s port=%s host='/tmp/'" % (dbname, user, port)
+    if schema is not None:
+        DSN += " options='-c search_path=%s'" % schema
+    return DSN
+
+
+def reset_schema(cur, schema=None, keep=False):
+    """
+    Create the schema of a run and make it the search_path of the session, after
+    dropping it with all its relations unless keep.
+    Args:
+        cur: cursor of database connection
+        schema: name of the schema; default is "public"
+        keep: whether to keep the relations of a previous run in the schema
+    """
+    if schema is None:
+        schema = "public"
+    else:
+        cur.execute("SET search_path TO %s;" % schema)
+    if not keep:
+        cur.execute("DROP SCHEMA IF EXISTS %s CASCADE;" % schema)
+    cur.execute("CREATE SCHEMA IF NOT EXISTS %s;" % schema)
+
+
+def create_table(storage="logged"):
+    """
+    Get the command to create a working relation. The working relations are all dropped 
+    in the end, so they do not need to be written to the write-ahead log.
+    Args:
+        storage: "logged" for regular tables, "unlogged" for unlogged tables, 
+                or "temp" for temporary tables
+    """
+    if storage == "logged":
+        return "CREATE TABLE"
+    elif storage == "unlogged":
+        return "CREATE UNLOGGED TABLE"
+    elif storage == "temp":
+        return "CREATE TEMP TABLE"
+    else:
+        raise ValueError("storage must be one of 'logged', 'unlogged' or 'temp'.")
+
+
+def remove_from_Btable(cur, X_name, condition, delta_Bmass=False):
+    """
+    "Remove" the entries satisfying the condition from Btable.
+    Args:
+        cur: cursor of database connection
+        X_name: column name of the measure attribute
+        condition: SQL condition on the entries of Btable
+        delta_Bmass: if True, the entries are moved from Btable into the relation "Bdelta",
+                which is later used by update_Bmass_delta; otherwise their mass is set to 0
+    """
+    if delta_Bmass:
+        cur.execute(("WITH removed AS (DELETE FROM Btable WHERE %s RETURNING *) " % condition)
+            + "INSERT INTO Bdelta SELECT * FROM removed;")
+    else:
+        cur.execute("UPDATE Btable SET %s=0 WHERE %s;" % (X_name, condition))
+
+
+def update_Bmass_delta(col_names, X_name, N, cur, n_rm, mark=False, params=None):
+    """
+    After moving some entries from Btable into the relation "Bdelta",
+    subtract their mass from each Bn=a, instead of re-computing the mass from Btable.
+    The values are kept in Bn even if their mass drops to 0, as in the full re-computation.
+    Args:
+        col_names: list of column names, with length N
+        X_name: column name of the measure attribute
+        N: number of dimensions
+        cur: cursor for database connection
+        n_rm: the current dimension that the algorithm is removing;
+              this Bn does not need to be updated.
+        mark: whether the Bn tables use the "exists" column of the mark implementation
+        params: client-side parameters; if None, use the relation "parameters"
+    """
+    cols = "value, exists, mass" if mark else "value, mass"
+    for n in range(N):
+        if n != n_rm:
+            cur.execute(("UPDATE B%d SET mass=B%d.mass-D.mass " % (n, n))
+                + ("FROM (SELECT %s as value, sum(%s) as mass FROM Bdelta GROUP BY %s) as D " %
+                    (col_names[n], X_name, col_names[n]))
+                + ("WHERE B%d.value=D.value;" % n))
+            ## the cumulative columns, in the new order of mass
+            cur.execute(("UPDATE B%d SET cum_mass=C.cum_mass, cum_card=C.cum_card " % n)
+                + ("FROM (%s) as C WHERE B%d.value=C.value;" %
+                    (cumulative_Bn("SELECT %s FROM B%d" % (cols, n), mark), n)))
+            reset_Bn_prefix(cur, n, params)
+    cur.execute("DELETE FROM Bdelta;")
+
+
 def compute_card(cur, table_name):
     """
     Compute the cardinality of a table.
@@ -164,39 +797,72 @@ def compute_card(cur, table_name):
     return cur.fetchone()[0]
 
 
-def get_parameter(cur, par):
+def get_parameter(cur, par, params=None):
     """
     Extrat the global parameter from the table "parameters".
     Args:
         cur: cursor of database connection
         par: parameter name. Possible values include 'total_mass', 'B_mass', 'card_Bn'
+        params: client-side parameters; if given, they are used instead of the table
     """
+    if params is not None:
+        return params[par]
     cur.execute("SELECT value FROM parameters WHERE par='%s';" % par)
     return cur.fetchone()[0]
 
 
-def update_parameter(cur, par, new_value):
+def update_parameter(cur, par, new_value, params=None):
     """
     Update the global parameter in the table "parameters".
     Args:
         cur: cursor of database connection
         par: parameter name. Possible values include 'total_mass', 'B_mass', 'card_Bn'
         new_value: new value, a double
+        params: client-side parameters; if given, they are updated instead of the table
     """
+    if params is not None:
+        params[par] = new_value
+        return
     cur.execute("UPDATE parameters SET value=%f WHERE par='%s';" % 
                     (new_value, par))
 
 
-def has_remained_B(N, cur):
+def fetch_parameters(cur):
+    """
+    Read all the global parameters in the table "parameters" into a dict,
+    which can then be kept in memory as the client-side parameters.
+    Args:
+        cur: cursor of database connection
+    """
+    cur.execute("SELECT par, value FROM parameters;")
+    return dict(cur.fetchall())
+
+
+def sync_parameters(cur, params):
+    """
+    Write the client-side parameters back to the table "parameters".
+    This is only needed for debugging, or for a checkpoint, since the engines never
+    read the table once they have started.
+    Args:
+        cur: cursor of database connection
+        params: client-side parameters
+    """
+    for par in sorted(params):
+        if params[par] is not None:
+            update_parameter(cur, par, params[par])
+
+
+def has_remained_B(N, cur, params=None):
     """
     Check whether all B_1, ..., B_N are empty. Return True if some are non-empty.
     Args:
         N: number of dimensions
         cur: cursor for database connection
+        params: client-side parameters; if None, use the relation "parameters"
     """
     for n in range(N):
         ## cardinality of B_n
-        card = get_parameter(cur, par=("card_B%d" % n))
+        card = get_parameter(cur, ("card_B%d" % n), params)
         if card > 0:
             return True
     return False
@@ -217,61 +883,53 @@ def compute_card_mark(cur, table_name):
     return cur.fetchone()[0]
     
 
-def select_dimension_mark(cur, N, policy, dmeasure):
+def select_dimension_mark(cur, N, policy, dmeasure, params=None):
     """
     Args:
         cur: cursor of database connection
         N: number of total dimensions
         policy: "cardinality" or "density"
+        params: client-side parameters; if None, use the relation "parameters"
     """
     if policy == "cardinality":
-        return select_dim_by_card(cur, N)
+        return select_dim_by_card(cur, N, params)
     elif policy == "density":
-        return select_dim_by_dens_mark(cur, N, dmeasure)
+        return select_dim_by_dens_mark(cur, N, dmeasure, params)
     else:
         raise ValueError("policy must be one of 'cardinality' or 'density'.")
 
 
-def select_dim_by_dens_mark(cur, N, dmeasure):
+def select_dim_by_dens_mark(cur, N, dmeasure, params=None):
     """
     Select the next dimension to remove by density.
     Args:
         cur: cursor of database connection
         N: number of total dimensions
         dmeasure: "arithmetic" or "geometric" or "suspicious", density measure
+        params: client-side parameters; if None, use the relation "parameters"
     """
     max_dens, max_dim = -10, 0 ## note: by construction density is always >= -1
-    B_mass = get_parameter(cur, par="B_mass")
+    if params is None:
+        params = fetch_parameters(cur)
+    B_mass = get_parameter(cur, "B_mass", params)
+
+    ## the mass and number of the values with mass <= average in each Bn
+    cards = [get_parameter(cur, ("card_B%d" % n), params) for n in range(N)]
+    removed = select_Bn_prefix(cur, [(n, B_mass/float(cards[n])) for n in range(N)
+                                    if cards[n] > 0], params)
 
     for n in range(N):
-        card = get_parameter(cur, par=("card_B%d" % n))
+        card = cards[n]
         if card > 0:
             ## what will the density be if we remove all values with mass <= average
-            avg_mass = B_mass/float(card)
-            cur.execute("SELECT sum(mass), count(*) FROM B%d WHERE mass <= %f and exists=1;" 
-                        % (n, avg_mass))
-            (rm_mass, rm_card) = cur.fetchone()
-
-            update_parameter(cur, ("card_B%d" % n), card - rm_card)
-            cur.execute("UPDATE parameters SET value=value-%f WHERE par='B_mass';" % rm_mass)
-            density = compute_density(cur, N, dmeasure)
+            (rm_mass, rm_card) = removed[n]
+
+            ## evaluate it on a copy of the parameters
+            trial = dict(params)
+            trial["card_B%d" % n] = card - rm_card
+            trial["B_mass"] = B_mass - rm_mass
+            density = compute_density(cur, N, dmeasure, trial)
             if density > max_dens:
                 max_dim, max_dens = n, density
 
-            ## need to change the parameters back
-            update_parameter(cur, ("card_B%d" % n), card)
-            update_parameter(cur, "B_mass", B_mass)
-
     return max_dim
-
-
-def get_next_Brow_mark(Bn, cur):
-    """
-    Get the next row in table Bn with the smallest mass.
-    Args:
-        Bn: table name, one of B0 ... B(N-1)
-        cur: cursor for database connection
-    """
-    cur.execute("SELECT value, mass FROM %s WHERE exists=1 LIMIT 1;" % Bn)
-    return cur.fetchone()
-
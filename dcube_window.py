@@ -0,0 +1,173 @@
+#################################################
+## Sliding windows over the time dimension for D-CUBE
+##
+## The window relation holds the entries whose time lies in the current window.
+## When the window slides, only the entries which leave and enter it are read,
+## and the distinct values of each dimension (with the number of entries and the mass
+## of each) and the total mass of the window are updated from them, so that D-Cube can
+## read them instead of computing them (see persistent in dcube()).
+##
+## Dependency: Psycopg2 (Access PostgreSQL with Python)
+#################################################
+
+import psycopg2
+from dcube_utils import create_table, set_phase
+
+
+def time_expression(col, time_type="number"):
+    """
+    The SQL expression of the time of an entry, as a number.
+    Args:
+        col: the column of the time dimension
+        time_type: "number" if the values are numbers, or "timestamp" if they are
+                timestamps, which are then measured in seconds
+    """
+    if time_type == "number":
+        return "(%s)::double precision" % col
+    elif time_type == "timestamp":
+        return "extract(epoch from (%s)::timestamp)::double precision" % col
+    else:
+        raise ValueError("time_type must be one of 'number' or 'timestamp'.")
+
+
+def iter_windows(data_table, col_names, X_name, cur, time_dim, size, slide,
+                time_type="number", storage="logged"):
+    """
+    Slide a window over the time dimension of data_table. For each window that is not
+    empty, the relation <name>_win holds its entries, <name>_win_R<n> the distinct
+    values of each dimension and their mass, and <name>_win_stats its total mass,
+    and (i, window_table) is yielded, where <name> is data_table without its schema,
+    so that the relations are created in the schema of the run.
+    The relations are dropped in the end, or if the generator is closed early.
+    Args:
+        data_table: name of the data relation
+        col_names: column names of the relation for the N dimensions
+        X_name: column name of the measure attribute
+        cur: cursor of database connection
+        time_dim: the index of the time dimension in col_names
+        size: length of each window, in the unit of the time
+        slide: distance between the starts of consecutive windows
+        time_type: "number" or "timestamp", how the values of the time are read
+        storage: "logged", "unlogged" or "temp", the kind of the window relations
+    """
+    N = len(col_names)
+    cols = ",".join(col_names)
+    time_col = col_names[time_dim]
+    (source, win, delta) = window_tables(data_table)
+
+    ## the time of each entry is read once, and indexed to find the entries of a range
+    set_phase(cur, "init_window")
+    cur.execute(create_table(storage) + " %s AS SELECT %s, %s, %s as t FROM %s;" %
+                (source, cols, X_name, time_expression(time_col, time_type), data_table))
+    cur.execute("CREATE INDEX ON %s (t);" % source)
+    cur.execute("SELECT min(t), max(t) FROM %s;" % source)
+    (t_min, t_max) = cur.fetchone()
+
+    cur.execute(create_table(storage) + " %s AS SELECT %s, %s FROM %s LIMIT 0;" %
+                (win, cols, X_name, data_table))
+    cur.execute("CREATE INDEX ON %s (%s);" % (win, time_col))
+    cur.execute(create_table(storage) + " %s (LIKE %s, sign int);" % (delta, win))
+    for n in range(N):
+        cur.execute(create_table(storage) + 
+                    " %s_R%d (value varchar PRIMARY KEY, n bigint, mass double precision);" %
+                    (win, n))
+    cur.execute(create_table(storage) +
+                " %s_stats (par varchar(40) PRIMARY KEY, value double precision);" % win)
+    cur.execute("INSERT INTO %s_stats VALUES ('total_mass', 0), ('entries', 0);" % win)
+
+    i, prev_start, start, end = 0, t_min, t_min, t_min
+    while t_min is not None and start <= t_max:
+        ## the entries leaving [prev_start, prev_end) and entering [start, start+size)
+        prev_end, end = end, start + size
+        set_phase(cur, "slide_window")
+        cur.execute(("INSERT INTO %s SELECT %s, %s, -1 FROM %s " % (delta, cols, X_name, source))
+            + ("WHERE t >= %r and t < %r;" % (float(prev_start), float(min(start, prev_end)))))
+        cur.execute(("INSERT INTO %s SELECT %s, %s, 1 FROM %s " % (delta, cols, X_name, source))
+            + ("WHERE t >= %r and t < %r;" % (float(max(start, prev_end)), float(end))))
+        (n_left, n_entered) = update_window(win, delta, col_names, X_name, time_col, cur)
+
+        cur.execute("SELECT value FROM %s_stats WHERE par='entries';" % win)
+        n_entries = int(cur.fetchone()[0])
+        print ("Window %d: [%r, %r) has %d entries (%d entered, %d left)." %
+                (i+1, start, end, n_entries, n_entered, n_left))
+        if n_entries > 0:
+            try:
+                yield (i, win)
+            except GeneratorExit:
+                drop_window(data_table, N, cur)
+                raise
+        ## the start is computed from t_min, so that the error does not accumulate
+        i, prev_start = i + 1, start
+        start = t_min + i * slide
+    drop_window(data_table, N, cur)
+
+
+def window_tables(data_table):
+    """
+    The names of the relations of the window over data_table, without its schema.
+    Args:
+        data_table: name of the data relation, possibly qualified by its schema
+    Returns:
+        (source, win, delta), the entries with their time, the window relation, and
+        the entries leaving and entering it
+    """
+    name = data_table.split(".")[-1]
+    return (name + "_timed", name + "_win", name + "_windelta")
+
+
+def drop_window(data_table, N, cur):
+    """
+    Drop the relations of the window over data_table.
+    Args:
+        data_table: name of the data relation
+        N: number of dimension
+        cur: cursor of database connection
+    """
+    (source, win, delta) = window_tables(data_table)
+    set_phase(cur, "clean_up")
+    for n in range(N):
+        cur.execute("DROP TABLE %s_R%d;" % (win, n))
+    for table in [win + "_stats", delta, win, source]:
+        cur.execute("DROP TABLE %s;" % table)
+
+
+def update_window(win, delta, col_names, X_name, time_col, cur):
+    """
+    Apply the entries leaving (sign -1) and entering (sign 1) the window, which are
+    in the relation delta, to the window relation and its distinct values and mass.
+    delta is emptied.
+    Args:
+        win: the window relation
+        delta: the relation with the leaving and entering entries and their sign
+        col_names: column names of the relations for the N dimensions
+        X_name: column name of the measure attribute
+        time_col: the column of the time dimension
+        cur: cursor of database connection
+    Returns:
+        (n_left, n_entered), the numbers of entries which left and entered the window
+    """
+    N = len(col_names)
+    cols = ",".join(col_names)
+    ## the whole time values leave the window, so they identify the leaving entries
+    cur.execute(("DELETE FROM %s WHERE %s IN " % (win, time_col))
+        + ("(SELECT DISTINCT %s FROM %s WHERE sign < 0);" % (time_col, delta)))
+    n_left = cur.rowcount
+    cur.execute("INSERT INTO %s (%s, %s) SELECT %s, %s FROM %s WHERE sign > 0;" %
+                (win, cols, X_name, cols, X_name, delta))
+    n_entered = cur.rowcount
+
+    ## the number of entries and the mass of each value; values without entries are removed
+    for n in range(N):
+        cur.execute(("INSERT INTO %s_R%d as T SELECT %s, sum(sign), sum(sign*%s) FROM %s " %
+                        (win, n, col_names[n], X_name, delta))
+            + ("GROUP BY %s ON CONFLICT (value) " % col_names[n])
+            + "DO UPDATE SET n=T.n+EXCLUDED.n, mass=T.mass+EXCLUDED.mass;")
+        cur.execute(("DELETE FROM %s_R%d WHERE n=0 and value IN " % (win, n))
+            + ("(SELECT %s FROM %s);" % (col_names[n], delta)))
+    cur.execute(("UPDATE %s_stats SET value=value+" % win)
+        + ("(SELECT coalesce(sum(sign*%s), 0) FROM %s) WHERE par='total_mass';" %
+            (X_name, delta)))
+    cur.execute(("UPDATE %s_stats SET value=value+%d " % (win, n_entered - n_left))
+        + "WHERE par='entries';")
+    cur.execute("DELETE FROM %s;" % delta)
+    return (n_left, n_entered)
@@ -0,0 +1,666 @@
+#################################################
+## Tests of D-CUBE
+##
+## The tests of the in-memory parts (the 'numpy' implementation, the density updates,
+## the loaders, the trace and the job runner) do not need a database. The tests of
+## EngineTest compare the blocks of the SQL implementations and of their options on
+## the same tensors; they are skipped if the database cannot be connected to.
+##
+## Usage:
+## $ python -m unittest -v test_dcube
+## The database of EngineTest is given by the environment variables DBNAME, USERNAME
+## and PORT, as in the makefile; by default $USER, $USER and 5432.
+#################################################
+
+import csv, glob, gzip, json, os, random, shutil, struct, sys, tempfile, unittest
+import psycopg2
+from dcube import dcube_custom, iter_dense_blocks
+from dcube_catalog import CATALOG_SCHEMA, file_hash, find_tensor, drop_tensor
+from dcube_jobs import make_jobs
+from dcube_loader import (split_file, parse_chunk, parse_data, encode_tensor_file,
+                        read_tensor_arrays, LineReader, load_tensor_file)
+from dcube_trace import statement_shape
+from dcube_window import iter_windows
+from dcube_utils import (compute_density, init_density, update_density, database_dsn,
+                        reset_schema)
+
+DEMO_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo", "demo_data.csv")
+DEMO_BLOCK = os.path.join(os.path.dirname(DEMO_DATA), "demo_out", "demo_data_block1.csv")
+COL_NAMES = ["D0", "D1", "D2"]
+
+
+def read_rows(file_name):
+    """
+    The sorted rows of a .csv block file.
+    """
+    with open(file_name, mode="rt") as fin:
+        return sorted([tuple(row) for row in csv.reader(fin)])
+
+
+class Interrupted(Exception):
+    """
+    Raised to interrupt a run after a checkpoint.
+    """
+
+
+def sum_entries(rows):
+    """
+    The mass of each entry of the rows of a block, summed over the rows of the same
+    entry, as append_tensor merges them.
+    """
+    masses = {}
+    for row in rows:
+        masses[row[:-1]] = masses.get(row[:-1], 0) + float(row[-1])
+    return masses
+
+
+def read_block(file_name):
+    """
+    The sorted rows of a block file in any of the output formats, with the mass as a
+    float.
+    """
+    if file_name.endswith(".npz"):
+        import numpy as np
+        arrays = np.load(file_name)
+        columns = [arrays[name + "_values"][arrays[name]] for name in COL_NAMES]
+        rows = zip(*(columns + [arrays["measure"]]))
+    elif file_name.endswith(".bin"):
+        ## the header of the binary COPY format, then int16 field counts, and int32
+        ## lengths before the fields, until the count -1
+        with open(file_name, mode="rb") as fin:
+            data = fin.read()
+        pos = 19 + struct.unpack(">i", data[15:19])[0]
+        rows = []
+        while struct.unpack(">h", data[pos:pos+2])[0] != -1:
+            (count, pos, fields) = (struct.unpack(">h", data[pos:pos+2])[0], pos + 2, [])
+            for i in range(count):
+                length = struct.unpack(">i", data[pos:pos+4])[0]
+                fields.append(data[pos+4:pos+4+length])
+                pos += 4 + length
+            rows.append(fields[:-1] + [struct.unpack(">d", fields[-1])[0]])
+    else:
+        if file_name.endswith(".gz"):
+            fin = gzip.open(file_name, mode="rb")
+        elif file_name.endswith(".zst"):
+            import zstandard
+            fin = zstandard.ZstdDecompressor().stream_reader(open(file_name, mode="rb"))
+        else:
+            fin = open(file_name, mode="rb")
+        try:
+            rows = list(csv.reader(fin.read().splitlines()))
+        finally:
+            fin.close()
+    return sorted([tuple(str(value) for value in row[:-1]) + (float(row[-1]),)
+                    for row in rows])
+
+
+class DensityTest(unittest.TestCase):
+    """
+    update_density against compute_density, after each removed value.
+    """
+
+    def check_updates(self, dmeasure):
+        N = 3
+        params = {"B_mass": 15.0, "total_mass": 40.0}
+        for (n, (card_B, card_R)) in enumerate([(5, 10), (4, 8), (3, 6)]):
+            params["card_B%d" % n] = card_B
+            params["card_R%d" % n] = card_R
+        (density, avg_card) = init_density(None, N, dmeasure, params)
+        self.assertEqual(density, compute_density(None, N, dmeasure, params)[0])
+
+        ## remove all but one value of B0, in increasing order of mass
+        (card, B_mass) = (params["card_B0"], params["B_mass"])
+        for curr_mass in [1.0, 2.0, 3.0, 4.0]:
+            (density, card, B_mass, avg_card) = update_density(density, N, dmeasure,
+                                            B_mass, card, curr_mass, avg_card, 40.0)
+            params["card_B0"], params["B_mass"] = card, B_mass
+            expected = compute_density(None, N, dmeasure, params)[0]
+            self.assertAlmostEqual(density, expected, delta=1e-9 * max(1, abs(expected)))
+
+    def test_arithmetic(self):
+        self.check_updates("arithmetic")
+
+    def test_geometric(self):
+        self.check_updates("geometric")
+
+    def test_suspicious(self):
+        self.check_updates("suspicious")
+
+
+class NumpyTest(unittest.TestCase):
+    """
+    The 'numpy' implementation on a pre-encoded tensor, without the database.
+    """
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def test_demo(self):
+        ## NumPy is only needed for this implementation
+        from dcube_numpy import dcube_numpy
+        arrays = os.path.join(self.outdir, "demo_data")
+        encode_tensor_file(DEMO_DATA, arrays, COL_NAMES, "measure")
+        tensor = read_tensor_arrays(arrays, COL_NAMES, "measure")
+        dcube_numpy(None, COL_NAMES, "measure", 1, 3, None, "arithmetic", "density",
+                    self.outdir, "demo_data", False, tensor=tensor)
+        self.assertEqual(read_rows(os.path.join(self.outdir, "demo_data_block1.csv")),
+                        read_rows(DEMO_BLOCK))
+
+
+class LoaderTest(unittest.TestCase):
+    """
+    Parsing of the input files by the "parallel" loader, their content hash, and the
+    strings streamed into COPY.
+    """
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def write(self, name, data):
+        file_name = os.path.join(self.outdir, name)
+        with open(file_name, mode="wb") as fout:
+            fout.write(data)
+        return file_name
+
+    def test_parse_data(self):
+        parts = parse_data(("a,x,1\nb,y,2.5\na,x,3\n\n", ",", 2, False, 1))
+        self.assertEqual(parts, [{("a", "x"): 4.0, ("b", "y"): 2.5}])
+        parts = parse_data(("a,x\nb,y\na,x\n", ",", 2, True, 3))
+        self.assertEqual(len(parts), 3)
+        merged = {}
+        for part in parts:
+            merged.update(part)
+        self.assertEqual(merged, {("a", "x"): 2, ("b", "y"): 1})
+        self.assertRaises(ValueError, parse_data, ("a,x,y,1\n", ",", 2, False, 1))
+
+    def test_split_file(self):
+        file_name = self.write("t.csv", "a,x,1\nbb,yy,2\nc,z,3\n")
+        self.assertEqual(split_file(file_name, 8), [(0, 8), (8, 16), (16, 20)])
+        ## each line is parsed in the range in which it starts, whatever the chunk size
+        for chunk_size in [1, 3, 6, 7, 100]:
+            merged = {}
+            for (start, end) in split_file(file_name, chunk_size):
+                for (entry, mass) in parse_chunk((file_name, start, end, ",", 2, False,
+                                                1))[0].iteritems():
+                    self.assertNotIn(entry, merged)
+                    merged[entry] = mass
+            self.assertEqual(merged, {("a", "x"): 1.0, ("bb", "yy"): 2.0, ("c", "z"): 3.0})
+
+    def test_file_hash(self):
+        file_name = self.write("t.csv", "a,x,1\n")
+        same = self.write("u.csv", "a,x,1\n")
+        changed = self.write("v.csv", "a,x,2\n")
+        self.assertEqual(file_hash(file_name), file_hash(same))
+        self.assertNotEqual(file_hash(file_name), file_hash(changed))
+        self.assertEqual(file_hash(file_name), file_hash(file_name, block_size=2))
+
+        ## a directory is hashed with the names of its files
+        os.mkdir(os.path.join(self.outdir, "d"))
+        self.write("d/D0.npy", "a")
+        digest = file_hash(os.path.join(self.outdir, "d"))
+        os.rename(os.path.join(self.outdir, "d", "D0.npy"),
+                os.path.join(self.outdir, "d", "D1.npy"))
+        self.assertNotEqual(file_hash(os.path.join(self.outdir, "d")), digest)
+
+    def test_line_reader(self):
+        reader = LineReader(["a,x,1\n", "bb,yy,2\n", "c,z,3\n"])
+        self.assertEqual(reader.read(3), "a,x")
+        self.assertEqual(reader.readline(), ",1\n")
+        self.assertEqual(reader.readline(), "bb,yy,2\n")
+        self.assertEqual(reader.read(), "c,z,3\n")
+        self.assertEqual(reader.read(), "")
+        self.assertEqual(reader.readline(), "")
+
+
+class ToolsTest(unittest.TestCase):
+    """
+    The statement shapes of the trace, and the jobs of the runner.
+    """
+
+    def test_statement_shape(self):
+        self.assertEqual(statement_shape("SELECT value FROM B0\n  WHERE mass <= 1.5e-3 "
+                                        + "and value='a''b' LIMIT 10;"),
+                        "SELECT value FROM B0 WHERE mass <= ? and value=? LIMIT ?;")
+
+    def test_make_jobs(self):
+        jobs = make_jobs(["in/t.csv", "darpa:in/darpa.csv"], 3, [1, 2],
+                        ["arithmetic", "suspicious"], ["density"], ["copy"])
+        self.assertEqual(sorted([job["name"] for job in jobs]),
+                        ["darpa_K1_arithmetic_density_copy",
+                        "darpa_K2_arithmetic_density_copy",
+                        "t_K1_arithmetic_density_copy", "t_K1_suspicious_density_copy",
+                        "t_K2_arithmetic_density_copy", "t_K2_suspicious_density_copy"])
+        darpa = [job for job in jobs if job["data"] == "darpa"][0]
+        self.assertEqual((darpa["file_name"], darpa["N"]), ("in/darpa.csv", 3))
+        ## the inputs with the same name would write to the same directory
+        self.assertRaises(ValueError, make_jobs, ["a/t.csv", "b/t.csv"], 3, [1],
+                        ["arithmetic"], ["density"], ["copy"])
+
+
+class EngineTest(unittest.TestCase):
+    """
+    The blocks of the SQL implementations and of their options, against those of the
+    'copy' implementation with its default options.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = (os.environ.get("DBNAME", os.environ["USER"]),
+                os.environ.get("USERNAME", os.environ["USER"]),
+                os.environ.get("PORT", "5432"))
+        try:
+            psycopg2.connect(database_dsn(*cls.db)).close()
+        except psycopg2.OperationalError as e:
+            raise unittest.SkipTest("the database cannot be connected to: %s" % e)
+
+        ## a tensor with 3 planted blocks, with a few entries appearing several times
+        cls.outdir = tempfile.mkdtemp()
+        cls.file_name = os.path.join(cls.outdir, "tensor.csv")
+        rand = random.Random(0)
+        with open(cls.file_name, mode="wt") as fout:
+            for i in range(2000):
+                fout.write("a%d,b%d,c%d,%d\n" % (rand.randrange(60), rand.randrange(50),
+                                                rand.randrange(40), rand.randrange(1, 5)))
+            for (k, size) in enumerate([8, 6, 4]):
+                for i in range(300):
+                    fout.write("a%d,b%d,c%d,%d\n" % (10*k + rand.randrange(size),
+                            10*k + rand.randrange(size), 10*k + rand.randrange(size), 3))
+        ## the blocks of the 'copy' implementation, for each dmeasure and policy
+        cls.expected = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.outdir)
+
+    def run_dcube(self, name, dmeasure, policy, file_name=None, **options):
+        """
+        Run D-CUBE on the tensor, or on file_name, in the schema dcube_test unless another
+        one is given, and return its output directory, which a resumed run shares.
+        """
+        outdir = os.path.join(self.outdir, "%s_%s_%s" % (name, dmeasure, policy))
+        if not os.path.isdir(outdir):
+            os.mkdir(outdir)
+        options.setdefault("schema", "dcube_test")
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            dcube_custom(self.db[0], self.db[1], self.db[2], file_name or self.file_name,
+                        3, 3, dmeasure=dmeasure, policy=policy, outdir=outdir, **options)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        return outdir
+
+    def run_blocks(self, name, dmeasure, policy, **options):
+        """
+        The sorted rows of the blocks of a run; there are less than 3 if no mass is left.
+        """
+        outdir = self.run_dcube(name, dmeasure, policy, **options)
+        return [read_rows(block) for block in
+                sorted(glob.glob(os.path.join(outdir, "*_block*.csv")))]
+
+    def expected_blocks(self, dmeasure, policy):
+        """
+        The blocks of the 'copy' implementation with its default options.
+        """
+        if (dmeasure, policy) not in self.expected:
+            self.expected[(dmeasure, policy)] = self.run_blocks("copy", dmeasure, policy)
+        return self.expected[(dmeasure, policy)]
+
+    def check_same(self, name, **options):
+        for dmeasure in ["arithmetic", "geometric", "suspicious"]:
+            for policy in ["density", "cardinality"]:
+                self.assertEqual(self.run_blocks(name, dmeasure, policy, **options),
+                                self.expected_blocks(dmeasure, policy),
+                                "%s %s %s" % (name, dmeasure, policy))
+
+    def append_blocks(self, name, **options):
+        """
+        The blocks after appending the odd and then the even lines of the tensor, in the
+        schema dcube_test_<name>, as the mass of each entry (see sum_entries).
+        """
+        with open(self.file_name, mode="rt") as fin:
+            lines = fin.readlines()
+        schema = "dcube_test_" + name
+        try:
+            for i in range(2):
+                part = os.path.join(self.outdir, "%s_part%d.csv" % (name, i+1))
+                with open(part, mode="wt") as fout:
+                    fout.writelines(lines[i::2])
+                blocks = self.run_blocks("%s%d" % (name, i+1), "arithmetic", "density",
+                                        file_name=part, append=True, schema=schema,
+                                        **options)
+        finally:
+            with psycopg2.connect(database_dsn(*self.db)) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DROP SCHEMA IF EXISTS %s CASCADE;" % schema)
+            conn.close()
+        return [sum_entries(rows) for rows in blocks]
+
+    def test_parallel_loader(self):
+        with open(self.file_name, mode="rb") as fin:
+            expected = parse_data((fin.read(), ",", 3, False, 1))[0]
+        gz_file = os.path.join(self.outdir, "tensor.csv.gz")
+        with open(self.file_name, mode="rb") as fin:
+            with gzip.open(gz_file, mode="wb") as fout:
+                fout.write(fin.read())
+        DSN = database_dsn(*self.db)
+        with psycopg2.connect(DSN) as conn:
+            with conn.cursor() as cur:
+                for (file_name, workers, chunk_size) in [(self.file_name, 1, 1000),
+                        (self.file_name, 3, 1000), (gz_file, 2, 5000)]:
+                    cur.execute("DROP TABLE IF EXISTS loaded;")
+                    n_entries = load_tensor_file(DSN, cur, file_name, "loaded", COL_NAMES,
+                                            "measure", workers=workers, chunk_size=chunk_size)
+                    cur.execute("SELECT D0, D1, D2, measure FROM loaded;")
+                    self.assertEqual(dict([(tuple(row[:3]), row[3]) for row in
+                                        cur.fetchall()]), expected)
+                    self.assertEqual(n_entries, len(expected))
+                cur.execute("DROP TABLE loaded;")
+        conn.close()
+
+    def test_batch(self):
+        self.check_same("batch", rm_batch=True)
+
+    def test_delta_Bmass(self):
+        self.check_same("delta", delta_Bmass=True)
+
+    def test_grouping_sets(self):
+        self.check_same("grouping", grouping_sets=True)
+
+    def test_encode_values(self):
+        self.check_same("encode", encode_values=True)
+
+    def test_mark(self):
+        self.check_same("mark", opt="mark")
+
+    def test_plpgsql(self):
+        self.check_same("plpgsql", opt="plpgsql")
+
+    def test_numpy(self):
+        self.check_same("numpy", opt="numpy")
+
+    def test_iter_dense_blocks(self):
+        expected = [sum_entries(rows) for rows in self.expected_blocks("arithmetic",
+                                                                        "density")]
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        with psycopg2.connect(database_dsn(*self.db)) as conn:
+            with conn.cursor() as cur:
+                reset_schema(cur, "dcube_test_iter")
+                cur.execute("CREATE TABLE tensor (%s, measure double precision);" % 
+                            ",".join([name + " varchar" for name in COL_NAMES]))
+                with open(self.file_name, mode="rt") as fin:
+                    cur.copy_from(fin, "tensor", sep=",")
+                try:
+                    for opt in ["copy", "mark", "plpgsql"]:
+                        blocks = [sum_entries(block.tuples()) for block in
+                                iter_dense_blocks("tensor", COL_NAMES, "measure", 3, 3, cur,
+                                                policy="density", opt=opt)]
+                        self.assertEqual(blocks, expected, opt)
+                        ## closed after the first block, the working tables are dropped
+                        blocks = iter_dense_blocks("tensor", COL_NAMES, "measure", 3, 3, cur,
+                                                policy="density", opt=opt)
+                        self.assertEqual(sum_entries(next(blocks).tuples()), expected[0])
+                        blocks.close()
+                        cur.execute("SELECT tablename FROM pg_tables " + 
+                                    "WHERE schemaname='dcube_test_iter';")
+                        self.assertEqual(cur.fetchall(), [("tensor",)], opt)
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                    cur.execute("DROP SCHEMA dcube_test_iter CASCADE;")
+        conn.close()
+
+    def test_resume(self):
+        expected = self.expected_blocks("arithmetic", "density")
+        for opt in ["copy", "mark", "plpgsql"]:
+            ## the run is interrupted once the checkpoint after the 2nd block is committed
+            module = sys.modules["dcube_sql_" + opt]
+            save_checkpoint = module.save_checkpoint
+            def interrupt(cur, k, *args):
+                save_checkpoint(cur, k, *args)
+                if k == 1:
+                    raise Interrupted()
+            module.save_checkpoint = interrupt
+            try:
+                self.assertRaises(Interrupted, self.run_dcube, "resume_" + opt, "arithmetic",
+                                "density", opt=opt, resume=True)
+            finally:
+                module.save_checkpoint = save_checkpoint
+            outdir = os.path.join(self.outdir, "resume_%s_arithmetic_density" % opt)
+            done = sorted(glob.glob(os.path.join(outdir, "tensor_block*.csv")))
+            self.assertEqual([read_rows(block) for block in done], expected[:2], opt)
+            for block in done:
+                os.remove(block)
+
+            ## the same run resumes with the 3rd block, and does not write the others again
+            self.run_dcube("resume_" + opt, "arithmetic", "density", opt=opt, resume=True)
+            self.assertEqual([read_rows(block) for block in
+                            glob.glob(os.path.join(outdir, "tensor_block*.csv"))],
+                            expected[2:], opt)
+            with open(os.path.join(outdir, "tensor_manifest.json"), mode="rt") as fin:
+                self.assertEqual([block["entries"] for block in json.load(fin)["blocks"]],
+                                [len(rows) for rows in expected], opt)
+
+    def catalog_entry(self, name):
+        """
+        The entry of the catalog for a tensor, with the time it was last registered.
+        """
+        with psycopg2.connect(database_dsn(*self.db)) as conn:
+            with conn.cursor() as cur:
+                entry = find_tensor(cur, name)
+                cur.execute("SELECT updated FROM %s.tensors WHERE name=%%s;" % CATALOG_SCHEMA,
+                            (name,))
+                entry["updated"] = cur.fetchone()[0]
+        conn.close()
+        return entry
+
+    def test_catalog(self):
+        with open(self.file_name, mode="rt") as fin:
+            rows = [tuple(row) for row in csv.reader(fin)]
+        expected = [sum_entries(block) for block in self.expected_blocks("arithmetic",
+                                                                        "density")]
+        half = os.path.join(self.outdir, "half.csv")
+        with open(half, mode="wt") as fout:
+            csv.writer(fout, lineterminator="\n").writerows(rows[::2])
+        name = "dcube_test_tensor"
+        try:
+            ## the tensor is loaded once, with its content hash and its totals
+            blocks = self.run_blocks("catalog1", "arithmetic", "density", catalog=name)
+            self.assertEqual([sum_entries(block) for block in blocks], expected)
+            entry = self.catalog_entry(name)
+            self.assertEqual(entry["file_hash"], file_hash(self.file_name))
+            self.assertEqual(entry["entries"], len(sum_entries(rows)))
+            self.assertEqual(entry["total_mass"], sum([float(row[3]) for row in rows]))
+            ## then reused, for the same file or without a file
+            for (i, file_name) in [(2, self.file_name), (3, None)]:
+                blocks = self.run_blocks("catalog%d" % i, "arithmetic", "density",
+                                        catalog=name, file_name=file_name)
+                self.assertEqual([sum_entries(block) for block in blocks], expected)
+                self.assertEqual(self.catalog_entry(name), entry)
+            ## and loaded again from a changed file
+            self.run_blocks("catalog4", "arithmetic", "density", catalog=name,
+                            file_name=half)
+            changed = self.catalog_entry(name)
+            self.assertEqual(changed["file_hash"], file_hash(half))
+            self.assertEqual(changed["entries"], len(sum_entries(rows[::2])))
+        finally:
+            with psycopg2.connect(database_dsn(*self.db)) as conn:
+                with conn.cursor() as cur:
+                    drop_tensor(cur, name, 3)
+            conn.close()
+
+    def test_summary(self):
+        expected = self.expected_blocks("arithmetic", "density")
+        summaries = []
+        for opt in ["copy", "mark", "plpgsql"]:
+            outdir = self.run_dcube("summary_" + opt, "arithmetic", "density", opt=opt,
+                                    output="summary")
+            self.assertEqual(glob.glob(os.path.join(outdir, "tensor_block?.csv")), [])
+            with open(os.path.join(outdir, "tensor_summary.csv"), mode="rt") as fin:
+                summary = list(csv.reader(fin))[1:]
+            self.assertEqual(len(summary), len(expected), opt)
+            blocks = []
+            for (k, rows) in enumerate(expected):
+                with open(os.path.join(outdir, "tensor_block%d_values.csv" % (k+1)),
+                        mode="rt") as fin:
+                    values = sorted([(int(n), value) for (n, value) in csv.reader(fin)])
+                ## the values of the entries of the block, which is not built
+                self.assertEqual(values, sorted(set([(n, row[n]) for row in rows
+                                                    for n in range(3)])), opt)
+                blocks.append(values)
+            ## the first block is found in the whole tensor
+            self.assertEqual(int(summary[0][1]), len(expected[0]), opt)
+            self.assertAlmostEqual(float(summary[0][2]),
+                                    sum([float(row[3]) for row in expected[0]]))
+            summaries.append((blocks, [[round(float(x), 6) for x in row] for row in summary]))
+        self.assertEqual(summaries[1], summaries[0])
+        self.assertEqual(summaries[2], summaries[0])
+
+    def timed_rows(self):
+        """
+        The rows of the tensor with the number of the third value as its time, from 0
+        to 39, written to timed.csv.
+        """
+        with open(self.file_name, mode="rt") as fin:
+            rows = [row[:2] + [row[2][1:], row[3]] for row in csv.reader(fin)]
+        timed = os.path.join(self.outdir, "timed.csv")
+        with open(timed, mode="wt") as fout:
+            csv.writer(fout, lineterminator="\n").writerows(rows)
+        return (timed, rows)
+
+    def test_window(self):
+        ## the blocks of each window against those of the entries of the window alone
+        (timed, rows) = self.timed_rows()
+        outdir = self.run_dcube("window", "arithmetic", "density", file_name=timed,
+                                window=20, slide=10, time_dim=2)
+        for (i, start) in enumerate(range(0, 40, 10)):
+            window_file = os.path.join(self.outdir, "timed_w%d.csv" % (i+1))
+            with open(window_file, mode="wt") as fout:
+                csv.writer(fout, lineterminator="\n").writerows([row for row in rows
+                                                if start <= int(row[2]) < start + 20])
+            self.assertEqual([read_rows(block) for block in sorted(glob.glob(
+                                os.path.join(outdir, "timed_w%d_block*.csv" % (i+1))))],
+                            self.run_blocks("window%d" % (i+1), "arithmetic", "density",
+                                            file_name=window_file),
+                            "window %d" % (i+1))
+
+    def test_update_window(self):
+        ## the distinct values and the total mass kept along the slides, against
+        ## those of the entries of each window
+        (timed, rows) = self.timed_rows()
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        with psycopg2.connect(database_dsn(*self.db)) as conn:
+            with conn.cursor() as cur:
+                reset_schema(cur, "dcube_test_window")
+                cur.execute("CREATE TABLE tensor (%s, measure double precision);" % 
+                            ",".join([name + " varchar" for name in COL_NAMES]))
+                with open(timed, mode="rt") as fin:
+                    cur.copy_from(fin, "tensor", sep=",")
+                try:
+                    n_windows = 0
+                    for (i, win) in iter_windows("tensor", COL_NAMES, "measure", cur,
+                                                2, 20, 7):
+                        entries = [row for row in rows if 7*i <= int(row[2]) < 7*i + 20]
+                        cur.execute("SELECT %s, measure FROM %s;" % (",".join(COL_NAMES), win))
+                        self.assertEqual(sorted(cur.fetchall()), sorted([tuple(row[:3]) +
+                                                (float(row[3]),) for row in entries]))
+                        for n in range(3):
+                            cur.execute("SELECT value, n, mass FROM %s_R%d;" % (win, n))
+                            values = {}
+                            for row in entries:
+                                (count, mass) = values.get(row[n], (0, 0.0))
+                                values[row[n]] = (count + 1, mass + float(row[3]))
+                            self.assertEqual(sorted(cur.fetchall()), sorted([(value,) + 
+                                                values[value] for value in values]))
+                        cur.execute("SELECT par, value FROM %s_stats;" % win)
+                        self.assertEqual(dict(cur.fetchall()), {"entries": len(entries),
+                                        "total_mass": sum([float(row[3]) for row in entries])})
+                        n_windows += 1
+                    self.assertEqual(n_windows, 6)
+                    ## the relations of the window are dropped in the end
+                    cur.execute("SELECT tablename FROM pg_tables " + 
+                                "WHERE schemaname='dcube_test_window';")
+                    self.assertEqual(cur.fetchall(), [("tensor",)])
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                    cur.execute("DROP SCHEMA dcube_test_window CASCADE;")
+        conn.close()
+
+    def test_pg_profile(self):
+        ## the explained statements are rolled back, so the blocks are the same
+        self.assertEqual(self.run_blocks("profile", "arithmetic", "density", pg_profile=True),
+                        self.expected_blocks("arithmetic", "density"))
+        with open(os.path.join(self.outdir, "profile_arithmetic_density",
+                                "tensor_pg_profile.json"), mode="rt") as fin:
+            profile = json.load(fin)
+        shapes = [entry["shape"] for entry in profile["plans"]]
+        self.assertEqual(len(shapes), len(set(shapes)))
+        self.assertEqual([entry for entry in profile["plans"] if "error" in entry], [])
+        self.assertTrue(any(["Seq Scan" in json.dumps(entry["plan"])
+                            for entry in profile["plans"]]))
+        ## nor are they counted in the statistics of the tables
+        inserted = [record["tables"]["block0"]["n_tup_ins"] for record in profile["phases"]
+                    if "block0" in record.get("tables", {})]
+        self.assertEqual(sum(inserted), len(self.expected_blocks("arithmetic", "density")[0]))
+
+    def test_append(self):
+        expected = [sum_entries(rows) for rows in self.expected_blocks("arithmetic",
+                                                                        "density")]
+        self.assertEqual(self.append_blocks("append"), expected)
+        self.assertEqual(self.append_blocks("append_mark", opt="mark"), expected)
+
+    def test_warm_start(self):
+        ## the planted blocks are found again among the candidate entries
+        self.assertEqual(self.append_blocks("warm", warm_start=True),
+                        [sum_entries(rows) for rows in self.expected_blocks("arithmetic",
+                                                                            "density")])
+
+    def read_manifest(self, outdir, out_format):
+        """
+        The rows and the mass of each block listed in the manifest of a run, checked
+        against the files.
+        """
+        with open(os.path.join(outdir, "tensor_manifest.json"), mode="rt") as fin:
+            manifest = json.load(fin)
+        self.assertEqual(manifest["format"], out_format)
+        self.assertEqual(manifest["columns"], COL_NAMES + ["measure"])
+        blocks = []
+        for (k, block) in enumerate(manifest["blocks"]):
+            self.assertEqual(block["block"], k+1)
+            rows = read_block(os.path.join(outdir, block["file"]))
+            self.assertEqual(block["entries"], len(rows))
+            ## the mass is without the entries of earlier blocks
+            self.assertTrue(block["mass"] <= sum([row[-1] for row in rows]) + 1e-6)
+            if k == 0:
+                self.assertAlmostEqual(block["mass"], sum([row[-1] for row in rows]))
+            blocks.append((rows, round(block["mass"], 6)))
+        return blocks
+
+    def test_out_format(self):
+        expected = self.read_manifest(self.run_dcube("format", "arithmetic", "density"), "csv")
+        self.assertEqual(len(expected), 3)
+        formats = ["csv", "csv.gz", "binary", "columnar"]
+        try:
+            import zstandard
+            formats.append("csv.zst")
+        except ImportError:
+            pass
+        for opt in ["copy", "mark", "plpgsql", "numpy"]:
+            for out_format in formats:
+                if opt == "numpy" and out_format == "binary":
+                    continue
+                outdir = self.run_dcube("format_%s_%s" % (opt, out_format.replace(".", "_")),
+                                "arithmetic", "density", opt=opt, out_format=out_format)
+                self.assertEqual(self.read_manifest(outdir, out_format), expected,
+                                "%s %s" % (opt, out_format))
+
+
+if __name__ == "__main__":
+    unittest.main()